@@ -1,7 +1,23 @@
 __all__ = [
-            'configfile' 
+            'calibrate',
+            'capture',
+            'configfile',
             'hardware',
             'genesis',
             'sms',
-            'snes'
+            'snes',
+            'archive',
+            'romimage',
+            'pipeline',
+            'receive',
+            'devicepool',
+            'script',
+            'jobs',
+            'compare',
+            'consensus',
+            'tg16',
+            'fingerprint',
+            'emulator',
+            'server',
+            'detect'
 ]
\ No newline at end of file
@@ -0,0 +1,367 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  archive.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import os
+import bisect
+import hashlib
+import struct
+import zlib
+from collections import OrderedDict
+
+# gear table for the rolling hash, derived from md5 so every store cuts identical chunks
+GEAR = [int.from_bytes(hashlib.md5(bytes([i])).digest()[:4], byteorder="little") for i in range(256)]
+
+# the hash of a byte only depends on the 32 bytes ending with it: the sum of their gear values shifted by their
+# distance, modulo 2^32. It is computed for a whole span at once with big integers so the work runs in C: every
+# byte gets a LANE byte lane holding its gear value, the lanes are summed with their neighbours shifted by one lane
+# and one bit, then the bits under the mask are picked from each lane with translate tables. A lane holds the 68 bit
+# sum before the modulo.
+LANE = 9
+GEAR_BYTES = [bytes((value >> (8 * byte)) & 0xFF for value in GEAR) for byte in range(4)]
+# bytes hashed per pass, a boundary found early leaves the rest of the pass unused
+SCAN_SIZE = 8192
+
+# manifest layout
+#   header : magic (4 bytes), version (uint16), rom size (uint64), md5 (16 bytes), chunk count (uint32)
+#   entry  : chunk length (uint32), sha1 of the chunk (20 bytes)
+MANIFEST_MAGIC = b"UMDA"
+MANIFEST_VERSION = 1
+MANIFEST_HEADER = struct.Struct("<4sHQ16sI")
+MANIFEST_ENTRY = struct.Struct("<I20s")
+
+
+## Chunker
+#
+#  Content-defined chunking with a gear rolling hash, boundaries only depend on the bytes around them so shared
+#  regions of two ROMs produce the same chunks even when their offsets differ
+class Chunker:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param min_size no boundary is looked for in the first min_size bytes of a chunk
+    #  \param avg_bits the average chunk size is 2^avg_bits
+    #  \param max_size a chunk is cut here when no boundary was found
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, min_size=2048, avg_bits=13, max_size=65536):
+        self.min_size = min_size
+        self.max_size = max_size
+        # test the top bits, they depend on the last 32 bytes where the low bits only see the last few
+        self.mask = ((1 << avg_bits) - 1) << (32 - avg_bits)
+        # (byte of the lane, table mapping it to 1 when a masked bit is set) for the bytes the mask covers
+        self.tests = [(byte, bytes(int(value & (self.mask >> (8 * byte)) != 0) for value in range(256)))
+                      for byte in range(4) if (self.mask >> (8 * byte)) & 0xFF]
+        self.buffer = bytearray()
+        # first byte of the chunk at the front of the buffer not tested yet, each byte is tested once however the
+        # data is fed
+        self.position = 0
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  cut
+    #
+    #  return the length of the next chunk in the buffer, or 0 if more data is needed to find it. The scan goes on
+    #  where the previous call stopped.
+    # ------------------------------------------------------------------------------------------------------------------
+    def cut(self, final=False):
+        length = len(self.buffer)
+        if length <= self.min_size:
+            return length if final else 0
+        end = min(length, self.max_size)
+        for start in range(max(self.position, self.min_size), end, SCAN_SIZE):
+            boundary = self.scan(start, min(start + SCAN_SIZE, end))
+            if boundary >= 0:
+                self.position = 0
+                return boundary + 1
+        if end == self.max_size or final:
+            self.position = 0
+            return end
+        self.position = end
+        return 0
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  scan
+    #  \param start first byte of the buffer tested
+    #  \param stop end of the bytes tested
+    #
+    #  return the position of the first byte in [start, stop) whose hash has no bit under the mask, or -1. The hash
+    #  starts at min_size, the bytes before it do not count.
+    # ------------------------------------------------------------------------------------------------------------------
+    def scan(self, start, stop):
+        first = max(start - 31, self.min_size)
+        data = bytes(self.buffer[first:stop])
+        size = len(data)
+        lanes = bytearray(size * LANE)
+        for byte, table in enumerate(GEAR_BYTES):
+            lanes[byte::LANE] = data.translate(table)
+        total = int.from_bytes(lanes, byteorder="little")
+        # add the lanes 1, 2, 4, 8 and 16 positions back, 32 terms in all
+        span = 1
+        while span < 32:
+            total += total << ((8 * LANE + 1) * span)
+            span *= 2
+        hashes = total.to_bytes((size + 32) * LANE, byteorder="little")
+        flags = 0
+        for byte, table in self.tests:
+            flags += int.from_bytes(hashes[byte:size * LANE:LANE].translate(table), byteorder="little")
+        position = flags.to_bytes(size, byteorder="little").find(0, start - first)
+        return first + position if position >= 0 else -1
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  feed
+    #  \param data bytes like
+    #
+    #  add data and yield every chunk which is now complete
+    # ------------------------------------------------------------------------------------------------------------------
+    def feed(self, data):
+        self.buffer += data
+        while True:
+            length = self.cut()
+            if length == 0:
+                return
+            chunk = bytes(self.buffer[:length])
+            del self.buffer[:length]
+            yield chunk
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  flush
+    #
+    #  yield the remaining chunks once the input is complete
+    # ------------------------------------------------------------------------------------------------------------------
+    def flush(self):
+        while self.buffer:
+            length = self.cut(final=True)
+            chunk = bytes(self.buffer[:length])
+            del self.buffer[:length]
+            yield chunk
+
+
+## Archive Store
+#
+#  A directory of deduplicated zlib compressed chunks shared by all ROMs, plus one manifest per ROM
+#      store/chunks/ab/ab01...ef  compressed chunk named by the sha1 of its uncompressed content
+#      store/roms/name.umda       list of chunks making up the ROM
+class ArchiveStore:
+
+    # zlib level 1 is the fastest codec in the standard library and still packs padding and code well
+    compression = 1
+    cache_size = 64
+
+    def __init__(self, path):
+        self.path = path
+        self.cache = OrderedDict()
+        os.makedirs(os.path.join(path, "chunks"), exist_ok=True)
+        os.makedirs(os.path.join(path, "roms"), exist_ok=True)
+
+    def chunk_path(self, digest):
+        name = digest.hex()
+        return os.path.join(self.path, "chunks", name[:2], name)
+
+    def manifest_path(self, name):
+        return os.path.join(self.path, "roms", name + ".umda")
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  put_chunk
+    #
+    #  store a chunk unless an identical one is already present, return its digest and the bytes actually written
+    # ------------------------------------------------------------------------------------------------------------------
+    def put_chunk(self, chunk):
+        digest = hashlib.sha1(chunk).digest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        packed = zlib.compress(chunk, self.compression)
+        # write then rename so an interrupted ingest never leaves a truncated chunk behind
+        with open(path + ".tmp", "wb") as f:
+            f.write(packed)
+        os.replace(path + ".tmp", path)
+        return digest, len(packed)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  get_chunk
+    #
+    #  return the uncompressed chunk, recently used chunks are kept in a small cache for sequential reads
+    # ------------------------------------------------------------------------------------------------------------------
+    def get_chunk(self, digest):
+        if digest in self.cache:
+            self.cache.move_to_end(digest)
+            return self.cache[digest]
+        with open(self.chunk_path(digest), "rb") as f:
+            chunk = zlib.decompress(f.read())
+        self.cache[digest] = chunk
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return chunk
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  ingest
+    #  \param name the name the ROM is stored under
+    #
+    #  return an ArchiveWriter, data can be written to it as it comes off the dumper
+    # ------------------------------------------------------------------------------------------------------------------
+    def ingest(self, name):
+        return ArchiveWriter(self, name)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  add_file
+    #
+    #  ingest an existing ROM file
+    # ------------------------------------------------------------------------------------------------------------------
+    def add_file(self, name, filename):
+        with self.ingest(name) as writer:
+            with open(filename, "rb") as f:
+                for block in iter(lambda: f.read(65536), b""):
+                    writer.write(block)
+        return writer
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  open
+    #
+    #  return an ArchiveRom for random access reads
+    # ------------------------------------------------------------------------------------------------------------------
+    def open(self, name):
+        return ArchiveRom(self, name)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  names
+    #
+    #  list the ROMs in the store
+    # ------------------------------------------------------------------------------------------------------------------
+    def names(self):
+        return sorted(f[:-5] for f in os.listdir(os.path.join(self.path, "roms")) if f.endswith(".umda"))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  stats
+    #
+    #  return (logical bytes of all ROMs, bytes used by the chunks on disk)
+    # ------------------------------------------------------------------------------------------------------------------
+    def stats(self):
+        logical = sum(self.open(name).size for name in self.names())
+        stored = 0
+        for root, dirs, files in os.walk(os.path.join(self.path, "chunks")):
+            stored += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        return logical, stored
+
+
+## Archive Writer
+#
+#  Streams data into the store, chunks are hashed, deduplicated and compressed as soon as they are cut
+class ArchiveWriter:
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.chunker = Chunker()
+        self.md5 = hashlib.md5()
+        self.entries = []
+        self.size = 0
+        self.stored = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # an aborted dump must not leave a manifest pointing at a partial ROM
+        if exc_type is None:
+            self.close()
+
+    def add(self, chunk):
+        digest, written = self.store.put_chunk(chunk)
+        self.entries.append((len(chunk), digest))
+        self.stored += written
+
+    def write(self, data):
+        self.md5.update(data)
+        self.size += len(data)
+        for chunk in self.chunker.feed(data):
+            self.add(chunk)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  close
+    #
+    #  store the last chunks and write the manifest
+    # ------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        for chunk in self.chunker.flush():
+            self.add(chunk)
+        path = self.store.manifest_path(self.name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(MANIFEST_HEADER.pack(MANIFEST_MAGIC, MANIFEST_VERSION, self.size,
+                                         self.md5.digest(), len(self.entries)))
+            for entry in self.entries:
+                f.write(MANIFEST_ENTRY.pack(*entry))
+        os.replace(path + ".tmp", path)
+
+
+## Archive ROM
+#
+#  Random access to a stored ROM, only the chunks covering the requested range are decompressed
+class ArchiveRom:
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        with open(store.manifest_path(name), "rb") as f:
+            magic, version, self.size, self.md5, count = MANIFEST_HEADER.unpack(f.read(MANIFEST_HEADER.size))
+            if magic != MANIFEST_MAGIC or version != MANIFEST_VERSION:
+                raise ValueError("{} is not a UMDv2 archive manifest".format(name))
+            entries = [MANIFEST_ENTRY.unpack(f.read(MANIFEST_ENTRY.size)) for i in range(count)]
+        self.offsets = []
+        self.digests = []
+        pos = 0
+        for length, digest in entries:
+            self.offsets.append(pos)
+            self.digests.append(digest)
+            pos += length
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  read
+    #  \param offset
+    #  \param size
+    #
+    #  return size bytes starting at offset, clipped to the end of the ROM
+    # ------------------------------------------------------------------------------------------------------------------
+    def read(self, offset, size):
+        end = min(offset + size, self.size)
+        data = bytearray()
+        index = bisect.bisect_right(self.offsets, offset) - 1
+        while offset < end and index < len(self.digests):
+            chunk = self.store.get_chunk(self.digests[index])
+            start = offset - self.offsets[index]
+            piece = chunk[start:start + end - offset]
+            data += piece
+            offset += len(piece)
+            index += 1
+        return bytes(data)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  extract
+    #
+    #  write the whole ROM to a file
+    # ------------------------------------------------------------------------------------------------------------------
+    def extract(self, filename):
+        with open(filename, "wb") as f:
+            for digest in self.digests:
+                f.write(self.store.get_chunk(digest))
@@ -0,0 +1,168 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  calibrate.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import time
+import zlib
+from collections import deque
+
+
+## Link Calibrator
+#
+#  Find the fastest reliable baud rate and block size for one UMDv2 and store it per device serial number
+class Calibrator:
+
+    # candidate settings, slowest first so the reference pattern is read on the most reliable link
+    baudrates = [115200, 230400, 460800, 921600]
+    block_sizes = [512, 1024, 2048, 4096, 8192]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param umd a connected UMDv2
+    #  \param address start of the cartridge region used as test pattern
+    #  \param pattern_size bytes read per trial
+    #  \param trials reads per setting
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, umd, address=0, pattern_size=32768, trials=3):
+        self.umd = umd
+        self.address = address
+        self.pattern_size = pattern_size
+        self.trials = trials
+        self.results = []
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  read_pattern
+    #
+    #  read the test pattern in blocks of block_size, return the data and the elapsed time
+    # ------------------------------------------------------------------------------------------------------------------
+    def read_pattern(self, port, block_size):
+        data = bytearray()
+        start = time.perf_counter()
+        for offset in range(0, self.pattern_size, block_size):
+            size = min(block_size, self.pattern_size - offset)
+            data += self.umd.read_block(port, self.address + offset, size)
+        return bytes(data), time.perf_counter() - start
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  calibrate
+    #  \param port the serial port name
+    #
+    #  try every baud rate and block size, return and store the fastest error free (baudrate, block_size)
+    # ------------------------------------------------------------------------------------------------------------------
+    def calibrate(self, port):
+        ser = self.umd.port[port]
+        self.results = []
+
+        # the reference is read twice on the slowest link, the cart itself must be stable to calibrate against it
+        ser.baudrate = self.baudrates[0]
+        reference, elapsed = self.read_pattern(port, self.block_sizes[0])
+        check, elapsed = self.read_pattern(port, self.block_sizes[0])
+        if len(reference) != self.pattern_size or reference != check:
+            print("calibration aborted on {}, test pattern is not stable".format(port))
+            ser.baudrate = self.umd.settings.get(port, (self.umd.baudrate,))[0]
+            return None
+        reference_crc = zlib.crc32(reference)
+
+        for baudrate in self.baudrates:
+            ser.baudrate = baudrate
+            self.umd.reset_input(port)
+            for block_size in self.block_sizes:
+                errors = 0
+                total = 0.0
+                for trial in range(self.trials):
+                    data, elapsed = self.read_pattern(port, block_size)
+                    total += elapsed
+                    if zlib.crc32(data) != reference_crc:
+                        errors += 1
+                        # drain whatever is left of a desynchronized response before the next trial
+                        self.umd.drain(port)
+                throughput = self.pattern_size * self.trials / total if total else 0
+                self.results.append((baudrate, block_size, errors / self.trials, throughput))
+                print("{} baud, {} byte blocks : {:.0%} errors, {:.1f} KB/s".format(
+                    baudrate, block_size, errors / self.trials, throughput / 1024))
+
+        reliable = [r for r in self.results if r[2] == 0]
+        if not reliable:
+            print("calibration failed on {}, no reliable setting found".format(port))
+            return None
+        baudrate, block_size, error_rate, throughput = max(reliable, key=lambda r: r[3])
+        self.umd.save_settings(port, baudrate, block_size)
+        print("{} calibrated to {} baud, {} byte blocks".format(port, baudrate, block_size))
+        return baudrate, block_size
+
+
+## Link Tuner
+#
+#  Track read failures during a long transfer and back off the link settings when they rise, UMDv2.tuned_batch()
+#  keeps one per port for the dump and streaming reads
+class LinkTuner:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param umd a connected UMDv2
+    #  \param port the serial port name
+    #  \param window number of recent reads considered
+    #  \param threshold failure ratio over the window which triggers a back off
+    #  \param retries attempts per block before giving up
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, umd, port, window=32, threshold=0.1, retries=4):
+        self.umd = umd
+        self.port = port
+        self.threshold = threshold
+        self.retries = retries
+        self.history = deque(maxlen=window)
+        self.baudrate, self.block_size = umd.settings.get(port, (umd.baudrate, umd.block_size))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  record
+    #  \param ok False when a block failed its check
+    #
+    #  add a result to the window and back off once the failure ratio exceeds the threshold, return True on back off
+    # ------------------------------------------------------------------------------------------------------------------
+    def record(self, ok):
+        self.history.append(ok)
+        failures = self.history.count(False)
+        if failures < 2 or failures / len(self.history) <= self.threshold:
+            return False
+        return self.back_off()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  back_off
+    #
+    #  halve the block size first, then drop to the next slower baud rate, return False when already at the minimum
+    # ------------------------------------------------------------------------------------------------------------------
+    def back_off(self):
+        slower = [b for b in Calibrator.baudrates if b < self.baudrate]
+        if self.block_size > Calibrator.block_sizes[0]:
+            self.block_size //= 2
+        elif slower:
+            self.baudrate = slower[-1]
+            self.umd.port[self.port].baudrate = self.baudrate
+        else:
+            return False
+        self.history.clear()
+        self.umd.settings[self.port] = (self.baudrate, self.block_size)
+        print("{} backing off to {} baud, {} byte blocks".format(self.port, self.baudrate, self.block_size))
+        return True
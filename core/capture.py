@@ -0,0 +1,274 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  capture.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import struct
+import threading
+import time
+
+# trace file layout
+#   file header : magic (8 bytes) + version (uint16)
+#   record      : kind (uint8), port index (uint16), seconds since start (double), payload length (uint32), payload
+TRACE_MAGIC = b"UMDTRACE"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct("<8sH")
+TRACE_RECORD = struct.Struct("<BHdI")
+
+TRACE_OPEN = 0
+TRACE_WRITE = 1
+TRACE_READ = 2
+TRACE_CLOSE = 3
+
+
+## Capture Recorder
+#
+#  Records the traffic of one or more serial ports into a single binary trace file
+class CaptureRecorder:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #
+    #  open the trace file and write its header
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, path):
+        self.path = path
+        self.ports = []
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.file = open(path, "wb")
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  wrap
+    #  \param name the port name, e.g. /dev/ttyACM0
+    #  \param ser an open serial.Serial object
+    #
+    #  return a CapturePort which records all traffic going through ser
+    # ------------------------------------------------------------------------------------------------------------------
+    def wrap(self, name, ser):
+        index = len(self.ports)
+        self.ports.append(name)
+        self.record(TRACE_OPEN, index, bytes(name, "utf-8"))
+        return CapturePort(self, index, ser)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  record
+    #
+    #  append one timestamped record to the trace, empty reads (timeouts) are kept since they cost time too
+    # ------------------------------------------------------------------------------------------------------------------
+    def record(self, kind, index, payload):
+        stamp = time.perf_counter() - self.start
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(TRACE_RECORD.pack(kind, index, stamp, len(payload)))
+            self.file.write(payload)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  close
+    #
+    #  flush and close the trace file, the wrapped ports keep working but are no longer recorded
+    # ------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+## Capture Port
+#
+#  Drop-in replacement for a serial.Serial object which records every request and response
+class CapturePort:
+
+    def __init__(self, recorder, index, ser):
+        self.recorder = recorder
+        self.index = index
+        self.serial = ser
+
+    def __getattr__(self, name):
+        # anything not recorded (baudrate, timeout, flush...) goes straight to the real port
+        return getattr(self.serial, name)
+
+    def write(self, data):
+        self.recorder.record(TRACE_WRITE, self.index, bytes(data))
+        return self.serial.write(data)
+
+    def read(self, size=1):
+        data = self.serial.read(size)
+        self.recorder.record(TRACE_READ, self.index, data)
+        return data
+
+    def readline(self):
+        data = self.serial.readline()
+        self.recorder.record(TRACE_READ, self.index, data)
+        return data
+
+    def readinto(self, buffer):
+        count = self.serial.readinto(buffer) or 0
+        self.recorder.record(TRACE_READ, self.index, bytes(buffer[:count]))
+        return count
+
+    def close(self):
+        self.recorder.record(TRACE_CLOSE, self.index, b"")
+        self.serial.close()
+
+
+## Trace Replay
+#
+#  Load a trace and expose one ReplayPort per recorded port, keyed by port name like UMDv2.port
+class TraceReplay:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param path the trace file
+    #  \param realtime True to deliver responses at the recorded pace, False to go as fast as possible
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, path, realtime=False):
+        self.path = path
+        self.realtime = realtime
+        self.port = {}
+        self.start = None
+
+        names = []
+        events = []
+        with open(path, "rb") as f:
+            magic, version = TRACE_HEADER.unpack(f.read(TRACE_HEADER.size))
+            if magic != TRACE_MAGIC or version != TRACE_VERSION:
+                raise ValueError("{} is not a UMDv2 trace file".format(path))
+            while True:
+                data = f.read(TRACE_RECORD.size)
+                if len(data) < TRACE_RECORD.size:
+                    break
+                kind, index, stamp, length = TRACE_RECORD.unpack(data)
+                payload = f.read(length)
+                if kind == TRACE_OPEN:
+                    names.append(payload.decode("utf-8"))
+                    events.append([])
+                elif kind in (TRACE_WRITE, TRACE_READ):
+                    events[index].append((kind, stamp, payload))
+
+        for name, port_events in zip(names, events):
+            self.port[name] = ReplayPort(self, name, port_events)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  wait_until
+    #
+    #  in realtime mode, sleep until the recorded timestamp is reached relative to the first replayed event
+    # ------------------------------------------------------------------------------------------------------------------
+    def wait_until(self, stamp):
+        if not self.realtime:
+            return
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now - stamp
+        delay = self.start + stamp - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+## Replay Port
+#
+#  Serial-like object answering reads from a recorded trace, writes are checked against the recording
+class ReplayPort:
+
+    def __init__(self, replay, name, events):
+        self.replay = replay
+        self.name = name
+        self.port = name
+        self.writes = [e for e in events if e[0] == TRACE_WRITE]
+        self.reads = [e for e in events if e[0] == TRACE_READ]
+        self.write_index = 0
+        self.read_index = 0
+        self.pending = bytearray()
+        self.mismatches = 0
+        self.is_open = True
+        self.timeout = None
+        self.baudrate = None
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  write
+    #
+    #  compare against the next recorded request, a mismatch means the code under test diverged from the session
+    # ------------------------------------------------------------------------------------------------------------------
+    def write(self, data):
+        if self.write_index < len(self.writes):
+            kind, stamp, expected = self.writes[self.write_index]
+            self.write_index += 1
+            if bytes(data) != expected:
+                self.mismatches += 1
+                print("replay {}: expected {!r}, got {!r}".format(self.name, expected, bytes(data)))
+        else:
+            self.mismatches += 1
+        return len(data)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  next_response
+    #
+    #  move the next recorded response into the pending buffer, return False once the trace is exhausted
+    # ------------------------------------------------------------------------------------------------------------------
+    def next_response(self):
+        if self.read_index >= len(self.reads):
+            return False
+        kind, stamp, payload = self.reads[self.read_index]
+        self.read_index += 1
+        self.replay.wait_until(stamp)
+        self.pending += payload
+        return True
+
+    def read(self, size=1):
+        while len(self.pending) < size:
+            if not self.next_response():
+                break
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+    def readline(self):
+        while b"\n" not in self.pending:
+            if not self.next_response():
+                break
+        end = self.pending.find(b"\n") + 1 or len(self.pending)
+        data = bytes(self.pending[:end])
+        del self.pending[:end]
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.pending)
+
+    def reset_input_buffer(self):
+        self.pending.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
@@ -25,8 +25,11 @@
 ########################################################################
 
 # https://docs.python.org/3/library/configparser.html
+import os
 import hashlib
 
+from core.romimage import RomImage
+
 
 #  Cartridge
 #
@@ -35,6 +38,7 @@ class Cartridge:
 
     md5_hex_str = None
     md5_bytes = None
+    rom_image = None
 
     # ------------------------------------------------------------------------------------------------------------------
     #  __init__
@@ -52,18 +56,79 @@ class Cartridge:
     # ------------------------------------------------------------------------------------------------------------------
     def md5(self):
         if self.path is not None:
-            hash_md5 = hashlib.md5()
-            with open(self.path, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
             # packed bytes
-            self.md5_bytes = hash_md5.digest()
+            self.md5_bytes = self.digest("md5")
             # hex string
-            self.md5_hex_str = hash_md5.hexdigest()
-            return hash_md5.digest()
+            self.md5_hex_str = self.md5_bytes.hex()
+            return self.md5_bytes
+        else:
+            print("No file path specified for source file")
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  digest
+    #  \param name any hashlib algorithm name, e.g. "md5" or "sha1"
+    #
+    #  calculate a digest of the ROM, cached by the ROM image until the file changes
+    # ------------------------------------------------------------------------------------------------------------------
+    def digest(self, name):
+        image = self.image()
+        return image.cached("digest." + name, lambda: hashlib.new(name, image.view()).digest())
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  image
+    #
+    #  return the RomImage of this cartridge, path may be a file name, a RomImage or a dump held in memory
+    # ------------------------------------------------------------------------------------------------------------------
+    def image(self):
+        if self.rom_image is None:
+            self.rom_image = RomImage.load(self.path)
+        return self.rom_image
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  archive
+    #  \param store an ArchiveStore
+    #  \param name defaults to the ROM file name
+    #
+    #  add the ROM to a deduplicated dump archive
+    # ------------------------------------------------------------------------------------------------------------------
+    def archive(self, store, name=None):
+        if self.path is not None:
+            image = self.image()
+            if name is None:
+                name = os.path.basename(image.path or "memory")
+            with store.ingest(name) as writer:
+                writer.write(image.view())
+            self.md5_bytes = writer.md5.digest()
+            self.md5_hex_str = writer.md5.hexdigest()
+            return name
         else:
             print("No file path specified for source file")
 
+    # ------------------------------------------------------------------------------------------------------------------
+    #  from_archive
+    #  \param store an ArchiveStore
+    #  \param name the name the ROM was stored under
+    #  \param path where to extract it
+    #
+    #  extract a ROM from a dump archive and return a Cartridge for it
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def from_archive(store, name, path):
+        store.open(name).extract(path)
+        return Cartridge(path)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  compare
+    #  \param others other dumps of the same cart, Cartridge objects or file names
+    #  \param options bus_width, bank_size and buckets, see compare_dumps
+    #
+    #  compare this dump bit by bit with other dumps and return a CompareReport
+    # ------------------------------------------------------------------------------------------------------------------
+    def compare(self, *others, **options):
+        # compare builds on this class, import it here to avoid a cycle
+        from core.compare import compare_dumps
+        return compare_dumps([self] + list(others), **options)
+
     # ------------------------------------------------------------------------------------------------------------------
     #  apply_ips
     #
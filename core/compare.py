@@ -0,0 +1,259 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  compare.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import itertools
+import re
+
+from core.cartridge import Cartridge
+
+# whole images are turned into big integers so XOR, AND and popcount run in C over megabytes at a time, the only
+# per byte Python work is on a bounded sample of error offsets
+
+# maps every non zero byte to 1, turns an XOR image into an error map whose popcount is the number of bad bytes
+ERROR_MAP = bytes([0] + [1] * 255)
+
+NONZERO = re.compile(b"[^\x00]")
+
+# bus width and mapper bank size of every console, bank boundaries are where bank switching faults show up
+CONSOLE_BUS = {
+    "genesis": (16, 0x80000),
+    "sms": (8, 0x4000),
+    "snes": (8, 0x8000),
+    "tg16": (8, 0x2000),
+}
+
+# fraction of the errors a single line must explain before it is blamed
+DOMINANT = 0.9
+# bytes either side of a bank boundary counted as a boundary error
+BOUNDARY_EDGE = 64
+# error offsets checked one by one when testing an address line
+SAMPLE_SIZE = 4096
+
+
+## Compare Report
+#
+#  Result of a comparison, attributes hold the raw statistics and format() renders them for the GUI or the CLI
+class CompareReport:
+
+    def __init__(self):
+        self.names = []
+        self.sizes = []
+        self.size = 0
+        self.reference = 0
+        self.bus_width = 8
+        self.bank_size = 0
+        # {dump index: bad bytes against the reference}
+        self.errors = {}
+        # bytes where at least one dump disagrees with the reference
+        self.error_bytes = 0
+        # {data line: flipped bits}, {data line: (bits read as 0, bits read as 1)}
+        self.data_lines = {}
+        self.data_values = {}
+        # {address line: share of the bad bytes with that address bit set}
+        self.address_lines = {}
+        # [(start offset, bad bytes)]
+        self.histogram = []
+        self.boundary_errors = 0
+        self.causes = []
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  format
+    #
+    #  return the report as text
+    # ------------------------------------------------------------------------------------------------------------------
+    def format(self):
+        lines = ["compared {} dumps of {} bytes, reference {}".format(len(self.names), self.size,
+                                                                      self.names[self.reference])]
+        for index, name in enumerate(self.names):
+            if index != self.reference:
+                lines.append("  {} : {} bad bytes".format(name, self.errors[index]))
+        if len(set(self.sizes)) > 1:
+            lines.append("  sizes differ: {}".format(", ".join(str(size) for size in self.sizes)))
+        if self.error_bytes == 0:
+            lines.append("all dumps agree")
+            return "\n".join(lines) + "\n"
+
+        lines.append("{} bytes disagree".format(self.error_bytes))
+        lines.append("data lines (flips, read as 0/1):")
+        for line, flips in sorted(self.data_lines.items()):
+            if flips:
+                lines.append("  D{:<2} {:8} {}/{}".format(line, flips, *self.data_values[line]))
+        lines.append("address lines (share of bad bytes with the line high):")
+        for line, share in sorted(self.address_lines.items()):
+            lines.append("  A{:<2} {:6.1%}".format(line, share))
+        lines.append("error positions:")
+        peak = max(count for start, count in self.histogram) or 1
+        for start, count in self.histogram:
+            if count:
+                lines.append("  0x{:06X} {:8} {}".format(start, count, "#" * max(1, count * 40 // peak)))
+        lines.append("likely cause:")
+        for cause in self.causes:
+            lines.append("  " + cause)
+        return "\n".join(lines) + "\n"
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  pattern
+#  \param size length in bytes
+#  \param period
+#  \param value byte value put in the second half of every period
+#
+#  return a big integer of size bytes where the second half of every period of bytes holds value, e.g. the bytes
+#  whose offset has one address line high
+# ----------------------------------------------------------------------------------------------------------------------
+def pattern(size, period, value=1):
+    half = period // 2
+    unit = bytes(half) + bytes([value]) * half
+    return int.from_bytes((unit * (size // period + 1))[:size], byteorder="little")
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  compare_dumps
+#  \param dumps two or more Cartridge objects, file names or RomImage
+#  \param bus_width 8, or 16 for big endian word carts like the Genesis
+#  \param bank_size mapper bank size used to look for bank boundary faults, 0 to skip
+#  \param buckets number of bars in the error position histogram
+#
+#  Compare dumps of the same cart and return a CompareReport. The reference is the dump which disagrees the least
+#  with all the others, so a single bad dump among good ones is the one blamed.
+# ----------------------------------------------------------------------------------------------------------------------
+def compare_dumps(dumps, bus_width=8, bank_size=0x4000, buckets=64):
+    if len(dumps) < 2:
+        raise ValueError("at least two dumps are needed")
+    carts = [dump if isinstance(dump, Cartridge) else Cartridge(dump) for dump in dumps]
+    images = [cart.image() for cart in carts]
+
+    report = CompareReport()
+    report.names = [image.path or "dump {}".format(index) for index, image in enumerate(images)]
+    report.sizes = [image.size for image in images]
+    report.size = size = min(report.sizes)
+    report.bus_width = bus_width
+    report.bank_size = bank_size
+
+    values = [int.from_bytes(image.view(0, size), byteorder="little") for image in images]
+
+    # pick the dump with the fewest flipped bits against all the others
+    distance = [0] * len(values)
+    for a, b in itertools.combinations(range(len(values)), 2):
+        flips = (values[a] ^ values[b]).bit_count()
+        distance[a] += flips
+        distance[b] += flips
+    report.reference = reference = distance.index(min(distance))
+
+    # per dump XOR against the reference, the OR of their error maps marks every suspicious byte
+    data_lines = {line: 0 for line in range(bus_width)}
+    data_values = {line: [0, 0] for line in range(bus_width)}
+    lanes = [(pattern(size, 2, 0xFF) ^ ((1 << (8 * size)) - 1), 8), (pattern(size, 2, 0xFF), 0)] \
+        if bus_width == 16 else [((1 << (8 * size)) - 1, 0)]
+    bits = [int.from_bytes(bytes([1 << bit]) * size, byteorder="little") for bit in range(8)]
+    errors = 0
+    mismatches = []
+    for index, value in enumerate(values):
+        if index == reference:
+            continue
+        flipped = value ^ values[reference]
+        if flipped == 0:
+            report.errors[index] = 0
+            continue
+        flipped_bytes = flipped.to_bytes(size, byteorder="little")
+        error_map = int.from_bytes(flipped_bytes.translate(ERROR_MAP), byteorder="little")
+        report.errors[index] = error_map.bit_count()
+        errors |= error_map
+        mismatches.append((index, flipped_bytes))
+        for lane, shift in lanes:
+            for bit, mask in enumerate(bits):
+                lane_flips = flipped & mask & lane
+                if lane_flips:
+                    data_lines[bit + shift] += lane_flips.bit_count()
+                    ones = (lane_flips & value).bit_count()
+                    data_values[bit + shift][0] += lane_flips.bit_count() - ones
+                    data_values[bit + shift][1] += ones
+
+    report.data_lines = data_lines
+    report.data_values = {line: tuple(counts) for line, counts in data_values.items()}
+    report.error_bytes = errors.bit_count()
+    if report.error_bytes == 0:
+        return report
+
+    # address lines, the error map has a 1 in the low bit of every bad byte
+    for line in range((size - 1).bit_length()):
+        report.address_lines[line] = (errors & pattern(size, 2 << line)).bit_count() / report.error_bytes
+
+    error_bytes = errors.to_bytes(size, byteorder="little")
+    step = max(1, -(-size // buckets))
+    report.histogram = [(start, error_bytes.count(1, start, start + step)) for start in range(0, size, step)]
+    if bank_size:
+        for boundary in range(bank_size, size, bank_size):
+            report.boundary_errors += error_bytes.count(1, boundary - BOUNDARY_EDGE, boundary + BOUNDARY_EDGE)
+
+    report.causes = diagnose(report, images[reference].view(0, size), images, mismatches)
+    return report
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  diagnose
+#
+#  turn the statistics of a report into likely causes, most specific first
+# ----------------------------------------------------------------------------------------------------------------------
+def diagnose(report, good, images, mismatches):
+    causes = []
+    flips = sum(report.data_lines.values())
+
+    # one data line holding every flip, a constant value means it is stuck, a mix means a bad contact
+    line, count = max(report.data_lines.items(), key=lambda item: item[1])
+    if count >= DOMINANT * flips:
+        zeros, ones = report.data_values[line]
+        if zeros == 0 or ones == 0:
+            causes.append("data line D{} stuck at {}".format(line, 0 if ones == 0 else 1))
+        else:
+            causes.append("data line D{} intermittent, clean the contacts".format(line))
+
+    # an address line which does not go high reads the byte 2^n below, test it on a sample of the bad bytes
+    for line, share in sorted(report.address_lines.items(), reverse=True):
+        if share < DOMINANT:
+            continue
+        stride = 1 << line
+        matched = checked = 0
+        for index, flipped in mismatches:
+            bad = images[index].view(0, report.size)
+            for match in itertools.islice(NONZERO.finditer(flipped), SAMPLE_SIZE):
+                offset = match.start()
+                if offset & stride:
+                    checked += 1
+                    matched += bad[offset] == good[offset ^ stride]
+        if checked and matched >= DOMINANT * checked:
+            causes.append("address line A{} stuck low, reads come from 0x{:X} bytes lower".format(line, stride))
+            break
+
+    if report.bank_size and report.size > report.bank_size:
+        boundaries = report.size // report.bank_size - 1
+        expected = 2 * BOUNDARY_EDGE * boundaries / report.size
+        if report.boundary_errors >= DOMINANT * report.error_bytes and expected < 0.5:
+            causes.append("errors at bank boundaries every 0x{:X} bytes, bank switching fault".format(report.bank_size))
+
+    if not causes:
+        causes.append("scattered errors, likely dirty contacts or a marginal read speed")
+    return causes
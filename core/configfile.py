@@ -96,6 +96,8 @@ class ConfigFile:
 
         config = configparser.ConfigParser()
         config.read(self.path)
+        if not config.has_section(section):
+            config.add_section(section)
         config[section][option] = value
 
         with open(self.path, "w") as f:
@@ -106,7 +108,7 @@ class ConfigFile:
     #
     #  return the config file, create a default if there is no file found
     # ------------------------------------------------------------------------------------------------------------------
-    def read(self, section, option):
+    def read(self, section, option, **kwargs):
         try:
             with open(self.path) as f:
                 pass
@@ -115,5 +117,7 @@ class ConfigFile:
 
         config = configparser.ConfigParser()
         config.read(self.path)
+        if "fallback" in kwargs:
+            return config.get(section, option, fallback=kwargs["fallback"])
         return config[section][option]
 
@@ -0,0 +1,215 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  consensus.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+# maps a XOR byte to 1 where two copies agree, summed over the copies it counts the votes of every byte
+EQUAL = bytes([1] + [0] * 255)
+
+
+## Consensus Reader
+#
+#  Reads every block several times and only trusts data enough reads agree on. Each block is read agree times, a
+#  block whose copies are identical is accepted at once, the others are read again one copy at a time until every
+#  byte has agree matching copies or max_reads is reached. Bytes are voted on as whole blocks turned into big
+#  integers so the comparisons run in C, healthy blocks cost agree reads and nothing else.
+class ConsensusReader:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param umd a connected UMDv2
+    #  \param port the serial port name
+    #  \param agree number of identical reads needed to accept a byte
+    #  \param max_reads reads of a block before giving up on it
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, umd, port, agree=2, max_reads=7):
+        if agree < 1 or max_reads < agree:
+            raise ValueError("need 1 <= agree <= max_reads")
+        self.umd = umd
+        self.port = port
+        self.agree = agree
+        self.max_reads = max_reads
+        # [(address, size, undecided bytes)] of the blocks which never reached agreement
+        self.unresolved = []
+        self.blocks = 0
+        self.reads = 0
+        self.retried = 0
+        self.short = 0
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  vote
+    #  \param copies reads of one block, all the same size
+    #
+    #  per byte vote, return (data, undecided) where undecided counts the bytes no value got agree votes for, those
+    #  are taken from the first copy
+    # ------------------------------------------------------------------------------------------------------------------
+    def vote(self, copies):
+        size = len(copies[0])
+        values = [int.from_bytes(copy, byteorder="little") for copy in copies]
+        full = (1 << (8 * size)) - 1
+        # a byte lane of 0xFF for the values reaching the threshold, votes never carry into the next lane
+        threshold = bytes([0] * self.agree + [0xFF] * (256 - self.agree))
+        result = 0
+        decided = 0
+        for value in values:
+            votes = 0
+            for other in values:
+                votes += int.from_bytes((value ^ other).to_bytes(size, byteorder="little").translate(EQUAL),
+                                        byteorder="little")
+            winners = int.from_bytes(votes.to_bytes(size, byteorder="little").translate(threshold), byteorder="little")
+            new = winners & ~decided
+            result |= value & new
+            decided |= new
+            if decided == full:
+                break
+        undecided = full & ~decided
+        result |= values[0] & undecided
+        return result.to_bytes(size, byteorder="little"), undecided.to_bytes(size, byteorder="little").count(0xFF)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  request
+    #  \param commands UMDv2.batch commands
+    #
+    #  Send one request until every byte of its reads came back. A short response shifts the reads after it, so it
+    #  is not voted on: the port is drained and the request sent again, the LinkTuner of the port backs the link off
+    #  when that keeps happening and IOError is raised once it runs out of attempts.
+    # ------------------------------------------------------------------------------------------------------------------
+    def request(self, commands):
+        tuner = self.umd.tuner(self.port)
+        expected = sum(len(command[2]) for command in commands if command[0] == "read")
+        attempts = 0
+        while True:
+            if self.umd.batch(self.port, commands) == expected:
+                tuner.record(True)
+                return
+            self.short += 1
+            self.umd.drain(self.port)
+            attempts += 1
+            if tuner.record(False):
+                attempts = 0
+            elif attempts >= tuner.retries:
+                raise IOError("consensus read failed on {}, responses keep coming back short".format(self.port))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  batch
+    #  \param commands same as UMDv2.batch, ("write", address, value) or ("read", address, dest memoryview)
+    #
+    #  Run a batch with consensus on every read. The whole batch is sent agree times, then only the reads which
+    #  disagree are sent again, each preceded by the writes (mapper registers) in effect for it in the batch.
+    #  Return the number of bytes read into the destinations.
+    # ------------------------------------------------------------------------------------------------------------------
+    def batch(self, commands):
+        reads = []
+        state = {}
+        for command in commands:
+            if command[0] == "write":
+                state[command[1]] = command[2]
+            else:
+                reads.append((command[1], command[2], dict(state)))
+
+        copies = [[] for read in reads]
+        for n in range(self.agree):
+            buffers = []
+            request = []
+            for command in commands:
+                if command[0] == "write":
+                    request.append(command)
+                else:
+                    buffers.append(bytearray(len(command[2])))
+                    request.append(("read", command[1], memoryview(buffers[-1])))
+            self.request(request)
+            for index, buffer in enumerate(buffers):
+                copies[index].append(bytes(buffer))
+        self.blocks += len(reads)
+        self.reads += len(reads) * self.agree
+
+        def settle(index):
+            address, dest, writes = reads[index]
+            data, undecided = self.vote(copies[index])
+            if undecided and len(copies[index]) < self.max_reads:
+                return False
+            dest[:] = data
+            if undecided:
+                self.unresolved.append((address, len(dest), undecided))
+            return True
+
+        pending = []
+        for index, (address, dest, writes) in enumerate(reads):
+            if copies[index].count(copies[index][0]) == len(copies[index]):
+                dest[:] = copies[index][0]
+            else:
+                self.retried += 1
+                if not settle(index):
+                    pending.append(index)
+
+        while pending:
+            # one more copy of every pending block, all of them in a single request
+            request = []
+            buffers = {}
+            current = {}
+            for index in pending:
+                address, dest, writes = reads[index]
+                for register, value in writes.items():
+                    if current.get(register) != value:
+                        request.append(("write", register, value))
+                        current[register] = value
+                buffers[index] = bytearray(len(dest))
+                request.append(("read", address, memoryview(buffers[index])))
+            self.request(request)
+            self.reads += len(pending)
+
+            for index in pending:
+                copies[index].append(bytes(buffers[index]))
+            pending = [index for index in pending if not settle(index)]
+        return sum(len(dest) for address, dest, writes in reads)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  read
+    #  \param address cartridge address
+    #  \param size number of bytes
+    #  \param blocks_per_request reads sent in one batch
+    #
+    #  read a range with consensus, in blocks of the calibrated block size
+    # ------------------------------------------------------------------------------------------------------------------
+    def read(self, address, size, blocks_per_request=16):
+        block_size = self.umd.settings.get(self.port, (self.umd.baudrate, self.umd.block_size))[1]
+        data = bytearray(size)
+        view = memoryview(data)
+        step = block_size * blocks_per_request
+        for start in range(0, size, step):
+            self.batch([("read", address + offset, view[offset:min(offset + block_size, size)])
+                        for offset in range(start, min(start + step, size), block_size)])
+        return data
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  report
+    #
+    #  return a text summary, one line per block which never reached agreement
+    # ------------------------------------------------------------------------------------------------------------------
+    def report(self):
+        lines = ["{} : {} blocks, {} reads, {} blocks re-read, {} short requests, {} unresolved".format(
+            self.port, self.blocks, self.reads, self.retried, self.short, len(self.unresolved))]
+        for address, size, undecided in self.unresolved:
+            lines.append("  0x{:06X} {} bytes, {} without agreement".format(address, size, undecided))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,187 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  detect.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+from core.genesis import genesis
+from core.sms import sms
+from core.snes import snes
+from core.tg16 import tg16
+
+# every header location probed, (console, header) : (address, size). Carts smaller than an address mirror, the
+# SMS headers of 8KB and 16KB carts are found at 0x7FF0 as well as at their own address.
+PROBE_REGIONS = {
+    ("genesis", "0x100"): (genesis.headerAddress, genesis.headerSize),
+    ("sms", "0x7FF0"): (0x7FF0, sms.headerSize),
+    ("sms", "0x3FF0"): (0x3FF0, sms.headerSize),
+    ("sms", "0x1FF0"): (0x1FF0, sms.headerSize),
+    ("snes", "LoROM"): (snes.header["LoROM"], snes.headerSize),
+    ("snes", "HiROM"): (snes.header["HiROM"], snes.headerSize),
+    ("tg16", "0x0000"): (0, tg16.bankSize),
+}
+
+# every console scores out of MAX_SCORE, a detection is confident when the best console scores at least
+# CONFIDENT_SCORE and CONFIDENT_MARGIN more than any other console
+MAX_SCORE = 5
+CONFIDENT_SCORE = 4
+CONFIDENT_MARGIN = 2
+
+
+def printable(data):
+    return all(0x20 <= value < 0x7F for value in data)
+
+
+## Cart Detector
+#
+#  Guesses the console of the inserted cart from one batched read of every header location, each console is scored
+#  with its own header layout and the best one is picked
+class CartDetector:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  probe
+    #  \param umd a connected UMDv2
+    #  \param port the serial port name
+    #  \param consensus optional ConsensusReader for the header reads
+    #
+    #  read every header location in a single batch, return {(console, header): bytes}
+    # ------------------------------------------------------------------------------------------------------------------
+    def probe(self, umd, port, consensus=None):
+        buffers = {}
+        commands = []
+        for key, (address, size) in PROBE_REGIONS.items():
+            buffers[key] = bytearray(size)
+            commands.append(("read", address, memoryview(buffers[key])))
+        if consensus is not None:
+            consensus.batch(commands)
+        else:
+            umd.batch(port, commands)
+        return buffers
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  score_genesis
+    #
+    #  "SEGA" console name, ROM starting at 0 and a ROM end in range. Carts past 4MB use the SSF2 mapper.
+    # ------------------------------------------------------------------------------------------------------------------
+    def score_genesis(self, data):
+        header = dict(genesis().decodeHeader(data))
+        end = header["ROM End"][0]
+        score = 0
+        score += 3 if header["Console Name"].startswith("SEGA") else 0
+        score += header["ROM Begin"][0] == 0
+        score += end & 1 == 1 and end < genesis.maxRomSize
+        mapping = "ssf2" if genesis.windowSize <= end < genesis.maxRomSize else "linear"
+        return score, mapping
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  score_sms
+    #
+    #  "TMR SEGA" trademark with a known region and size code. The header does not tell the mapper, carts with a
+    #  header use the Sega one.
+    # ------------------------------------------------------------------------------------------------------------------
+    def score_sms(self, data):
+        header = dict(sms().decodeHeader(data))
+        score = 0
+        score += 3 if header["Trademark"] == "TMR SEGA" else 0
+        score += header["Region"] is not None
+        score += data[15] & 0x0F in sms.romSizeData
+        return score
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  score_snes
+    #
+    #  checksum and complement adding up, a printable title, a map mode agreeing with the header location and a
+    #  reset vector in ROM
+    # ------------------------------------------------------------------------------------------------------------------
+    def score_snes(self, data, mapping):
+        header = dict(snes().decodeHeader(data))
+        mode = header["Map Mode"][0]
+        score = 0
+        score += 2 if header["Checksum"][0] ^ header["Complement"][0] == 0xFFFF else 0
+        score += printable(data[:snes.titleSize])
+        score += mode & 0xE0 == 0x20 and mode & 0x01 == snes.mapModes[mapping]
+        score += header["Reset Vector"][0] >= 0x8000
+        return score
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  score_tg16
+    #
+    #  a reset vector pointing at a typical first instruction, in either bit order. A vector alone is what an empty
+    #  bus reads, it does not score.
+    # ------------------------------------------------------------------------------------------------------------------
+    def score_tg16(self, data):
+        normal = tg16().bootScore(data)
+        reversed_score = tg16().bootScore(tg16().reverseBits(data))
+        if max(normal, reversed_score) < 2:
+            return 0, "normal"
+        return CONFIDENT_SCORE, "reversed" if reversed_score > normal else "normal"
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  score
+    #  \param buffers the result of probe
+    #
+    #  return {console: (score, mapping)} with the best mapping of every console, the mapping is what the dumpers
+    #  take: "linear" or "ssf2", "sega", "LoROM" or "HiROM", "normal" or "reversed"
+    # ------------------------------------------------------------------------------------------------------------------
+    def score(self, buffers):
+        scores = {"genesis": self.score_genesis(buffers["genesis", "0x100"])}
+        scores["sms"] = (max(self.score_sms(buffers["sms", header]) for header in ("0x7FF0", "0x3FF0", "0x1FF0")),
+                         "sega")
+        scores["snes"] = max((self.score_snes(buffers["snes", mapping], mapping), mapping)
+                             for mapping in ("LoROM", "HiROM"))
+        scores["tg16"] = self.score_tg16(buffers["tg16", "0x0000"])
+        return scores
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  decide
+    #  \param scores the result of score
+    #
+    #  return the detection: {"console", "mapping", "score", "confident", "scores"}
+    # ------------------------------------------------------------------------------------------------------------------
+    def decide(self, scores):
+        ranked = sorted(scores.items(), key=lambda item: item[1][0], reverse=True)
+        console, (best, mapping) = ranked[0]
+        runner_up = ranked[1][1][0] if len(ranked) > 1 else 0
+        return {"console": console, "mapping": mapping, "score": best,
+                "confident": best >= CONFIDENT_SCORE and best - runner_up >= CONFIDENT_MARGIN,
+                "scores": {name: {"score": value, "mapping": where} for name, (value, where) in scores.items()}}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  detect
+    #  \param umd a connected UMDv2
+    #  \param port the serial port name
+    #  \param consensus optional ConsensusReader for the header reads
+    #
+    #  probe, score and decide in one go
+    # ------------------------------------------------------------------------------------------------------------------
+    def detect(self, umd, port, consensus=None):
+        return self.decide(self.score(self.probe(umd, port, consensus)))
+
+
+def format_detection(detection):
+    text = "{} ({}), score {}/{}".format(detection["console"], detection["mapping"], detection["score"], MAX_SCORE)
+    if not detection["confident"]:
+        others = ", ".join("{} {}".format(name, result["score"]) for name, result in detection["scores"].items()
+                           if name != detection["console"])
+        text += ", low confidence against " + others
+    return text
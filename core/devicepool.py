@@ -0,0 +1,208 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  devicepool.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import threading
+import time
+
+
+## Device Pool
+#
+#  Keeps the UMDv2 connections of a UMDv2 object open and follows hot-plug by diffing the list of serial ports,
+#  only new ports are probed and devices which drop are reconnected with exponential backoff. Connections to the
+#  other devices are never touched. Ports held by a job of the executor are left alone until the job ends, a probe
+#  would write into its transfer and a detach would close the handle under it.
+class DevicePool:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param umd the UMDv2 whose port dictionary is managed
+    #  \param interval seconds between two scans of the watcher thread
+    #  \param backoff first reconnect delay in seconds, doubled on every failure
+    #  \param backoff_max longest reconnect delay
+    #  \param executor optional JobExecutor whose jobs hold their device
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, umd, interval=1.0, backoff=0.5, backoff_max=30.0, executor=None):
+        self.umd = umd
+        self.interval = interval
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.executor = executor
+        self.lock = threading.RLock()
+        # ports present at the last scan, ports known not to be a UMDv2, and {port: (failures, next attempt)}
+        self.seen = set()
+        self.foreign = set()
+        self.retry = {}
+        # bumped on every change so a GUI can poll for it from its own thread
+        self.generation = 0
+        self.thread = None
+        self.running = False
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  refresh
+    #
+    #  scan once: drop vanished ports, probe new ones, check the open ones and retry the dropped ones that are due.
+    #  Busy ports are skipped, a vanished one is dropped at the first scan after its job ended.
+    #  Return (added, removed) lists of UMDv2 ports.
+    # ------------------------------------------------------------------------------------------------------------------
+    def refresh(self):
+        with self.lock:
+            current = set(self.umd.list_serial_ports())
+            busy = self.busy()
+            added = []
+            removed = []
+
+            for port in self.seen - current:
+                if port in busy:
+                    current.add(port)
+                    continue
+                if port in self.umd.port:
+                    self.umd.detach(port)
+                    removed.append(port)
+                self.foreign.discard(port)
+                self.retry.pop(port, None)
+
+            for port in list(self.umd.port):
+                if port in current and port not in busy and not self.healthy(port):
+                    print("lost UMDv2 on " + port)
+                    self.umd.detach(port)
+                    removed.append(port)
+                    self.schedule(port)
+
+            now = time.monotonic()
+            due = [p for p, r in self.retry.items() if r[1] <= now]
+            for port in dict.fromkeys(sorted(current - self.seen) + due):
+                if port in self.umd.port or port in self.foreign or port in busy:
+                    continue
+                if self.umd.probe(port):
+                    print("UMDv2 present on " + port)
+                    self.umd.attach(port)
+                    self.retry.pop(port, None)
+                    added.append(port)
+                elif port in self.retry:
+                    self.schedule(port)
+                else:
+                    # new port which did not answer, it is probed again only if it disappears and comes back
+                    self.foreign.add(port)
+
+            self.seen = current
+            if added or removed:
+                self.generation += 1
+            return added, removed
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  rescan
+    #
+    #  probe every port which does not hold an open UMDv2 again, open devices are left alone
+    # ------------------------------------------------------------------------------------------------------------------
+    def rescan(self):
+        with self.lock:
+            self.foreign.clear()
+            self.seen = set(self.umd.port) - self.umd.devices
+            return self.refresh()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  busy
+    #
+    #  ports a job is using, empty without an executor
+    # ------------------------------------------------------------------------------------------------------------------
+    def busy(self):
+        if self.executor is None:
+            return set()
+        return self.executor.busy_devices()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  healthy
+    #
+    #  an unplugged device leaves a handle which fails on any ioctl
+    # ------------------------------------------------------------------------------------------------------------------
+    def healthy(self, port):
+        ser = self.umd.port[port]
+        try:
+            ser.in_waiting
+            return ser.is_open
+        except Exception:
+            # OSError or serial.SerialException depending on the platform
+            return False
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  schedule
+    #
+    #  plan the next reconnect attempt of a dropped device
+    # ------------------------------------------------------------------------------------------------------------------
+    def schedule(self, port):
+        failures = self.retry.get(port, (0, 0))[0]
+        delay = min(self.backoff * (2 ** failures), self.backoff_max)
+        self.retry[port] = (failures + 1, time.monotonic() + delay)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  report_failure
+    #  \param port the serial port name
+    #
+    #  called by users of a port when it failed, the device is closed and reconnected with backoff
+    # ------------------------------------------------------------------------------------------------------------------
+    def report_failure(self, port):
+        with self.lock:
+            if port in self.umd.port:
+                self.umd.detach(port)
+                self.generation += 1
+            self.schedule(port)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  start
+    #
+    #  start the watcher thread
+    # ------------------------------------------------------------------------------------------------------------------
+    def start(self):
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.watch, daemon=True)
+        self.thread.start()
+
+    def watch(self):
+        while self.running:
+            try:
+                self.refresh()
+            except EnvironmentError as e:
+                print("device scan failed : {}".format(e))
+            time.sleep(self.interval)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  stop
+    #
+    #  stop the watcher thread, close_ports also closes every open device
+    # ------------------------------------------------------------------------------------------------------------------
+    def stop(self, close_ports=False):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if close_ports:
+            with self.lock:
+                self.umd.disconnect()
+                self.seen.clear()
+                self.foreign.clear()
+                self.retry.clear()
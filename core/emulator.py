@@ -0,0 +1,188 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  emulator.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import threading
+import time
+
+
+## Emulated Cart
+#
+#  A ROM image seen through the address decoding of a console: small carts mirror, SMS carts bank 16KB slots through
+#  0xFFFD-0xFFFF, Genesis carts bank 512KB slots through the SSF2 registers and 384KB HuCards use the split layout
+class EmulatedCart:
+
+    def __init__(self, rom, console="flat"):
+        self.rom = bytearray(rom)
+        self.console = console
+        self.reset()
+
+    def reset(self):
+        if self.console == "genesis":
+            self.banks = list(range(8))
+        elif self.console == "sms":
+            self.banks = [0, 1, 2]
+        else:
+            self.banks = []
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  locate
+    #
+    #  return (ROM offset, bytes until the next mapping boundary) of a cart address
+    # ------------------------------------------------------------------------------------------------------------------
+    def locate(self, address):
+        size = len(self.rom)
+        if self.console == "genesis":
+            slot, offset = divmod(address & 0x3FFFFF, 0x80000)
+            return (self.banks[slot] * 0x80000 + offset) % size, 0x80000 - offset
+        if self.console == "sms" and 0x400 <= address < 0xC000:
+            slot, offset = divmod(address, 0x4000)
+            return (self.banks[slot] * 0x4000 + offset) % size, 0x4000 - offset
+        if self.console == "tg16" and size == 0x60000:
+            address &= 0x7FFFF
+            if address >= 0x40000:
+                return 0x40000 + (address & 0x1FFFF), 0x20000 - (address & 0x1FFFF)
+            return address, 0x40000 - address
+        return address % size, size - address % size
+
+    def read(self, address, size):
+        data = bytearray()
+        while len(data) < size:
+            offset, run = self.locate(address + len(data))
+            run = min(run, size - len(data), len(self.rom) - offset)
+            data += self.rom[offset:offset + run]
+        return bytes(data)
+
+    def write(self, address, data):
+        for position in range(len(data)):
+            offset, run = self.locate(address + position)
+            self.rom[offset] = data[position]
+
+    def write_register(self, address, value):
+        if self.console == "genesis" and 0xA130F3 <= address <= 0xA130FF and address & 1:
+            self.banks[(address - 0xA130F1) // 2] = value
+        elif self.console == "sms" and 0xFFFD <= address <= 0xFFFF:
+            self.banks[address - 0xFFFD] = value
+
+
+## Emulated UMDv2
+#
+#  Serial port stand-in answering the UMDv2 protocol from an EmulatedCart, it can be put in UMDv2.port with
+#  UMDv2.attach_device() to run dumps, scripts and the server without hardware
+class EmulatedUMD:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param rom the cart image
+    #  \param console address decoding of the cart, "genesis", "sms", "tg16" or "flat"
+    #  \param latency seconds added to every request, to see scheduling at work
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, rom=b"\xFF", console="flat", latency=0.0):
+        self.cart = EmulatedCart(rom, console)
+        self.latency = latency
+        self.pending = bytearray()
+        self.output = bytearray()
+        self.ready = threading.Condition()
+        self.is_open = True
+        self.timeout = 0.5
+        self.baudrate = 460800
+        self.requests = 0
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  write
+    #
+    #  parse complete commands, a wrbblk waits until its data has arrived
+    # ------------------------------------------------------------------------------------------------------------------
+    def write(self, data):
+        self.pending += data
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        while True:
+            end = self.pending.find(b"\n")
+            if end < 0:
+                break
+            words = bytes(self.pending[:end]).split()
+            if words and words[0] == b"wrbblk":
+                address, size = int(words[1], 0), int(words[2], 0)
+                if len(self.pending) < end + 1 + size:
+                    break
+                self.cart.write(address, self.pending[end + 1:end + 1 + size])
+                del self.pending[:end + 1 + size]
+                continue
+            del self.pending[:end + 1]
+            self.execute(words)
+        return len(data)
+
+    def execute(self, words):
+        if not words:
+            return
+        if words[0] == b"rdbblk":
+            self.respond(self.cart.read(int(words[1], 0), int(words[2], 0)))
+        elif words[0] == b"wrbyte":
+            self.cart.write_register(int(words[1], 0), int(words[2], 0))
+        elif words[0] == b"flash":
+            self.respond(b"flash\n")
+        else:
+            self.respond(b"unknown command\n")
+
+    def respond(self, data):
+        with self.ready:
+            self.output += data
+            self.ready.notify_all()
+
+    def read(self, size=1):
+        with self.ready:
+            if not self.output:
+                self.ready.wait(self.timeout)
+            data = bytes(self.output[:size])
+            del self.output[:size]
+            return data
+
+    def readline(self):
+        with self.ready:
+            end = self.output.find(b"\n") + 1 or len(self.output)
+            data = bytes(self.output[:end])
+            del self.output[:end]
+            return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.output)
+
+    def reset_input_buffer(self):
+        with self.ready:
+            self.output.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
@@ -0,0 +1,297 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  fingerprint.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import hashlib
+import json
+import os
+import random
+import threading
+import zlib
+
+from core.genesis import genesis
+from core.sms import sms
+from core.tg16 import tg16
+from core.romimage import RomImage
+
+# a fingerprint is the sha1 of the header region of the console followed by a few fixed samples, all of them in
+# the first 32KB which every console reads without touching a mapper. Carts smaller than a region mirror it, so
+# a fingerprint taken from a file wraps its offsets the same way.
+FINGERPRINT_REGIONS = {
+    "genesis": [(0x100, 0x100)],
+    "sms": [(0x7FF0, 16)],
+    "tg16": [(0x0000, 0x2000)],
+}
+FINGERPRINT_SAMPLES = [(0x0000, 256), (0x3000, 256), (0x5000, 256), (0x7000, 256)]
+
+INDEX_VERSION = 1
+
+
+## Fingerprint Index
+#
+#  Maps the fingerprint of a cart to the verified dumps it may be, stored as json. A cart whose fingerprint is in the
+#  index is confirmed by a spot check of random blocks against the known dump instead of being dumped in full.
+class FingerprintIndex:
+
+    # indexed dumps kept mapped for spot checks, the least recently used one is dropped past this
+    max_images = 8
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param path the json index file, created on save if it does not exist
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, path):
+        self.path = path
+        # {fingerprint: [{"console", "size", "md5", "crc32", "path"}]}
+        self.entries = {}
+        # {path: RomImage} in least recently used order
+        self.images = {}
+        self.lock = threading.Lock()
+        if os.path.isfile(path):
+            with open(path) as f:
+                index = json.load(f)
+            if index.get("version") != INDEX_VERSION:
+                raise ValueError("{} is not a fingerprint index".format(path))
+            self.entries = index["entries"]
+
+    def save(self):
+        with self.lock:
+            with open(self.path + ".tmp", "w") as f:
+                json.dump({"version": INDEX_VERSION, "entries": self.entries}, f, indent=1)
+            os.replace(self.path + ".tmp", self.path)
+            # the saved entries may point at new dumps, map them again when they are checked
+            self.images.clear()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  close
+    #
+    #  release the mapped dumps
+    # ------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        with self.lock:
+            for image in self.images.values():
+                image.close()
+            self.images.clear()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  regions
+    #
+    #  return the (address, size) list making up the fingerprint of a console
+    # ------------------------------------------------------------------------------------------------------------------
+    def regions(self, console):
+        if console not in FINGERPRINT_REGIONS:
+            raise ValueError("no fingerprint support for {} carts".format(console))
+        return FINGERPRINT_REGIONS[console] + FINGERPRINT_SAMPLES
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  rom_image
+    #  \param console
+    #  \param filename a dump file or a RomImage
+    #
+    #  return the dump as the console reads it: Genesis SMD files in BIN order, HuCards in Japanese bit order
+    # ------------------------------------------------------------------------------------------------------------------
+    def rom_image(self, console, filename):
+        if console == "genesis":
+            return genesis().loadImage(filename)
+        if console == "tg16":
+            return tg16().normalize(filename)
+        return RomImage.load(filename)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  image
+    #  \param entry an index entry
+    #
+    #  return the known dump of an entry, mapped once and shared by the job threads. Dropped images are not closed,
+    #  a spot check may still be using one, the map goes away with the last reference.
+    # ------------------------------------------------------------------------------------------------------------------
+    def image(self, entry):
+        with self.lock:
+            image = self.images.pop(entry["path"], None)
+            if image is None:
+                image = self.rom_image(entry["console"], entry["path"])
+            self.images[entry["path"]] = image
+            while len(self.images) > self.max_images:
+                del self.images[next(iter(self.images))]
+            return image
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  fingerprint
+    #  \param console
+    #  \param read function(address, size) returning the bytes of the cart at address
+    #
+    #  return the hex fingerprint of a cart or of a dump
+    # ------------------------------------------------------------------------------------------------------------------
+    def fingerprint(self, console, read):
+        digest = hashlib.sha1(console.encode("utf-8"))
+        for address, size in self.regions(console):
+            digest.update(read(address, size))
+        return digest.hexdigest()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  add_file
+    #  \param console
+    #  \param filename a verified dump
+    #  \param verify False to skip the checksum check of Genesis and SMS dumps
+    #
+    #  add a dump to the index, return its fingerprint or None if the dump does not verify
+    # ------------------------------------------------------------------------------------------------------------------
+    def add_file(self, console, filename, verify=True):
+        image = self.rom_image(console, filename)
+        view = image.view()
+        if verify and console in ("genesis", "sms"):
+            checker = genesis() if console == "genesis" else sms()
+            if checker.checksum(image) != checker.checksumRom:
+                print("{} : checksum mismatch, not indexed".format(filename))
+                return None
+
+        def read(address, size):
+            start = address % len(view)
+            return view[start:start + size]
+        key = self.fingerprint(console, read)
+        entry = {"console": console, "size": len(view), "md5": hashlib.md5(view).hexdigest(),
+                 "crc32": "{:08x}".format(zlib.crc32(view)), "path": os.path.abspath(filename)}
+        with self.lock:
+            candidates = self.entries.setdefault(key, [])
+            candidates[:] = [c for c in candidates if c["md5"] != entry["md5"]] + [entry]
+        return key
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  cart_commands
+    #  \param console
+    #  \param offset ROM offset of a sample, aligned on its size
+    #  \param dest memoryview receiving the sample
+    #
+    #  return the UMDv2.batch commands reading a ROM offset, mapping its bank in first when it is out of reach
+    # ------------------------------------------------------------------------------------------------------------------
+    def cart_commands(self, console, offset, dest):
+        if console == "sms" and offset >= sms.fixedSize:
+            register, window = sms.mapperData["sega"]
+            return [("write", register, offset // sms.bankSize), ("read", window + offset % sms.bankSize, dest)]
+        if console == "genesis" and offset >= genesis.windowSize:
+            slot = genesis.bankSlots - 1
+            return [("write", genesis.bankRegister + 2 * slot, offset // genesis.bankSize),
+                    ("read", slot * genesis.bankSize + offset % genesis.bankSize, dest)]
+        return [("read", offset, dest)]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  restore_commands
+    #
+    #  return the UMDv2.batch commands putting the mapper registers touched by cart_commands back to power on
+    # ------------------------------------------------------------------------------------------------------------------
+    def restore_commands(self, console):
+        if console == "sms":
+            return [("write", sms.mapperData["sega"][0], 2)]
+        if console == "genesis":
+            slot = genesis.bankSlots - 1
+            return [("write", genesis.bankRegister + 2 * slot, slot)]
+        return []
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  identify
+    #  \param umd a connected UMDv2
+    #  \param port the serial port name
+    #  \param console
+    #
+    #  read the fingerprint regions in one batch, return (fingerprint, candidate entries, bit reversed)
+    # ------------------------------------------------------------------------------------------------------------------
+    def identify(self, umd, port, console):
+        buffers = []
+        commands = []
+        for address, size in self.regions(console):
+            buffers.append(bytearray(size))
+            commands.append(("read", address, memoryview(buffers[-1])))
+        umd.batch(port, commands)
+
+        # US HuCards read back bit reversed, the index holds Japanese order
+        reversed_bits = console == "tg16" and tg16().isReversed(buffers[0])
+        if reversed_bits:
+            buffers = [tg16().reverseBits(buffer) for buffer in buffers]
+        samples = iter(buffers)
+        key = self.fingerprint(console, lambda address, size: next(samples))
+        return key, self.entries.get(key, []), reversed_bits
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  spot_check
+    #  \param umd a connected UMDv2
+    #  \param port the serial port name
+    #  \param entry a candidate returned by identify
+    #  \param reversed_bits True if the cart reads bit reversed
+    #  \param samples number of random blocks compared
+    #  \param sample_size bytes per block
+    #
+    #  compare random blocks of the cart, and its last block, with the known dump in a single batch. Return True if
+    #  they all match.
+    # ------------------------------------------------------------------------------------------------------------------
+    def spot_check(self, umd, port, entry, reversed_bits=False, samples=32, sample_size=512):
+        if not os.path.isfile(entry["path"]):
+            print("{} : indexed dump is missing".format(entry["path"]))
+            return False
+        image = self.image(entry)
+        if image.size != entry["size"]:
+            return False
+
+        blocks = max(1, entry["size"] // sample_size)
+        offsets = sorted(set(random.sample(range(blocks), min(samples, blocks)) + [blocks - 1]))
+        buffers = []
+        commands = []
+        for block in offsets:
+            buffers.append(bytearray(min(sample_size, entry["size"] - block * sample_size)))
+            commands += self.cart_commands(entry["console"], block * sample_size, memoryview(buffers[-1]))
+        try:
+            umd.batch(port, commands)
+        finally:
+            restore = self.restore_commands(entry["console"])
+            if restore:
+                umd.batch(port, restore)
+
+        for block, buffer in zip(offsets, buffers):
+            data = tg16().reverseBits(buffer) if reversed_bits else buffer
+            if data != image.view(block * sample_size, len(buffer)):
+                return False
+        return True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  known_dump
+    #  \param umd a connected UMDv2
+    #  \param port the serial port name
+    #  \param console
+    #  \param filename where the dump is written on a match
+    #
+    #  identify the cart and spot check it, on a confident match copy the known dump to filename and return a
+    #  verdict like a full dump would. Return None when the cart must be dumped in full.
+    # ------------------------------------------------------------------------------------------------------------------
+    def known_dump(self, umd, port, console, filename):
+        if console not in FINGERPRINT_REGIONS:
+            return None
+        key, candidates, reversed_bits = self.identify(umd, port, console)
+        for entry in candidates:
+            if self.spot_check(umd, port, entry, reversed_bits):
+                with open(filename, "wb") as f:
+                    f.write(self.image(entry).view())
+                return {"size": entry["size"], "md5": entry["md5"], "crc32": entry["crc32"],
+                        "identified": entry["path"], "fingerprint": key}
+        if candidates:
+            print("{} : fingerprint {} known but the spot check failed".format(port, key[:12]))
+        return None
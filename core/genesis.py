@@ -25,7 +25,13 @@
 ########################################################################
 
 import os
-import struct
+import sys
+import array
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from core.romimage import RomImage
 
 ## Genesis
 #
@@ -43,6 +49,32 @@ class genesis:
     
     readChunkSize = 2048
     
+    # SMD files: a 512 byte header then 16KB blocks holding the odd bytes
+    # of the block in their first half and the even bytes in the second,
+    # header byte 2 is smdSplitFlag when another file of a set follows
+    smdHeaderSize = 512
+    smdBlockSize = 0x4000
+    smdSplitFlag = 0x40
+    smdFormats = ("bin", "smd", "swapped")
+    
+    # writing 1 to the time register maps battery backed SRAM over the ROM
+    sramControl = 0xA130F1
+    sramLanes = {
+        0 : "both",
+        2 : "even",
+        3 : "odd"
+    }
+    
+    # carts over 4MB use the SSF2 mapper: the 4MB window is cut in eight
+    # 512KB slots, the bank register of slot n is at bankRegister + 2n and
+    # slot 0 always holds bank 0
+    bankSize = 0x80000
+    bankRegister = 0xA130F1
+    bankSlots = 8
+    windowSize = 0x400000
+    maxRomSize = 0x2000000
+    sampleSize = 256
+    
 ########################################################################    
 ## The Constructor
 #  \param self self
@@ -55,14 +87,13 @@ class genesis:
 ########################################################################    
 ## byteSwap(self, ifile, ofile):
 #  \param self self
-#  \param ifile
+#  \param ifile the ROM file or a RomImage
 #  \param ofile
 #
 ########################################################################
     def byteSwap(self, ifile, ofile):
         
-        fileSize = os.path.getsize(ifile)
-        pos = 0
+        image = RomImage.load(ifile)
         
         try:
             os.remove(ofile)
@@ -70,109 +101,641 @@ class genesis:
             pass
             
         with open(ofile, "wb+") as fwrite:
-            with open(ifile, "rb") as fread:
-                while(pos < fileSize):  
-                    badEndian = fread.read(2)
-                    revEndian = struct.pack('<h', *struct.unpack('>h', badEndian))
-                    fwrite.write(revEndian)
-                    pos += 2
+            fwrite.write(self.swapBytes(image.view()))
+
+
+########################################################################    
+## swapBytes(self, data):
+#  \param self self
+#  \param data bytes like
+#
+#  Return data with the bytes of every word swapped, done with two slice
+#  assignments instead of one struct call per word
+########################################################################
+    def swapBytes(self, data):
+        
+        even = len(data) & ~1
+        swapped = bytearray(data)
+        swapped[0:even:2] = data[1:even:2]
+        swapped[1:even:2] = data[0:even:2]
+        return swapped
+
+
+########################################################################    
+## detectFormat(self, data):
+#  \param self self
+#  \param data the whole image, bytes like
+#  
+#  Tell a plain BIN, an SMD and a byte swapped image apart by content:
+#  the SMD header id, then where the "SEGA" of the header shows up
+########################################################################
+    def detectFormat(self, data):
+        
+        view = memoryview(data)
+        smdSized = len(view) % self.smdBlockSize == self.smdHeaderSize
+        if smdSized and view[8] == 0xAA and view[9] == 0xBB:
+            return "smd"
+        
+        console = view[self.headerAddress:self.headerAddress + 16].tobytes()
+        if b"SEGA" in console:
+            return "bin"
+        if b"SEGA" in self.swapBytes(console):
+            return "swapped"
+        
+        # SMD files from some copiers leave the id bytes out
+        if smdSized and len(view) > self.smdHeaderSize:
+            block = self.deinterleave(view[self.smdHeaderSize:self.smdHeaderSize + self.smdBlockSize])
+            if b"SEGA" in block[self.headerAddress:self.headerAddress + 16]:
+                return "smd"
+        return "bin"
+
+
+########################################################################    
+## deinterleave(self, data):
+#  \param self self
+#  \param data SMD blocks without the file header
+#  
+#  Return the BIN data of SMD blocks, two slice assignments per block
+########################################################################
+    def deinterleave(self, data):
+        
+        view = memoryview(data)
+        size = len(view) - len(view) % self.smdBlockSize
+        half = self.smdBlockSize // 2
+        out = bytearray(size)
+        for start in range(0, size, self.smdBlockSize):
+            end = start + self.smdBlockSize
+            out[start + 1:end:2] = view[start:start + half]
+            out[start:end:2] = view[start + half:end]
+        return out
+
+
+########################################################################    
+## interleave(self, data):
+#  \param self self
+#  \param data BIN data
+#  
+#  Return the SMD blocks of BIN data, the last block is padded with 0xFF
+########################################################################
+    def interleave(self, data):
+        
+        view = memoryview(data)
+        size = -(-len(view) // self.smdBlockSize) * self.smdBlockSize
+        if size != len(view):
+            view = memoryview(bytes(view) + b"\xFF" * (size - len(view)))
+        half = self.smdBlockSize // 2
+        out = bytearray(size)
+        for start in range(0, size, self.smdBlockSize):
+            end = start + self.smdBlockSize
+            out[start:start + half] = view[start + 1:end:2]
+            out[start + half:end] = view[start:end:2]
+        return out
+
+
+########################################################################    
+## smdHeader(self, blocks, last=True):
+#  \param self self
+#  \param blocks number of 16KB blocks in the file
+#  \param last False if another file of a split set follows
+#  
+#  Return the 512 byte header of an SMD file
+########################################################################
+    def smdHeader(self, blocks, last=True):
+        
+        header = bytearray(self.smdHeaderSize)
+        header[0] = blocks & 0xFF
+        header[1] = 0x03
+        header[2] = 0x00 if last else self.smdSplitFlag
+        header[8] = 0xAA
+        header[9] = 0xBB
+        header[10] = 0x06
+        return bytes(header)
+
+
+########################################################################    
+## splitSet(self, filename):
+#  \param self self
+#  \param filename the first file of an SMD set
+#  
+#  Return the file names of a split SMD set, following the split flag of
+#  every header to the next file: the last character of the name bumped
+#  (GAMEA.SMD, GAMEB.SMD) or a numeric extension bumped (GAME.1, GAME.2)
+########################################################################
+    def splitSet(self, filename):
+        
+        names = [filename]
+        while True:
+            with open(names[-1], "rb") as f:
+                header = f.read(self.smdHeaderSize)
+            if len(header) < 3 or header[2] != self.smdSplitFlag:
+                return names
+            root, ext = os.path.splitext(names[-1])
+            candidates = [root[:-1] + chr(ord(root[-1]) + 1) + ext]
+            if ext[1:].isdigit():
+                candidates.append("{}.{}".format(root, int(ext[1:]) + 1))
+            following = [name for name in candidates if os.path.isfile(name) and name not in names]
+            if not following:
+                print("{} : split set ends early, {} not found".format(filename, " or ".join(candidates)))
+                return names
+            names.append(following[0])
+
+
+########################################################################    
+## loadImage(self, filename):
+#  \param self self
+#  \param filename a ROM file name or a RomImage, BIN, SMD or swapped
+#  
+#  Return a RomImage of the ROM in BIN order. A BIN is returned as it is
+#  mapped, other formats are converted in memory once and cached by the
+#  source image, a split SMD set is joined from its first file.
+########################################################################
+    def loadImage(self, filename):
+        
+        image = RomImage.load(filename)
+        fmt = image.cached("genesis.format", lambda: self.detectFormat(image.view()))
+        if fmt == "bin":
+            return image
+        
+        def convert():
+            if fmt == "swapped":
+                return RomImage(data=self.swapBytes(image.view()))
+            parts = [image.view()]
+            if image.path is not None:
+                for name in self.splitSet(image.path)[1:]:
+                    with open(name, "rb") as f:
+                        parts.append(memoryview(f.read()))
+            return RomImage(data=b"".join(self.deinterleave(part[self.smdHeaderSize:]) for part in parts))
+        return image.cached("genesis.bin", convert)
+
+
+########################################################################    
+## convertFile(self, ifile, ofile, target="bin"):
+#  \param self self
+#  \param ifile the ROM file, any of smdFormats
+#  \param ofile
+#  \param target one of smdFormats
+#  
+#  Convert a ROM file, return (ifile, source format)
+########################################################################
+    def convertFile(self, ifile, ofile, target="bin"):
+        
+        if target not in self.smdFormats:
+            raise ValueError("unknown Genesis format " + target)
+        with RomImage(ifile) as source:
+            fmt = source.cached("genesis.format", lambda: self.detectFormat(source.view()))
+            data = self.loadImage(source).view()
+            with open(ofile, "wb") as fwrite:
+                if target == "smd":
+                    fwrite.write(self.smdHeader(-(-len(data) // self.smdBlockSize)))
+                    fwrite.write(self.interleave(data))
+                elif target == "swapped":
+                    fwrite.write(self.swapBytes(data))
+                else:
+                    fwrite.write(data)
+        return ifile, fmt
+
+
+########################################################################    
+## convertAll(self, files, target="bin", workers=None):
+#  \param self self
+#  \param files list of (ifile, ofile)
+#  \param target one of smdFormats
+#  \param workers number of processes, defaults to the number of CPUs
+#  
+#  Convert many files at once across a process pool, the conversion is
+#  CPU bound so threads would be held back by the GIL. Return the
+#  (ifile, source format) of every file.
+########################################################################
+    def convertAll(self, files, target="bin", workers=None):
+        
+        sources = [ifile for ifile, ofile in files]
+        targets = [ofile for ifile, ofile in files]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(self.convertFile, sources, targets, [target] * len(files), chunksize=16))
+
 
 ########################################################################    
 ## checksum(self, file):
 #  \param self self
-#  \param file the rom to verify
+#  \param file the rom to verify, a file name or a RomImage, SMD and
+#         byte swapped images are checked without converting them on disk
 #
 ########################################################################
     def checksum(self, filename):
         
-        # Genesis checksums start after the header
-        pos = self.romStartAddress
-        self.checksumCalc = 0
-        fileSize = os.path.getsize(filename)
+        image = self.loadImage(filename)
+        self.checksumRom, self.checksumCalc = image.cached("genesis.checksum", lambda: self.sumImage(image))
+        return self.checksumCalc
+
+
+########################################################################    
+## sumImage(self, image):
+#  \param self self
+#  \param image a RomImage
+#
+#  Return (header checksum, calculated checksum), the calculated sum adds
+#  all big endian words after the header, a trailing odd byte is ignored
+########################################################################
+    def sumImage(self, image):
+        
+        checksumRom = int.from_bytes(image.view(self.headerChecksum, 2), byteorder="big")
         
-        with open(filename, "rb") as f:
-            
-            # read the ROM header's checksum value
+        data = image.view(self.romStartAddress)
+        words = array.array("H")
+        words.frombytes(data[:len(data) & ~1])
+        if sys.byteorder == "little":
+            words.byteswap()
+        return checksumRom, sum(words) & 0xFFFF
 
-            f.seek( self.headerChecksum, 0)
-            data = f.read(2)
-            thisWord = data[0],data[1]
-            self.checksumRom = int.from_bytes(thisWord, byteorder="big")
+
+########################################################################    
+## readGenesisROMHeader
+#  \param self self
+#  
+#  Read and format the ROM header for Sega Genesis cartridge, filename
+#  may also be a RomImage
+########################################################################
+    def formatHeader(self, filename):
+        
+        image = self.loadImage(filename)
+        header = image.cached("genesis.header",
+                              lambda: dict(self.decodeHeader(image.view(self.headerAddress, self.headerSize))))
+        self.headerData = dict(header)
+        return self.headerData
+
+
+########################################################################    
+## decodeHeader
+#  \param self self
+#  \param data the headerSize bytes found at headerAddress
+#  
+#  Decode a raw Sega Genesis header, from a file or straight off a cart
+########################################################################
+    def decodeHeader(self, data):
+        
+        # decode into a new dictionnary, the class one is shared by every
+        # instance and thread
+        header = {}
+        pos = 0
+        
+        def field(size):
+            nonlocal pos
+            pos += size
+            return data[pos - size:pos]
             
-            # jump ahead of ROM header
-            f.seek(self.romStartAddress, 0)
+        def text(size):
+            return bytes(field(size)).decode("utf-8", "replace")
             
-            while( pos < fileSize ):
-                if( ( fileSize - pos ) >= self.readChunkSize):
-                    sizeOfRead = self.readChunkSize
-                else:
-                    sizeOfRead = ( fileSize - pos )
-                    
-                data = f.read(sizeOfRead)
-                
-                i = 0
-                while i < sizeOfRead and i+1 < sizeOfRead:
-                    thisWord = data[i],data[i + 1]
-                    intVal = int.from_bytes(thisWord, byteorder="big")
-                    self.checksumCalc = (self.checksumCalc + intVal) & 0xFFFF
-                    i += 2 
-                
-                pos += sizeOfRead
+        def address():
+            value = int.from_bytes(field(4), byteorder="big" )
+            return [value, hex(value)]
+            
+    ## get console name
+        header.update({"Console Name": text(16) })
+    ## get copyright information
+        header.update({"Copyright": text(16) })
+    ## get domestic name
+        header.update({"Domestic Name": text(48) })
+    ## get overseas name
+        header.update({"Overseas Name": text(48) })
+    ## get serial number
+        header.update({"Serial Number": text(14) })
+    ## get checksum
+        value = int.from_bytes(field(2), byteorder="big" )
+        header.update({"Checksum": [value, hex(value)] })
+    ## get io support
+        header.update({"IO Support": text(16) })
+    ## get ROM Start Address
+        header.update({"ROM Begin": address() })
+    ## get ROM End Address
+        header.update({"ROM End": address() })
+    ## get Start of RAM
+        header.update({"RAM Begin": address() })
+    ## get End of RAM
+        header.update({"RAM End": address() })
+    ## get sram support
+        header.update({"SRAM Support": bytes(field(4)) })
+    ## get start of sram
+        header.update({"SRAM Begin": address() })
+    ## get end of sram
+        header.update({"SRAM End": address() })
+    ## get modem support
+        header.update({"Modem Support": text(12) })
+    ## get memo
+        header.update({"Memo": text(40) })
+    ## get country support
+        header.update({"Country Support": text(16) })
+        
+        self.headerData = header
+        return header
 
 
 ########################################################################    
-## readGenesisROMHeader
+## sramInfo
 #  \param self self
+#  \param header a decoded header
 #  
-#  Read and format the ROM header for Sega Genesis cartridge
+#  Return (begin, end, lanes) of the battery backed SRAM declared in the
+#  header, lanes is "odd", "even" or "both". None if there is no SRAM.
 ########################################################################
-    def formatHeader(self, filename):
+    def sramInfo(self, header):
+        
+        support = header.get("SRAM Support", b"")
+        if len(support) != 4 or support[0:2] != b"RA":
+            return None
+        
+        # bits 4 and 3 of the third byte select the byte lanes
+        lanes = self.sramLanes.get((support[2] >> 3) & 0x03, "both")
+        begin = header["SRAM Begin"][0]
+        end = header["SRAM End"][0]
+        if end < begin:
+            return None
+        return begin, end, lanes
+
+
+########################################################################    
+## readSram
+#  \param self self
+#  \param umd a connected UMDv2
+#  \param port the serial port name
+#  \param begin
+#  \param end
+#  \param lanes
+#  
+#  Read the SRAM window in one pass and pack the used byte lane with a
+#  single slice, the cart must have SRAM enabled
+########################################################################
+    def readSram(self, umd, port, begin, end, lanes):
+        
+        start = begin & ~1
+        raw = umd.read_range(port, start, (end | 1) - start + 1)
+        if lanes == "odd":
+            return raw[1::2]
+        elif lanes == "even":
+            return raw[0::2]
+        return raw
+
+
+########################################################################    
+## backupSram
+#  \param self self
+#  \param umd a connected UMDv2
+#  \param port the serial port name
+#  \param filename the save file to write
+#  
+#  Read only the SRAM window declared in the cart header, verify it with
+#  a read-back hash and write the packed save file. Return its md5.
+########################################################################
+    def backupSram(self, umd, port, filename):
+        
+        header = dict(self.decodeHeader(umd.read_block(port, self.headerAddress, self.headerSize)))
+        info = self.sramInfo(header)
+        if info is None:
+            print("{} : no SRAM declared in header".format(port))
+            return None
+        
+        umd.write_byte(port, self.sramControl, 1)
+        try:
+            save = self.readSram(umd, port, *info)
+            check = self.readSram(umd, port, *info)
+        finally:
+            umd.write_byte(port, self.sramControl, 0)
+        
+        digest = hashlib.md5(save).hexdigest()
+        if hashlib.md5(check).hexdigest() != digest:
+            print("{} : SRAM read-back mismatch, save not written".format(port))
+            return None
+        
+        with open(filename, "wb") as f:
+            f.write(save)
+        return digest
+
+
+########################################################################    
+## restoreSram
+#  \param self self
+#  \param umd a connected UMDv2
+#  \param port the serial port name
+#  \param filename the save file to restore
+#  
+#  Expand a packed save file to the SRAM byte lane, write it in one block
+#  and verify it with a read-back hash. A file of the wrong size is not
+#  written. Return True on success.
+########################################################################
+    def restoreSram(self, umd, port, filename):
+        
+        header = dict(self.decodeHeader(umd.read_block(port, self.headerAddress, self.headerSize)))
+        info = self.sramInfo(header)
+        if info is None:
+            print("{} : no SRAM declared in header".format(port))
+            return False
+        begin, end, lanes = info
         
-        # clear current rom info dictionnary
-        self.headerData.clear()
         with open(filename, "rb") as f:
-            
-        ## get console name
-            self.headerData.update({"Console Name": f.read(16).decode("utf-8", "replace") })
-        ## get copyright information
-            self.headerData.update({"Copyright": f.read(16).decode("utf-8", "replace") })
-        ## get domestic name
-            self.headerData.update({"Domestic Name": f.read(48).decode("utf-8", "replace") })
-        ## get overseas name
-            self.headerData.update({"Overseas Name": f.read(48).decode("utf-8", "replace") })
-        ## get serial number
-            self.headerData.update({"Serial Number": f.read(14).decode("utf-8", "replace") })
-        ## get checksum
-            data = int.from_bytes(f.read(2), byteorder="big" )
-            self.headerData.update({"Checksum": [data, hex(data)] })
-        ## get io support
-            self.headerData.update({"IO Support": f.read(16).decode("utf-8", "replace") })
-        ## get ROM Start Address
-            data = int.from_bytes(f.read(4), byteorder="big" )
-            self.headerData.update({"ROM Begin": [data, hex(data)] })
-        ## get ROM End Address
-            data = int.from_bytes(f.read(4), byteorder="big" )
-            self.headerData.update({"ROM End": [data, hex(data)] })
-        ## get Start of RAM
-            data = int.from_bytes(f.read(4), byteorder="big" )
-            self.headerData.update({"RAM Begin": [data, hex(data)] })
-        ## get End of RAM
-            data = int.from_bytes(f.read(4), byteorder="big" )
-            self.headerData.update({"RAM End": [data, hex(data)] })
-        ## get sram support
-            self.headerData.update({"SRAM Support": f.read(4) })
-        ## get start of sram
-            data = int.from_bytes(f.read(4), byteorder="big" )
-            self.headerData.update({"SRAM Begin": [data, hex(data)] })
-        ## get end of sram
-            data = int.from_bytes(f.read(4), byteorder="big" )
-            self.headerData.update({"SRAM End": [data, hex(data)] })
-        ## get modem support
-            self.headerData.update({"Modem Support": f.read(12).decode("utf-8", "replace") })
-        ## get memo
-            self.headerData.update({"Memo": f.read(40).decode("utf-8", "replace") })
-        ## get country support
-            self.headerData.update({"Country Support": f.read(16).decode("utf-8", "replace") })
+            save = f.read()
         
-        return self.headerData
+        # the save must fill the window exactly, as backupSram writes it
+        start = begin & ~1
+        window = (end | 1) - start + 1
+        size = window if lanes == "both" else window // 2
+        if len(save) != size:
+            print("{} : save file is {} bytes, the SRAM window holds {}".format(port, len(save), size))
+            return False
+        
+        if lanes == "both":
+            raw = save
+        else:
+            # the unused lane is not connected, fill it and let the lane slice place the save bytes
+            raw = bytearray(b"\xFF" * ((end | 1) - start + 1))
+            raw[1 if lanes == "odd" else 0::2] = save
+        
+        umd.write_byte(port, self.sramControl, 1)
+        try:
+            umd.write_block(port, start, raw)
+            check = self.readSram(umd, port, begin, end, lanes)
+        finally:
+            umd.write_byte(port, self.sramControl, 0)
+        
+        if hashlib.md5(check).digest() != hashlib.md5(save).digest():
+            print("{} : SRAM read-back mismatch after restore".format(port))
+            return False
+        return True
+
+
+########################################################################    
+## backupSramAll
+#  \param self self
+#  \param umd a connected UMDv2
+#  \param directory where the save files are written
+#  \param ports the devices holding Genesis carts, usually the selected ones
+#  \param busy ports a running job holds, e.g. JobExecutor.busy_devices()
+#  
+#  Back up the saves of the carts in several devices at once, one thread
+#  per device. Return {port: (filename, md5)}, md5 is None when no save
+#  was written. A busy or failed port gives (None, exception).
+########################################################################
+    def backupSramAll(self, umd, directory, ports, busy=()):
+        
+        results = {}
+        
+        def backup(port):
+            try:
+                # each thread uses its own genesis object
+                console = genesis()
+                header = dict(console.decodeHeader(umd.read_block(port, self.headerAddress, self.headerSize)))
+                name = "".join(c if c.isalnum() else "_" for c in header["Serial Number"].strip())
+                filename = os.path.join(directory, "{}_{}.srm".format(name, os.path.basename(port)))
+                results[port] = (filename, console.backupSram(umd, port, filename))
+            except Exception as e:
+                print("{} : SRAM backup failed : {}".format(port, e))
+                results[port] = (None, e)
+        
+        threads = []
+        for port in ports:
+            if port in busy or port not in umd.port:
+                results[port] = (None, IOError("{} is busy or not connected".format(port)))
+            else:
+                threads.append(threading.Thread(target=backup, args=(port,)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
 
+
+########################################################################    
+## detectMirror
+#  \param self self
+#  \param umd a connected UMDv2
+#  \param port the serial port name
+#  \param consensus optional ConsensusReader for the samples
+#  
+#  Compare a small sample at every power of two up to 2MB against the
+#  start of the ROM in a single batched request, return the first size
+#  which mirrors address 0 or windowSize if none does
+########################################################################
+    def detectMirror(self, umd, port, consensus=None):
+        
+        samples = {}
+        commands = []
+        size = 0x20000
+        for address in [0] + [size << n for n in range(5)]:
+            samples[address] = bytearray(self.sampleSize)
+            commands.append(("read", address, memoryview(samples[address])))
+        if consensus is not None:
+            consensus.batch(commands)
+        else:
+            umd.batch(port, commands)
+        
+        for address in sorted(samples)[1:]:
+            if samples[address] == samples[0]:
+                return address
+        return self.windowSize
+
+
+########################################################################    
+## detectSize
+#  \param self self
+#  \param umd a connected UMDv2
+#  \param port the serial port name
+#  \param consensus optional ConsensusReader for the header and samples
+#  
+#  Size the dump from the header ROM range, checked against mirroring: a
+#  header range past the first mirror is a bad header and the mirror wins,
+#  a range over 4MB can not be checked and is trusted if it is sane.
+#  Return (romSize, header).
+########################################################################
+    def detectSize(self, umd, port, consensus=None):
+        
+        if consensus is not None:
+            data = consensus.read(self.headerAddress, self.headerSize)
+        else:
+            data = umd.read_block(port, self.headerAddress, self.headerSize)
+        header = dict(self.decodeHeader(data))
+        begin = header["ROM Begin"][0]
+        end = header["ROM End"][0]
+        headerSize = (end | 1) + 1 if begin == 0 and end < self.maxRomSize else 0
+        
+        mirror = self.detectMirror(umd, port, consensus)
+        if headerSize == 0:
+            print("{} : bad ROM range in header, using mirror size {}KB".format(port, mirror // 1024))
+            return mirror, header
+        if headerSize > mirror and mirror < self.windowSize:
+            print("{} : header claims {}KB but the ROM mirrors at {}KB".format(port, headerSize // 1024,
+                                                                               mirror // 1024))
+            return mirror, header
+        return headerSize, header
+
+
+########################################################################    
+## planDump
+#  \param self self
+#  \param romSize
+#  \param blockSize largest single read
+#  
+#  Return the list of batches needed to read romSize bytes, one 512KB bank
+#  per batch. The first 4MB are read through the power on bank layout,
+#  later banks are mapped into slots 1 to 7 by a register write sent in
+#  the same batch as the reads of the bank.
+########################################################################
+    def planDump(self, romSize, blockSize=2048):
+        
+        def reads(address, offset, size):
+            return [("read", address + pos, offset + pos, min(blockSize, size - pos))
+                    for pos in range(0, size, blockSize)]
+        
+        batches = []
+        banks = -(-romSize // self.bankSize)
+        for bank in range(banks):
+            offset = bank * self.bankSize
+            size = min(self.bankSize, romSize - offset)
+            if bank < self.bankSlots:
+                batches.append(reads(offset, offset, size))
+            else:
+                slot = 1 + (bank - self.bankSlots) % (self.bankSlots - 1)
+                batch = [("write", self.bankRegister + 2 * slot, bank)]
+                batches.append(batch + reads(slot * self.bankSize, offset, size))
+        return batches
+
+
+########################################################################    
+## dumpRom
+#  \param self self
+#  \param umd a connected UMDv2
+#  \param port the serial port name
+#  \param stages extra pipeline stages, e.g. a FileWriterStage
+#  \param swap True if the cart returns its words byte swapped
+#  \param job optional JobContext for progress and cancellation
+#  \param consensus optional ConsensusReader to read every block until
+#         enough reads agree
+#  \param mapper "linear" to never touch the bank registers, "ssf2" to
+#         bank past 4MB, None to go by the header
+#  
+#  Dump a Genesis cart reading only the range declared in its header, the
+#  blocks stream through the checksum and digest stages as they arrive.
+#  Return (image, verdict) with the checksum and digests of the dump.
+########################################################################
+    def dumpRom(self, umd, port, stages=None, swap=False, job=None, consensus=None, mapper=None):
+        
+        # the pipeline stages use this module, import it here to avoid a cycle
+        from core.pipeline import DumpPipeline, ByteSwapStage, GenesisChecksumStage, DigestStage
+        
+        romSize, header = self.detectSize(umd, port, consensus)
+        if mapper == "linear" and romSize > self.windowSize:
+            print("{} : {}KB header range on a cart without mapper, dumping 4MB".format(port, romSize // 1024))
+            romSize = self.windowSize
+        blockSize = umd.settings.get(port, (umd.baudrate, umd.block_size))[1]
+        image = bytearray(romSize)
+        pipeline = DumpPipeline(([ByteSwapStage()] if swap else []) +
+                                [GenesisChecksumStage(), DigestStage()] + list(stages or []))
+        
+        try:
+            umd.run_plan(port, self.planDump(romSize, blockSize), image, pipeline, job, consensus)
+        finally:
+            if romSize > self.windowSize:
+                # put slots 1 to 7 back on their power on banks
+                umd.batch(port, [("write", self.bankRegister + 2 * slot, slot) for slot in range(1, self.bankSlots)])
+            verdict = pipeline.finish()
+        if swap:
+            image = self.swapBytes(image)
+        return image, verdict
@@ -26,7 +26,13 @@
 
 import sys
 import glob
+import time
 import serial
+import serial.tools.list_ports
+
+from core.calibrate import LinkTuner
+from core.capture import CaptureRecorder, TraceReplay
+from core.receive import ReceiveBuffer
 
 
 ## Universal Mega Dumper
@@ -35,16 +41,41 @@ import serial
 class UMDv2:
 
     timeout = 0
-    port = {}
+
+    # default link settings, calibrated settings per device are kept in settings[port]
+    baudrate = 460800
+    block_size = 2048
+
+    cmd_read_block = "rdbblk 0x{:X} {}\r\n"
+    cmd_write_block = "wrbblk 0x{:X} {}\r\n"
+    cmd_write_byte = "wrbyte 0x{:X} 0x{:X}\r\n"
+
+    # response of each command as (kind, pipelined), kind is "block" (size is the second argument), "line" or None.
+    # Commands not listed answer with a line and may be pipelined.
+    responses = {
+        "rdbblk": ("block", True),
+        "wrbyte": (None, True),
+        "wrbblk": (None, True),
+        "flash": ("line", False),
+    }
 
     # ------------------------------------------------------------------------------------------------------------------
     #  __init__
     #
     #  select a local file
     # ------------------------------------------------------------------------------------------------------------------
-    def __init__(self, timeout):
+    def __init__(self, timeout, configfile=None):
         self.timeout = timeout
-        pass
+        self.configfile = configfile
+        # per device state, {port: serial handle}, {port: ReceiveBuffer}, {port: LinkTuner} and
+        # {port: (baudrate, block_size)}
+        self.port = {}
+        self.rx = {}
+        self.tuners = {}
+        self.settings = {}
+        # names of the devices added with attach_device, they are not serial ports
+        self.devices = set()
+        self.capture = None
 
     # ------------------------------------------------------------------------------------------------------------------
     #  list_serial_ports
@@ -71,8 +102,7 @@ class UMDv2:
     # ------------------------------------------------------------------------------------------------------------------
     def connect(self, app):
         print("autodecting UMDv2...")
-        umd_ports = []
-        self.port.clear()
+        self.disconnect()
         check_ports = self.list_serial_ports()
         if len(check_ports) == 0:
             print("no active serial ports detected, please connect a UMDv2 to the PC and press 'Connect'")
@@ -80,30 +110,395 @@ class UMDv2:
         else:
             for port in check_ports:
                 print("attempting to connect to UMDv2 on " + port + " : ", end='')
-                try:
-                    ser = serial.Serial(port=port,
-                                        baudrate=460800,
-                                        bytesize=serial.EIGHTBITS,
-                                        parity=serial.PARITY_NONE,
-                                        stopbits=serial.STOPBITS_ONE,
-                                        timeout=self.timeout)
-                    ser.write(bytes("flash\n", "utf-8"))
-                    response = ser.readline().decode("utf-8")
-                    if response == "flash\n":
-                        print("present!")
-                        umd_ports.append(port)
-                    else:
-                        print("timed out")
-                        pass
-                    ser.close()
-                except (OSError, serial.SerialException):
-                    pass
-
-            # add all discovered ports to the
-            for port in umd_ports:
-                self.port[port] = serial.Serial(port=port,
-                                                baudrate=460800,
-                                                bytesize=serial.EIGHTBITS,
-                                                parity=serial.PARITY_NONE,
-                                                stopbits=serial.STOPBITS_ONE,
-                                                timeout=self.timeout)
+                if self.probe(port):
+                    print("present!")
+                    self.attach(port)
+                else:
+                    print("timed out")
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  probe
+    #  \param port the serial port name
+    #
+    #  Return True if a UMDv2 answers on this port, the port is closed again afterwards
+    # ------------------------------------------------------------------------------------------------------------------
+    def probe(self, port):
+        try:
+            ser = self.open_port(port)
+            try:
+                ser.write(b"flash\n")
+                return ReceiveBuffer(ser, 64).readline() == b"flash\n"
+            finally:
+                ser.close()
+        except (OSError, serial.SerialException):
+            return False
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  attach
+    #  \param port the serial port name
+    #
+    #  Open a port known to hold a UMDv2 with its calibrated settings and add it to self.port
+    # ------------------------------------------------------------------------------------------------------------------
+    def attach(self, port):
+        self.settings[port] = self.load_settings(port)
+        self.port[port] = self.open_port(port, self.settings[port][0])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  attach_device
+    #  \param name the name the device is known by
+    #  \param device an open serial-like object, e.g. an EmulatedUMD
+    #
+    #  Add a device which is not a serial port, it uses the default link settings and is left alone by hot-plug scans
+    # ------------------------------------------------------------------------------------------------------------------
+    def attach_device(self, name, device):
+        self.settings[name] = (self.baudrate, self.block_size)
+        self.port[name] = device
+        self.devices.add(name)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  detach
+    #  \param port the serial port name
+    #
+    #  Close a port and forget it, a port which already vanished is only forgotten
+    # ------------------------------------------------------------------------------------------------------------------
+    def detach(self, port):
+        ser = self.port.pop(port, None)
+        self.rx.pop(port, None)
+        self.tuners.pop(port, None)
+        self.devices.discard(port)
+        if ser is not None:
+            try:
+                ser.close()
+            except (OSError, serial.SerialException):
+                pass
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  disconnect
+    #
+    #  Close all ports
+    # ------------------------------------------------------------------------------------------------------------------
+    def disconnect(self):
+        for port in list(self.port):
+            self.detach(port)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  open_port
+    #  \param port the serial port name
+    #  \param baudrate defaults to the UMDv2 default baud rate
+    #
+    #  Open a serial port with the UMDv2 line settings
+    # ------------------------------------------------------------------------------------------------------------------
+    def open_port(self, port, baudrate=None):
+        return serial.Serial(port=port,
+                             baudrate=baudrate or self.baudrate,
+                             bytesize=serial.EIGHTBITS,
+                             parity=serial.PARITY_NONE,
+                             stopbits=serial.STOPBITS_ONE,
+                             timeout=self.timeout)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  serial_number
+    #  \param port the serial port name
+    #
+    #  Return the USB serial number of the device on this port, falls back to the port name
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def serial_number(port):
+        for info in serial.tools.list_ports.comports():
+            if info.device == port and info.serial_number:
+                return info.serial_number
+        return port
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  load_settings
+    #  \param port the serial port name
+    #
+    #  Return the calibrated (baudrate, block_size) for the device on this port, or the defaults
+    # ------------------------------------------------------------------------------------------------------------------
+    def load_settings(self, port):
+        if self.configfile is not None:
+            value = self.configfile.read("CALIBRATION", self.serial_number(port), fallback=None)
+            if value:
+                baudrate, block_size = value.split(",")
+                return int(baudrate), int(block_size)
+        return self.baudrate, self.block_size
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  save_settings
+    #  \param port the serial port name
+    #  \param baudrate
+    #  \param block_size
+    #
+    #  Apply link settings to the open port and store them against the device serial number
+    # ------------------------------------------------------------------------------------------------------------------
+    def save_settings(self, port, baudrate, block_size):
+        self.settings[port] = (baudrate, block_size)
+        self.port[port].baudrate = baudrate
+        self.tuners.pop(port, None)
+        if self.configfile is not None:
+            self.configfile.modify("CALIBRATION", self.serial_number(port), "{},{}".format(baudrate, block_size))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  read_block
+    #  \param port the serial port name
+    #  \param address cartridge address
+    #  \param size number of bytes
+    #
+    #  Read a block of bytes from the cartridge, a short read means the link timed out. The returned memoryview
+    #  is only valid until the next read on this port.
+    # ------------------------------------------------------------------------------------------------------------------
+    def read_block(self, port, address, size):
+        self.port[port].write(bytes(self.cmd_read_block.format(address, size), "utf-8"))
+        return self.receiver(port).read(size)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  read_block_into
+    #  \param port the serial port name
+    #  \param address cartridge address
+    #  \param dest writable memoryview, its length is the number of bytes read
+    #
+    #  Read a block of bytes from the cartridge straight into dest, return the byte count
+    # ------------------------------------------------------------------------------------------------------------------
+    def read_block_into(self, port, address, dest):
+        self.port[port].write(bytes(self.cmd_read_block.format(address, len(dest)), "utf-8"))
+        return self.receiver(port).read_into(dest)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  batch
+    #  \param port the serial port name
+    #  \param commands list of ("write", address, value) and ("read", address, dest) with dest a writable memoryview
+    #
+    #  Send all commands in a single request and read every block response straight into its dest, so register
+    #  writes and reads cost one round trip per batch instead of one per command. Return the bytes read.
+    # ------------------------------------------------------------------------------------------------------------------
+    def batch(self, port, commands):
+        request = bytearray()
+        reads = []
+        for command in commands:
+            if command[0] == "write":
+                request += bytes(self.cmd_write_byte.format(command[1], command[2]), "utf-8")
+            else:
+                request += bytes(self.cmd_read_block.format(command[1], len(command[2])), "utf-8")
+                reads.append(command[2])
+        self.port[port].write(request)
+        rx = self.receiver(port)
+        return sum(rx.read_into(dest) for dest in reads)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  run_plan
+    #  \param port the serial port name
+    #  \param plan list of batches of ("write", address, value) and ("read", address, image offset, size)
+    #  \param image writable buffer receiving the reads
+    #  \param pipeline optional DumpPipeline fed as the image fills up
+    #  \param job optional JobContext for progress and cancellation
+    #  \param consensus optional ConsensusReader of the port, every read is then checked by multiple reads
+    #
+    #  Execute a dump plan one batch per request, reads must fill the image in ascending order. A batch coming back
+    #  short is sent again, the LinkTuner of the port backs the link off when that keeps happening.
+    # ------------------------------------------------------------------------------------------------------------------
+    def run_plan(self, port, plan, image, pipeline=None, job=None, consensus=None):
+        view = memoryview(image)
+        done = 0
+        for batch in plan:
+            end = done
+            for command in batch:
+                if command[0] == "read":
+                    end = max(end, command[2] + command[3])
+            if consensus is not None:
+                consensus.batch(self.plan_commands(batch, view))
+            else:
+                self.tuned_batch(port, batch, view)
+            if pipeline is not None and end > done:
+                pipeline.feed(view[done:end])
+            done = end
+            if job is not None:
+                job.progress(done, len(view))
+                job.check()
+        return done
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  plan_commands
+    #  \param batch a batch of a dump plan
+    #  \param view memoryview of the image
+    #  \param block_size optional largest read, longer reads are split
+    #
+    #  Return the UMDv2.batch commands of a plan batch, reads go straight into the image
+    # ------------------------------------------------------------------------------------------------------------------
+    def plan_commands(self, batch, view, block_size=None):
+        commands = []
+        for command in batch:
+            if command[0] != "read":
+                commands.append(command)
+                continue
+            step = block_size or command[3]
+            for pos in range(0, command[3], step):
+                size = min(step, command[3] - pos)
+                commands.append(("read", command[1] + pos, view[command[2] + pos:command[2] + pos + size]))
+        return commands
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  tuner
+    #  \param port the serial port name
+    #
+    #  Return the LinkTuner of a port, it starts from the calibrated settings
+    # ------------------------------------------------------------------------------------------------------------------
+    def tuner(self, port):
+        tuner = self.tuners.get(port)
+        if tuner is None:
+            tuner = self.tuners[port] = LinkTuner(self, port)
+        return tuner
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  tuned_batch
+    #  \param port the serial port name
+    #  \param batch a batch of a dump plan
+    #  \param view memoryview of the image
+    #
+    #  Run a plan batch in reads no longer than the tuned block size. A short batch is drained and sent again, it
+    #  holds its own mapper writes. Raise IOError once the retries and back offs are exhausted.
+    # ------------------------------------------------------------------------------------------------------------------
+    def tuned_batch(self, port, batch, view):
+        tuner = self.tuner(port)
+        expected = sum(command[3] for command in batch if command[0] == "read")
+        attempts = 0
+        while True:
+            if self.batch(port, self.plan_commands(batch, view, tuner.block_size)) == expected:
+                tuner.record(True)
+                return expected
+            self.drain(port)
+            attempts += 1
+            # a back off gives the batch a fresh set of attempts with the new settings
+            if tuner.record(False):
+                attempts = 0
+            elif attempts >= tuner.retries:
+                raise IOError("batch failed on {}".format(port))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  reset_input
+    #  \param port the serial port name
+    #
+    #  Drop every received byte not read yet, in the serial driver and in the receive buffer
+    # ------------------------------------------------------------------------------------------------------------------
+    def reset_input(self, port):
+        self.receiver(port).reset()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  drain
+    #  \param port the serial port name
+    #
+    #  Wait for the rest of a desynchronized response and drop it
+    # ------------------------------------------------------------------------------------------------------------------
+    def drain(self, port):
+        time.sleep(self.timeout)
+        self.reset_input(port)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  receiver
+    #  \param port the serial port name
+    #
+    #  Return the ReceiveBuffer of a port, a new one is made when the port object was replaced (capture, replay)
+    # ------------------------------------------------------------------------------------------------------------------
+    def receiver(self, port):
+        ser = self.port[port]
+        rx = self.rx.get(port)
+        if rx is None or rx.serial is not ser:
+            rx = ReceiveBuffer(ser)
+            self.rx[port] = rx
+        return rx
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  read_range
+    #  \param port the serial port name
+    #  \param address cartridge address
+    #  \param size number of bytes
+    #
+    #  Read any number of bytes in blocks of the device's calibrated block size
+    # ------------------------------------------------------------------------------------------------------------------
+    def read_range(self, port, address, size):
+        data = bytearray(size)
+        for block in self.stream_range(port, address, size, data):
+            pass
+        return data
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  stream_range
+    #  \param port the serial port name
+    #  \param address cartridge address
+    #  \param size number of bytes
+    #  \param image optional preallocated buffer of at least size bytes
+    #
+    #  Yield the blocks of a range as they come off the link, e.g. to feed a DumpPipeline. Blocks are read straight
+    #  into the image and handed out as memoryviews of it, so they stay valid after the next read. Blocks are as
+    #  long as the tuned block size of the port, a short block is read again.
+    # ------------------------------------------------------------------------------------------------------------------
+    def stream_range(self, port, address, size, image=None):
+        view = memoryview(image if image is not None else bytearray(size))
+        offset = 0
+        while offset < size:
+            block = view[offset:offset + min(self.tuner(port).block_size, size - offset)]
+            self.tuned_batch(port, [("read", address + offset, offset, len(block))], view)
+            offset += len(block)
+            yield block
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  write_block
+    #  \param port the serial port name
+    #  \param address cartridge address
+    #  \param data bytes to write
+    #
+    #  Write a block of bytes to the cartridge, the data follows the command line
+    # ------------------------------------------------------------------------------------------------------------------
+    def write_block(self, port, address, data):
+        ser = self.port[port]
+        ser.write(bytes(self.cmd_write_block.format(address, len(data)), "utf-8") + bytes(data))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  write_byte
+    #  \param port the serial port name
+    #  \param address cartridge address
+    #  \param value
+    #
+    #  Write a single byte to the cartridge, used for mapper and control registers
+    # ------------------------------------------------------------------------------------------------------------------
+    def write_byte(self, port, address, value):
+        self.port[port].write(bytes(self.cmd_write_byte.format(address, value), "utf-8"))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  start_capture
+    #  \param path the trace file to create
+    #
+    #  Record all traffic on the connected ports into a binary trace for offline replay
+    # ------------------------------------------------------------------------------------------------------------------
+    def start_capture(self, path):
+        self.stop_capture()
+        self.capture = CaptureRecorder(path)
+        for name in self.port:
+            self.port[name] = self.capture.wrap(name, self.port[name])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  stop_capture
+    #
+    #  Close the trace and put the real serial ports back in place
+    # ------------------------------------------------------------------------------------------------------------------
+    def stop_capture(self):
+        if self.capture is None:
+            return
+        for name in self.port:
+            if hasattr(self.port[name], "recorder"):
+                self.port[name] = self.port[name].serial
+        self.capture.close()
+        self.capture = None
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  replay
+    #  \param path a trace file made with start_capture
+    #  \param realtime True to reproduce the recorded timing, False to run as fast as possible
+    #
+    #  Replace the connected ports with replay ports so the normal code paths run against a recorded session
+    # ------------------------------------------------------------------------------------------------------------------
+    def replay(self, path, realtime=False):
+        self.stop_capture()
+        # the open devices are not used again, close them rather than leave them locked
+        for port in list(self.port):
+            self.detach(port)
+        self.port.update(TraceReplay(path, realtime).port)
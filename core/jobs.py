@@ -0,0 +1,239 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  jobs.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+## Job Cancelled
+#
+#  Raised inside a job by JobContext.check() once the job was cancelled
+class JobCancelled(Exception):
+    pass
+
+
+## Job Context
+#
+#  Handed to the function of a job to publish progress and check for cancellation, progress events are throttled so
+#  a job reporting every block does not flood the GUI
+class JobContext:
+
+    def __init__(self, executor, job_id, name, device):
+        self.executor = executor
+        self.job_id = job_id
+        self.name = name
+        self.device = device
+        self.cancel_event = threading.Event()
+        self.start = time.monotonic()
+        self.last = 0.0
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  check
+    #
+    #  raise JobCancelled if the job was cancelled, call it between blocks
+    # ------------------------------------------------------------------------------------------------------------------
+    def check(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  progress
+    #  \param done units done, usually bytes
+    #  \param total units in the job, 0 if unknown
+    #
+    #  publish progress with throughput and ETA, at most once per refresh interval except for the last update
+    # ------------------------------------------------------------------------------------------------------------------
+    def progress(self, done, total=0):
+        now = time.monotonic()
+        if now - self.last < self.executor.refresh and done != total:
+            return
+        self.last = now
+        elapsed = now - self.start
+        rate = done / elapsed if elapsed > 0 else 0
+        eta = (total - done) / rate if rate > 0 and total else None
+        self.executor.publish("progress", self, {"done": done, "total": total, "rate": rate, "eta": eta})
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  log
+    #
+    #  publish a line of text for the output pane
+    # ------------------------------------------------------------------------------------------------------------------
+    def log(self, text):
+        self.executor.publish("log", self, text)
+
+
+## Job Executor
+#
+#  Runs long operations on worker threads and reports on a queue the GUI drains from its own loop with after().
+#  Serial handles cannot be shared with other processes, so jobs run on threads; the heavy lifting of a dump is
+#  I/O or done by C code (hashing, slicing) which releases the GIL.
+#
+#  Events are (kind, job_id, name, device, payload) with kind one of
+#  "start", "progress", "log", "done" (payload is the result), "error" (payload is the exception) and "cancelled".
+#
+#  Jobs of one device run one after the other in submission order, two jobs talking to the same port at once would
+#  interleave their commands. Jobs without a device run as soon as a worker is free.
+class JobExecutor:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param workers number of jobs running at once
+    #  \param refresh shortest interval between two progress events of a job, in seconds
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, workers=8, refresh=1 / 30):
+        self.refresh = refresh
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.events = queue.Queue()
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        # {device: deque of (context, run)} waiting for the running job of the device, a device is a key while busy
+        self.waiting = {}
+        self.lock = threading.Lock()
+
+    def publish(self, kind, context, payload=None):
+        self.events.put((kind, context.job_id, context.name, context.device, payload))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  submit
+    #  \param name label shown in the GUI
+    #  \param function called as function(context, *args)
+    #  \param device optional device the job runs on, e.g. a port name
+    #
+    #  queue a job and return its id, a job on a busy device waits for the jobs submitted on it earlier
+    # ------------------------------------------------------------------------------------------------------------------
+    def submit(self, name, function, *args, device=None):
+        context = JobContext(self, next(self.ids), name, device)
+        self.jobs[context.job_id] = context
+
+        def run():
+            try:
+                if context.cancelled:
+                    self.publish("cancelled", context)
+                else:
+                    execute()
+            finally:
+                self.jobs.pop(context.job_id, None)
+                if device is not None:
+                    self.release(device)
+
+        def execute():
+            context.start = time.monotonic()
+            self.publish("start", context)
+            try:
+                result = function(context, *args)
+            except JobCancelled:
+                self.publish("cancelled", context)
+            except Exception as e:
+                self.publish("error", context, e)
+            else:
+                self.publish("cancelled" if context.cancelled else "done", context, result)
+
+        with self.lock:
+            if device is not None and device in self.waiting:
+                self.waiting[device].append((context, run))
+                return context.job_id
+            if device is not None:
+                self.waiting[device] = deque()
+        self.pool.submit(run)
+        return context.job_id
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  release
+    #  \param device the device of a job which just ended
+    #
+    #  start the next job waiting for the device, cancelled ones are only reported
+    # ------------------------------------------------------------------------------------------------------------------
+    def release(self, device):
+        while True:
+            with self.lock:
+                waiting = self.waiting[device]
+                if not waiting:
+                    del self.waiting[device]
+                    return
+                context, run = waiting.popleft()
+            if not context.cancelled:
+                self.pool.submit(run)
+                return
+            # a job cancelled while it waited never starts
+            self.publish("cancelled", context)
+            self.jobs.pop(context.job_id, None)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  cancel
+    #
+    #  ask a job to stop, it stops at its next check()
+    # ------------------------------------------------------------------------------------------------------------------
+    def cancel(self, job_id):
+        context = self.jobs.get(job_id)
+        if context is not None:
+            context.cancel_event.set()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  busy_devices
+    #
+    #  return the set of devices a queued or running job holds
+    # ------------------------------------------------------------------------------------------------------------------
+    def busy_devices(self):
+        return {context.device for context in list(self.jobs.values()) if context.device is not None}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  poll
+    #  \param limit most events drained in one call, keeps a GUI frame short
+    #
+    #  return the pending events without blocking, only the latest progress event of each job is kept
+    # ------------------------------------------------------------------------------------------------------------------
+    def poll(self, limit=500):
+        events = []
+        progress = {}
+        for i in range(limit):
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == "progress":
+                if event[1] in progress:
+                    events[progress[event[1]]] = None
+                progress[event[1]] = len(events)
+            events.append(event)
+        return [event for event in events if event is not None]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  shutdown
+    #
+    #  cancel every job and wait for the workers
+    # ------------------------------------------------------------------------------------------------------------------
+    def shutdown(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,300 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  pipeline.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import sys
+import array
+import queue
+import hashlib
+import threading
+import zlib
+
+from core.genesis import genesis
+from core.sms import sms
+from core.tg16 import tg16
+from core.romimage import RomImage
+
+
+## Stage
+#
+#  A pipeline stage sees every block in order, it may return a transformed block for the following stages
+class Stage:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  process
+    #  \param offset position of the block in the dump
+    #  \param block bytes like
+    #
+    #  return the block handed to the next stage
+    # ------------------------------------------------------------------------------------------------------------------
+    def process(self, offset, block):
+        return block
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  finish
+    #
+    #  return a dictionary of results once the last block went through
+    # ------------------------------------------------------------------------------------------------------------------
+    def finish(self):
+        return {}
+
+
+## Byte Swap Stage
+#
+#  Swap the bytes of every word. Blocks are swapped in place so the following stages see the offsets of the dump,
+#  only the last block may end on an odd byte, which is passed through as is.
+class ByteSwapStage(Stage):
+
+    def __init__(self):
+        self.console = genesis()
+        self.trailing = 0
+
+    def process(self, offset, block):
+        if self.trailing:
+            raise ValueError("byte swap block at 0x{:X} follows an odd length block".format(offset))
+        self.trailing = len(block) & 1
+        return self.console.swapBytes(block)
+
+    def finish(self):
+        if self.trailing:
+            return {"byteswap_trailing": self.trailing}
+        return {}
+
+
+## Bit Reverse Stage
+#
+#  Reverse the bits of every byte, for US HuCards whose data lines are wired backwards
+class BitReverseStage(Stage):
+
+    def __init__(self):
+        self.console = tg16()
+
+    def process(self, offset, block):
+        return self.console.reverseBits(block)
+
+
+## Genesis Checksum Stage
+#
+#  Accumulate the Genesis checksum as blocks arrive, the header value is picked up when 0x18E goes by
+class GenesisChecksumStage(Stage):
+
+    def __init__(self):
+        self.console = genesis()
+        self.header = bytearray()
+        self.carry = b""
+        self.total = 0
+
+    def process(self, offset, block):
+        end = offset + len(block)
+        start = self.console.romStartAddress
+        if offset < start:
+            self.header += block[:start - offset]
+        if end > start:
+            data = self.carry + bytes(block[max(start - offset, 0):])
+            even = len(data) & ~1
+            self.carry = data[even:]
+            words = array.array("H")
+            words.frombytes(data[:even])
+            if sys.byteorder == "little":
+                words.byteswap()
+            self.total = (self.total + sum(words)) & 0xFFFF
+        return block
+
+    def finish(self):
+        checksumRom = int.from_bytes(self.header[self.console.headerChecksum:self.console.headerChecksum + 2],
+                                     byteorder="big")
+        return {"checksum": self.total, "checksum_rom": checksumRom, "checksum_ok": self.total == checksumRom}
+
+
+## SMS Checksum Stage
+#
+#  The checksum range depends on the size code at 0x7FFF, the first 64KB are held until it is known
+class SmsChecksumStage(Stage):
+
+    window = 0x10000
+
+    def __init__(self):
+        self.console = sms()
+        self.head = bytearray()
+        self.romSize = None
+        self.known = False
+        self.checksumRom = 0
+        self.total = 0
+
+    def process(self, offset, block):
+        end = offset + len(block)
+        if offset < self.window:
+            self.head += block[:self.window - offset]
+            if end >= self.window:
+                self.sum_head()
+        if end > self.window and self.romSize is not None and offset < self.romSize:
+            first = max(self.window - offset, 0)
+            self.total += sum(block[first:self.romSize - offset])
+        return block
+
+    def sum_head(self):
+        self.checksumRom, self.total = self.console.sumImage(RomImage(data=self.head))
+        # an unknown size code sums the whole dump, like sumImage does
+        self.known = self.head[0x7FFF] & 0x0F in self.console.romSizeData
+        self.romSize = self.console.checksumRange(self.head[0x7FFF] & 0x0F, sys.maxsize)[0]
+
+    def finish(self):
+        if len(self.head) < self.console.headerAddress + self.console.headerSize:
+            return {"checksum": None, "checksum_rom": None, "checksum_ok": False}
+        if self.romSize is None:
+            self.sum_head()
+        total = self.total & 0xFFFF
+        # the BIOS does not check carts without a valid size code, their checksum is n/a
+        return {"checksum": total, "checksum_rom": self.checksumRom,
+                "checksum_ok": total == self.checksumRom if self.known else None}
+
+
+## Digest Stage
+#
+#  Compute several digests in the same pass, crc32 comes from zlib and anything else from hashlib
+class DigestStage(Stage):
+
+    def __init__(self, names=("md5", "sha1", "crc32")):
+        self.crc = 0 if "crc32" in names else None
+        self.hashes = {name: hashlib.new(name) for name in names if name != "crc32"}
+
+    def process(self, offset, block):
+        for digest in self.hashes.values():
+            digest.update(block)
+        if self.crc is not None:
+            self.crc = zlib.crc32(block, self.crc)
+        return block
+
+    def finish(self):
+        results = {name: digest.hexdigest() for name, digest in self.hashes.items()}
+        if self.crc is not None:
+            results["crc32"] = "{:08x}".format(self.crc)
+        return results
+
+
+## File Writer Stage
+#
+#  Write the blocks to a file
+class FileWriterStage(Stage):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "wb")
+
+    def process(self, offset, block):
+        self.file.write(block)
+        return block
+
+    def finish(self):
+        self.file.close()
+        return {"filename": self.filename}
+
+
+## Archive Stage
+#
+#  Ingest the blocks into an ArchiveStore while the dump is running
+class ArchiveStage(Stage):
+
+    def __init__(self, store, name):
+        self.writer = store.ingest(name)
+
+    def process(self, offset, block):
+        self.writer.write(block)
+        return block
+
+    def finish(self):
+        self.writer.close()
+        return {"archive": self.writer.name}
+
+
+## Dump Pipeline
+#
+#  Blocks coming off the serial link are queued and run through the stages on a worker thread, the bounded queue
+#  blocks the reader when the stages fall behind
+class DumpPipeline:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param stages list of Stage, in processing order
+    #  \param depth number of blocks the queue holds before feed() blocks
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, stages, depth=16):
+        self.stages = stages
+        self.queue = queue.Queue(maxsize=depth)
+        self.offset = 0
+        self.error = None
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.worker.start()
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # keep draining so the reader never blocks on a dead pipeline
+                continue
+            offset, block = item
+            try:
+                for stage in self.stages:
+                    block = stage.process(offset, block)
+            except Exception as e:
+                self.error = e
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  feed
+    #  \param block bytes like, must not be modified by the caller afterwards
+    #
+    #  queue one block, blocks while the queue is full
+    # ------------------------------------------------------------------------------------------------------------------
+    def feed(self, block):
+        self.queue.put((self.offset, block))
+        self.offset += len(block)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  run
+    #  \param blocks an iterable of blocks, e.g. UMDv2.stream_range()
+    #
+    #  feed every block then return the verdict
+    # ------------------------------------------------------------------------------------------------------------------
+    def run(self, blocks):
+        for block in blocks:
+            self.feed(block)
+        return self.finish()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  finish
+    #
+    #  wait for the queue to drain and return the results of all stages merged in one dictionary
+    # ------------------------------------------------------------------------------------------------------------------
+    def finish(self):
+        self.queue.put(None)
+        self.worker.join()
+        if self.error is not None:
+            raise self.error
+        verdict = {"size": self.offset}
+        for stage in self.stages:
+            verdict.update(stage.finish())
+        return verdict
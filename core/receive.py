@@ -0,0 +1,190 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  receive.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import os
+import select
+import time
+import serial
+
+
+## Receive Buffer
+#
+#  Allocation-free receive path for one serial port. Data is read into a preallocated buffer, responses are handed
+#  out as memoryview slices which stay valid until the next call, and bulk data can be read straight into the
+#  caller's own buffer.
+#
+#  On POSIX ports the file descriptor is read with os.readv, pyserial's own readinto() allocates a bytes object
+#  internally. Other port objects (capture, replay, Windows) fall back to their readinto().
+class ReceiveBuffer:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param ser an open serial port
+    #  \param size capacity of the buffer, the largest single response handed out as a slice
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, ser, size=65536):
+        self.serial = ser
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.direct = isinstance(ser, serial.Serial) and hasattr(ser, "fd") and hasattr(os, "readv")
+
+        # counters, every call returning data replaces a bytes object the old read()/readline() path allocated, and
+        # every response compared without decoding saves the str of .decode()
+        self.calls = 0
+        self.syscalls = 0
+        self.bytes_received = 0
+        self.decodes_avoided = 0
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  receive
+    #  \param dest writable memoryview
+    #  \param timeout seconds to wait for the first byte
+    #
+    #  read whatever is available into dest without allocating, return the byte count, 0 on timeout
+    # ------------------------------------------------------------------------------------------------------------------
+    def receive(self, dest, timeout):
+        self.syscalls += 1
+        if self.direct:
+            fd = self.serial.fd
+            ready, w, x = select.select([fd], [], [], timeout)
+            if not ready:
+                return 0
+            count = os.readv(fd, [dest])
+        else:
+            count = self.serial.readinto(dest) or 0
+        self.bytes_received += count
+        return count
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  fill
+    #  \param want minimum number of buffered bytes needed
+    #
+    #  move the unread bytes to the front if needed and read until want bytes are buffered or the port times out
+    # ------------------------------------------------------------------------------------------------------------------
+    def fill(self, want, timeout):
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.start + want > len(self.buffer):
+            # rare and usually only a few bytes, copied out first since the source and destination overlap
+            pending = self.end - self.start
+            self.buffer[0:pending] = bytes(self.view[self.start:self.end])
+            self.start, self.end = 0, pending
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.end - self.start < want:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            # the fallback readinto() blocks for the full slice, only ask for what is missing
+            limit = len(self.buffer) if self.direct else self.start + want
+            count = self.receive(self.view[self.end:limit], remaining)
+            if count == 0:
+                return False
+            self.end += count
+        return True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  read
+    #  \param size number of bytes
+    #
+    #  return a memoryview of size bytes, shorter on timeout
+    # ------------------------------------------------------------------------------------------------------------------
+    def read(self, size):
+        if size > len(self.buffer):
+            raise ValueError("read of {} bytes exceeds the {} byte receive buffer".format(size, len(self.buffer)))
+        self.calls += 1
+        self.fill(size, self.serial.timeout)
+        size = min(size, self.end - self.start)
+        data = self.view[self.start:self.start + size]
+        self.start += size
+        return data
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  readline
+    #
+    #  return a memoryview of the next line including its newline, compare it against bytes instead of decoding it
+    # ------------------------------------------------------------------------------------------------------------------
+    def readline(self):
+        self.calls += 1
+        self.decodes_avoided += 1
+        # searched counts from start, fill() may move the unread bytes to the front of the buffer
+        searched = 0
+        while True:
+            end = self.buffer.find(b"\n", self.start + searched, self.end)
+            if end >= 0:
+                end += 1
+                break
+            searched = self.end - self.start
+            if searched >= len(self.buffer) or not self.fill(searched + 1, self.serial.timeout):
+                end = self.end
+                break
+        data = self.view[self.start:end]
+        self.start = end
+        return data
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  read_into
+    #  \param dest writable memoryview, e.g. a slice of a preallocated dump image
+    #
+    #  fill dest with bytes straight from the port, return the byte count, shorter on timeout
+    # ------------------------------------------------------------------------------------------------------------------
+    def read_into(self, dest):
+        self.calls += 1
+        # bytes already buffered go first
+        count = min(len(dest), self.end - self.start)
+        dest[:count] = self.view[self.start:self.start + count]
+        self.start += count
+        timeout = self.serial.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while count < len(dest):
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            received = self.receive(dest[count:], remaining)
+            if received == 0:
+                break
+            count += received
+        return count
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  reset
+    #
+    #  drop buffered bytes along with the port's input buffer
+    # ------------------------------------------------------------------------------------------------------------------
+    def reset(self):
+        self.start = self.end = 0
+        self.serial.reset_input_buffer()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  stats
+    #
+    #  return the counters and the allocations per MB saved compared to read()/readline() with .decode()
+    # ------------------------------------------------------------------------------------------------------------------
+    def stats(self):
+        saved = self.calls + self.decodes_avoided
+        megabytes = self.bytes_received / 1048576
+        return {"calls": self.calls,
+                "syscalls": self.syscalls,
+                "bytes_received": self.bytes_received,
+                "allocations_saved": saved,
+                "allocations_saved_per_mb": saved / megabytes if megabytes else 0}
@@ -0,0 +1,165 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  romimage.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import os
+import mmap
+import threading
+
+
+## ROM Image
+#
+#  A ROM file memory-mapped once, or a dump held in memory, shared by all console operations. Slices are zero-copy
+#  memoryviews and derived results (header, checksum, digests) are cached until the file changes.
+class RomImage:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param path the ROM file to map
+    #  \param data a bytes like dump held in memory, used when there is no file
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, path=None, data=None):
+        self.path = path
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.map = None
+        self.stamp = None
+        if path is not None:
+            self.map_file()
+        else:
+            self.data = memoryview(data if data is not None else b"")
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  load
+    #  \param source a RomImage, a file name or a bytes like object
+    #
+    #  return a RomImage for source, so every console function accepts either a path or an image
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def load(source):
+        if isinstance(source, RomImage):
+            return source
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return RomImage(data=source)
+        return RomImage(path=source)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  map_file
+    #
+    #  (re)map the file and remember its size and modification time
+    # ------------------------------------------------------------------------------------------------------------------
+    def map_file(self):
+        self.release()
+        stat = os.stat(self.path)
+        self.stamp = (stat.st_mtime_ns, stat.st_size)
+        if stat.st_size == 0:
+            # mmap refuses empty files
+            self.data = memoryview(b"")
+            return
+        with open(self.path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self.map)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  refresh
+    #
+    #  remap and drop the cached results if the file changed on disk, return True if it did
+    # ------------------------------------------------------------------------------------------------------------------
+    def refresh(self):
+        if self.path is None:
+            return False
+        stat = os.stat(self.path)
+        if (stat.st_mtime_ns, stat.st_size) == self.stamp:
+            return False
+        self.cache.clear()
+        self.map_file()
+        return True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  invalidate
+    #
+    #  drop the cached results, for in memory dumps which were modified in place
+    # ------------------------------------------------------------------------------------------------------------------
+    def invalidate(self):
+        with self.lock:
+            self.cache.clear()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  cached
+    #  \param key name of the result, e.g. "md5"
+    #  \param compute callable returning the result
+    #
+    #  return the cached result or compute and cache it
+    # ------------------------------------------------------------------------------------------------------------------
+    def cached(self, key, compute):
+        with self.lock:
+            self.refresh()
+            if key not in self.cache:
+                self.cache[key] = compute()
+            return self.cache[key]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  view
+    #  \param offset
+    #  \param size defaults to the end of the image
+    #
+    #  return a zero-copy memoryview of the image
+    # ------------------------------------------------------------------------------------------------------------------
+    def view(self, offset=0, size=None):
+        if size is None:
+            return self.data[offset:]
+        return self.data[offset:offset + size]
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  release
+    #
+    #  release the memory map, views handed out earlier must not be used afterwards
+    # ------------------------------------------------------------------------------------------------------------------
+    def release(self):
+        if self.map is not None:
+            try:
+                self.data.release()
+                self.map.close()
+            except BufferError:
+                # a consumer still holds a view, the map is closed when that view goes away
+                pass
+            self.map = None
+
+    def close(self):
+        self.release()
+        self.data = memoryview(b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,265 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  script.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import ast
+import operator
+import re
+from collections import deque
+
+# script syntax, one statement per line or separated by ';', '#' starts a comment
+#
+#   set base = 0x8000
+#   for addr = base to base + 0x4000 step 0x800
+#       rdbblk ${addr} 2048
+#   end
+#   wrbyte 0xFFFF 0x02
+#
+# ${expression} is replaced by its value in hex, expressions use integers, variables and + - * // % << >> & | ^
+
+OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+    ast.BitAnd: operator.and_,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+}
+
+SUBSTITUTION = re.compile(r"\$\{([^}]*)\}|\$([A-Za-z_]\w*)")
+
+
+## Script Error
+#
+#  Raised for syntax errors, with the line number of the offending statement
+class ScriptError(Exception):
+    pass
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  evaluate
+#  \param text an integer expression
+#  \param variables current variable values
+#
+#  evaluate an expression without eval(), only integers, variables and the operators above are allowed
+# ----------------------------------------------------------------------------------------------------------------------
+def evaluate(text, variables):
+    def walk(node):
+        if isinstance(node, ast.Expression):
+            return walk(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, int):
+            return node.value
+        if isinstance(node, ast.Name) and node.id in variables:
+            return variables[node.id]
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            return OPERATORS[type(node.op)](walk(node.left), walk(node.right))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -walk(node.operand)
+        raise ScriptError("invalid expression '{}'".format(text))
+    try:
+        return walk(ast.parse(text.strip(), mode="eval"))
+    except SyntaxError:
+        raise ScriptError("invalid expression '{}'".format(text))
+
+
+## Command Script
+#
+#  Expands a script into the list of UMDv2 commands it sends
+class CommandScript:
+
+    def __init__(self, text, variables=None):
+        self.lines = []
+        for number, line in enumerate(text.splitlines(), 1):
+            for statement in line.split("#", 1)[0].split(";"):
+                if statement.strip():
+                    self.lines.append((number, statement.strip()))
+        self.variables = dict(variables or {})
+        # line number of the last command yielded
+        self.line = 0
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  commands
+    #
+    #  yield every command with its variables substituted, loops are expanded lazily so long ranges cost nothing
+    # ------------------------------------------------------------------------------------------------------------------
+    def commands(self):
+        return self.expand(0, len(self.lines), self.variables)
+
+    def expand(self, start, stop, variables):
+        index = start
+        while index < stop:
+            number, statement = self.lines[index]
+            words = statement.split(None, 1)
+            try:
+                if words[0] == "set":
+                    name, value = words[1].split("=", 1)
+                    variables[name.strip()] = evaluate(value, variables)
+                elif words[0] == "for":
+                    end = self.match_end(index, stop)
+                    match = re.match(r"(\w+)\s*=\s*(.+?)\s+to\s+(.+?)(?:\s+step\s+(.+))?$", words[1])
+                    if match is None:
+                        raise ScriptError("expected 'for name = start to end [step n]'")
+                    name, first, last, step = match.groups()
+                    step = evaluate(step, variables) if step else 1
+                    if step <= 0:
+                        raise ScriptError("step must be positive")
+                    # the end value is exclusive, like an address range
+                    for value in range(evaluate(first, variables), evaluate(last, variables), step):
+                        variables[name] = value
+                        yield from self.expand(index + 1, end, variables)
+                    index = end
+                elif words[0] == "end":
+                    raise ScriptError("'end' without 'for'")
+                else:
+                    self.line = number
+                    yield SUBSTITUTION.sub(lambda m: "0x{:X}".format(evaluate(m.group(1) or m.group(2), variables)),
+                                           statement)
+            except ScriptError as e:
+                # errors of a loop body already carry their own line number
+                if str(e).startswith("line "):
+                    raise
+                raise ScriptError("line {}: {}".format(number, e))
+            except (IndexError, ValueError) as e:
+                raise ScriptError("line {}: {}".format(number, e))
+            index += 1
+
+    def match_end(self, index, stop):
+        depth = 0
+        for position in range(index, stop):
+            keyword = self.lines[position][1].split(None, 1)[0]
+            if keyword == "for":
+                depth += 1
+            elif keyword == "end":
+                depth -= 1
+                if depth == 0:
+                    return position
+        raise ScriptError("'for' without 'end'")
+
+
+## Script Runner
+#
+#  Sends the commands of a script to one UMDv2 port with up to window commands in flight, responses are read back
+#  in order and matched to the command which produced them
+class ScriptRunner:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param umd a connected UMDv2
+    #  \param port the serial port name
+    #  \param window maximum number of commands sent ahead of their responses
+    #  \param terminator appended to every command, an empty one sends the text as it is and waits for no response
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, umd, port, window=16, terminator="\r\n"):
+        self.umd = umd
+        self.port = port
+        self.window = window
+        self.terminator = terminator
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  response_kind
+    #  \param command the command text
+    #  \param capacity largest block the receive buffer holds
+    #
+    #  return (kind, size, pipelined) of the response to a command, kind is "block", "line" or None
+    # ------------------------------------------------------------------------------------------------------------------
+    def response_kind(self, command, capacity):
+        words = command.split()
+        kind, pipelined = self.umd.responses.get(words[0], ("line", True))
+        size = 0
+        if kind == "block":
+            try:
+                size = int(words[2], 0)
+            except (IndexError, ValueError):
+                raise ScriptError("expected '{} address size'".format(words[0]))
+            if not 0 <= size <= capacity:
+                raise ScriptError("block size {} out of range, at most {}".format(size, capacity))
+        return kind, size, pipelined
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  run
+    #  \param script a CommandScript or script text
+    #
+    #  yield (command, response) in script order, response is bytes, a str line or None
+    # ------------------------------------------------------------------------------------------------------------------
+    def run(self, script):
+        if not isinstance(script, CommandScript):
+            script = CommandScript(script)
+        ser = self.umd.port[self.port]
+        rx = self.umd.receiver(self.port)
+        pending = deque()
+
+        def collect():
+            command, kind, size = pending.popleft()
+            if kind == "block":
+                return command, bytes(rx.read(size))
+            elif kind == "line":
+                return command, bytes(rx.readline()).decode("utf-8", "replace")
+            return command, None
+
+        for command in script.commands():
+            try:
+                kind, size, pipelined = self.response_kind(command, len(rx.buffer))
+            except ScriptError as e:
+                # hand out the responses in flight so the port is left idle
+                while pending:
+                    yield collect()
+                raise ScriptError("line {}: {}".format(script.line, e))
+            if not self.terminator:
+                # the UMDv2 answers once the line is complete, that is up to whoever completes it
+                kind, pipelined = None, True
+            # commands which must not overlap wait for everything in flight first
+            while pending and (not pipelined or len(pending) >= self.window):
+                yield collect()
+            ser.write(bytes(command + self.terminator, "utf-8"))
+            pending.append((command, kind, size))
+            if not pipelined:
+                yield collect()
+        while pending:
+            yield collect()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  format_response
+#  \param command
+#  \param response as yielded by ScriptRunner.run
+#
+#  return printable text, blocks are hex dumped with the address of the command
+# ----------------------------------------------------------------------------------------------------------------------
+def format_response(command, response):
+    if response is None:
+        return "> {}\n".format(command)
+    if isinstance(response, str):
+        return "> {}\n{}".format(command, response if response.endswith("\n") else response + "\n")
+    words = command.split()
+    address = int(words[1], 0) if len(words) > 1 else 0
+    lines = ["> {}".format(command)]
+    for offset in range(0, len(response), 16):
+        row = response[offset:offset + 16]
+        lines.append("0x{:06X} {}".format(address + offset, " ".join("{:02X}".format(b) for b in row)))
+    return "\n".join(lines) + "\n"
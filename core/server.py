@@ -0,0 +1,585 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  server.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import itertools
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+from collections import OrderedDict, deque
+
+from core.genesis import genesis
+from core.sms import sms
+from core.tg16 import tg16
+from core.consensus import ConsensusReader
+from core.jobs import JobCancelled
+from core.pipeline import Stage
+
+# wire format, every message in both directions is a frame
+#   frame   : payload length (uint32), kind (uint8), request id (uint32), payload
+#   string  : length (uint16) + utf-8
+# requests
+#   STATUS  : nothing                                   -> RESULT {"devices": {name: {"queued", "busy"}}, "clients"}
+#   READ    : device string, address (uint32), size (uint32)      -> DATA, RESULT
+#   PROGRAM : device string, address (uint32), data               -> RESULT
+#   DUMP    : device string, console string, consensus (uint8)    -> DATA..., RESULT verdict
+# responses
+#   DATA    : offset (uint32) + bytes, streamed as the blocks come off the device
+#   RESULT  : json, ends the request
+#   ERROR   : utf-8 message, ends the request
+FRAME = struct.Struct("<IBI")
+STRING = struct.Struct("<H")
+ADDRESS = struct.Struct("<II")
+OFFSET = struct.Struct("<I")
+
+REQUEST_STATUS = 1
+REQUEST_READ = 2
+REQUEST_PROGRAM = 3
+REQUEST_DUMP = 4
+RESPONSE_DATA = 0x81
+RESPONSE_RESULT = 0x82
+RESPONSE_ERROR = 0x83
+
+DEFAULT_ADDRESS = "unix:" + os.path.join(os.path.expanduser("~"), ".umdv2.sock")
+
+CONSOLES = {"genesis": genesis, "sms": sms, "tg16": tg16}
+
+# power on mapping of the carts of a console, written around the requests of other clients which run while a dump
+# is paused: every dump batch maps its own banks in, a default mapped window is what the other requests expect
+MAPPER_RESTORE = {
+    "genesis": [("write", genesis.bankRegister + 2 * slot, slot) for slot in range(1, genesis.bankSlots)],
+    "sms": [("write", sms.mapperData["sega"][0], 2)],
+    "tg16": [],
+}
+
+# largest READ, the data is streamed back in blocks
+MAX_READ_SIZE = genesis.maxRomSize
+
+
+def pack_string(text):
+    data = text.encode("utf-8")
+    return STRING.pack(len(data)) + data
+
+
+def unpack_string(payload, offset=0):
+    size, = STRING.unpack_from(payload, offset)
+    start = offset + STRING.size
+    return bytes(payload[start:start + size]).decode("utf-8"), start + size
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  parse_address
+#  \param text "unix:/path", a path, "tcp:host:port" or "host:port"
+#
+#  return (socket family, address) of a server address
+# ----------------------------------------------------------------------------------------------------------------------
+def parse_address(text):
+    if text.startswith("unix:"):
+        return socket.AF_UNIX, text[5:]
+    if "/" in text:
+        return socket.AF_UNIX, text
+    if text.startswith("tcp:"):
+        text = text[4:]
+    host, port = text.rsplit(":", 1)
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def receive_exactly(sock, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    done = 0
+    while done < size:
+        count = sock.recv_into(view[done:])
+        if count == 0:
+            raise ConnectionError("connection closed")
+        done += count
+    return data
+
+
+## Client Connection
+#
+#  Server side of one client, frames of several requests may be interleaved but each frame is sent whole
+class ClientConnection:
+
+    ids = itertools.count(1)
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.client_id = next(self.ids)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, kind, request_id, payload=b""):
+        with self.lock:
+            if self.closed:
+                raise JobCancelled()
+            try:
+                self.sock.sendall(FRAME.pack(len(payload), kind, request_id) + bytes(payload))
+            except OSError:
+                self.closed = True
+                raise JobCancelled()
+
+    def result(self, request_id, value):
+        self.send(RESPONSE_RESULT, request_id, json.dumps(value).encode("utf-8"))
+
+    def error(self, request_id, message):
+        self.send(RESPONSE_ERROR, request_id, str(message).encode("utf-8"))
+
+
+## Server Job
+#
+#  Job context handed to the dump engines running for a client: between two batches check() lets the requests of
+#  the other clients of the device run, so a long dump does not lock them out
+class ServerJob:
+
+    def __init__(self, queue, client, restore=()):
+        self.queue = queue
+        self.client = client
+        self.restore = restore
+
+    @property
+    def cancelled(self):
+        return self.client.closed
+
+    def check(self):
+        if self.client.closed:
+            raise JobCancelled()
+        self.queue.yield_turn(self.client, self.restore)
+
+    def progress(self, done, total=0):
+        pass
+
+    def log(self, text):
+        pass
+
+
+## Stream Stage
+#
+#  Pipeline stage sending every block to the client as a DATA frame
+class StreamStage(Stage):
+
+    def __init__(self, client, request_id):
+        self.client = client
+        self.request_id = request_id
+
+    def process(self, offset, block):
+        self.client.send(RESPONSE_DATA, self.request_id, OFFSET.pack(offset) + bytes(block))
+        return block
+
+
+## Device Queue
+#
+#  Requests for one device, queued per client and served round robin by a worker thread which owns the device
+class DeviceQueue:
+
+    def __init__(self, server, name):
+        self.server = server
+        self.name = name
+        self.clients = OrderedDict()
+        self.condition = threading.Condition()
+        self.busy = False
+        self.running = True
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def submit(self, client, task):
+        with self.condition:
+            self.clients.setdefault(client, deque()).append(task)
+            self.condition.notify()
+
+    def queued(self):
+        with self.condition:
+            return sum(len(tasks) for tasks in self.clients.values())
+
+    def drop(self, client):
+        with self.condition:
+            self.clients.pop(client, None)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  next_task
+    #  \param skip client which must not be served, the one yielding its turn
+    #
+    #  take the first task of the next client in turn and move that client to the back, None if nothing is waiting.
+    #  While a client yields, exclusive tasks stay queued: a dump in the middle of another would move its banks.
+    # ------------------------------------------------------------------------------------------------------------------
+    def next_task(self, skip=None):
+        for client in list(self.clients):
+            tasks = self.clients[client]
+            if client is skip or not tasks or (skip is not None and tasks[0].exclusive):
+                continue
+            task = tasks.popleft()
+            self.clients.move_to_end(client)
+            if not tasks:
+                del self.clients[client]
+            return client, task
+        return None
+
+    def work(self):
+        while self.running:
+            with self.condition:
+                item = self.next_task()
+                if item is None:
+                    self.condition.wait(0.5)
+                    continue
+                self.busy = True
+            try:
+                self.run(*item)
+            finally:
+                self.busy = False
+
+    def run(self, client, task):
+        if client.closed:
+            return
+        try:
+            task(ServerJob(self, client, task.restore))
+        except JobCancelled:
+            pass
+        except Exception as e:
+            try:
+                client.error(task.request_id, e)
+            except JobCancelled:
+                pass
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  yield_turn
+    #  \param client the client whose long request is running
+    #  \param restore UMDv2.batch commands putting the cart back on its power on mapping
+    #
+    #  run one waiting request of every other client before the long request goes on, on this same thread. The
+    #  mapping is restored before they run and again after, in case one of them wrote to a mapper register.
+    # ------------------------------------------------------------------------------------------------------------------
+    def yield_turn(self, client, restore=()):
+        served = set()
+        while True:
+            with self.condition:
+                item = self.next_task(skip=client)
+            if item is None or item[0] in served:
+                if item is not None:
+                    # went round once, put it back at the front of its queue for the next turn
+                    with self.condition:
+                        self.clients.setdefault(item[0], deque()).appendleft(item[1])
+                break
+            if restore and not served:
+                self.server.umd.batch(self.name, restore)
+            served.add(item[0])
+            self.run(*item)
+        if restore and served:
+            self.server.umd.batch(self.name, restore)
+
+
+## Task
+#
+#  A queued request, request_id is kept to report errors. Exclusive tasks switch mapper banks and only run on their own,
+#  restore is the power on mapping they put back whenever they let other requests run.
+class Task:
+
+    def __init__(self, request_id, function, *args, exclusive=False, restore=()):
+        self.request_id = request_id
+        self.function = function
+        self.args = args
+        self.exclusive = exclusive
+        self.restore = restore
+
+    def __call__(self, job):
+        return self.function(job, self.request_id, *self.args)
+
+
+## Request Handler
+#
+#  Reads the requests of one client and queues them on their device, STATUS is answered right away
+class RequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server.umd_server
+        client = ClientConnection(self.request)
+        server.add_client(client)
+        try:
+            while True:
+                size, kind, request_id = FRAME.unpack(receive_exactly(self.request, FRAME.size))
+                payload = receive_exactly(self.request, size)
+                server.dispatch(client, kind, request_id, payload)
+        except (ConnectionError, OSError, JobCancelled):
+            pass
+        finally:
+            client.closed = True
+            server.remove_client(client)
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+## UMDv2 Server
+#
+#  Owns the devices of a UMDv2 object and shares them with any number of clients over a Unix socket or localhost TCP
+class UMDServer:
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  __init__
+    #  \param umd a UMDv2 whose devices are served, devices attached later are served too
+    #  \param address see parse_address
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self, umd, address=DEFAULT_ADDRESS):
+        self.umd = umd
+        self.address = address
+        self.queues = {}
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+        family, target = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(target):
+                self.remove_stale(target)
+            self.server = UnixServer(target, RequestHandler)
+        else:
+            self.server = TCPServer(target, RequestHandler)
+            if address.endswith(":0"):
+                self.address = "{}:{}".format(*self.server.server_address)
+        self.server.umd_server = self
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  remove_stale
+    #  \param path an existing Unix socket path
+    #
+    #  remove the socket left behind by a server which is gone, raise OSError if a server still answers on it
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def remove_stale(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(path)
+            return
+        finally:
+            probe.close()
+        raise OSError("a UMDv2 server is already running on " + path)
+
+    def add_client(self, client):
+        with self.lock:
+            self.clients.add(client)
+
+    def remove_client(self, client):
+        with self.lock:
+            self.clients.discard(client)
+            queues = list(self.queues.values())
+        for queue in queues:
+            queue.drop(client)
+
+    def queue(self, name):
+        with self.lock:
+            if name not in self.umd.port:
+                raise KeyError("no device " + name)
+            if name not in self.queues:
+                self.queues[name] = DeviceQueue(self, name)
+            return self.queues[name]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  status
+    #
+    #  return the devices with their queue lengths
+    # ------------------------------------------------------------------------------------------------------------------
+    def status(self):
+        devices = {}
+        for name in sorted(self.umd.port):
+            queue = self.queues.get(name)
+            devices[name] = {"queued": queue.queued() if queue else 0, "busy": bool(queue and queue.busy)}
+        return {"devices": devices, "clients": len(self.clients)}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  dispatch
+    #
+    #  decode a request and queue it on its device
+    # ------------------------------------------------------------------------------------------------------------------
+    def dispatch(self, client, kind, request_id, payload):
+        try:
+            if kind == REQUEST_STATUS:
+                client.result(request_id, self.status())
+                return
+            device, offset = unpack_string(payload)
+            if kind == REQUEST_READ:
+                address, size = ADDRESS.unpack_from(payload, offset)
+                if size > MAX_READ_SIZE:
+                    raise ValueError("read of {} bytes exceeds the {} byte limit".format(size, MAX_READ_SIZE))
+                task = Task(request_id, self.read, client, device, address, size)
+            elif kind == REQUEST_PROGRAM:
+                address, = OFFSET.unpack_from(payload, offset)
+                task = Task(request_id, self.program, client, device, address, payload[offset + OFFSET.size:])
+            elif kind == REQUEST_DUMP:
+                console, offset = unpack_string(payload, offset)
+                if console not in CONSOLES:
+                    raise ValueError("cannot dump {} carts".format(console))
+                task = Task(request_id, self.dump, client, device, console, bool(payload[offset]), exclusive=True,
+                            restore=MAPPER_RESTORE[console])
+            else:
+                raise ValueError("unknown request {}".format(kind))
+            self.queue(device).submit(client, task)
+        except (KeyError, ValueError, IndexError, struct.error) as e:
+            client.error(request_id, e)
+
+    def read(self, job, request_id, client, device, address, size):
+        block_size = self.umd.settings.get(device, (self.umd.baudrate, self.umd.block_size))[1]
+        block = bytearray(block_size)
+        for offset in range(0, size, block_size):
+            view = memoryview(block)[:min(block_size, size - offset)]
+            self.umd.tuned_batch(device, [("read", address + offset, 0, len(view))], view)
+            client.send(RESPONSE_DATA, request_id, OFFSET.pack(offset) + view)
+            job.check()
+        client.result(request_id, {"size": size})
+
+    def program(self, job, request_id, client, device, address, data):
+        self.umd.write_block(device, address, data)
+        client.result(request_id, {"size": len(data)})
+
+    def dump(self, job, request_id, client, device, console, consensus):
+        reader = ConsensusReader(self.umd, device) if consensus else None
+        image, verdict = CONSOLES[console]().dumpRom(self.umd, device, stages=[StreamStage(client, request_id)],
+                                                     job=job, consensus=reader)
+        if reader is not None:
+            verdict["unresolved"] = reader.unresolved
+        client.result(request_id, verdict)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  start
+    #
+    #  serve from a background thread, serve_forever() serves from the calling thread
+    # ------------------------------------------------------------------------------------------------------------------
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for queue in list(self.queues.values()):
+            queue.running = False
+        family, target = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.remove(target)
+
+
+## Server Error
+#
+#  Raised by the client when the server answers a request with an error
+class ServerError(Exception):
+    pass
+
+
+## UMDv2 Client
+#
+#  Blocking client of a UMDServer, one request at a time per connection. Open one client per thread to use several
+#  devices at once, the server schedules them fairly.
+class UMDClient:
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        family, target = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(target)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  request
+    #  \param kind
+    #  \param payload
+    #  \param on_data function(offset, data) called for every DATA frame
+    #
+    #  send a request and wait for its result
+    # ------------------------------------------------------------------------------------------------------------------
+    def request(self, kind, payload=b"", on_data=None):
+        with self.lock:
+            request_id = next(self.ids)
+            self.sock.sendall(FRAME.pack(len(payload), kind, request_id) + payload)
+            while True:
+                size, kind, response_id = FRAME.unpack(receive_exactly(self.sock, FRAME.size))
+                data = receive_exactly(self.sock, size)
+                if response_id != request_id:
+                    continue
+                if kind == RESPONSE_DATA:
+                    if on_data is not None:
+                        offset, = OFFSET.unpack_from(data)
+                        on_data(offset, memoryview(data)[OFFSET.size:])
+                elif kind == RESPONSE_RESULT:
+                    return json.loads(data.decode("utf-8"))
+                else:
+                    raise ServerError(data.decode("utf-8", "replace"))
+
+    def status(self):
+        return self.request(REQUEST_STATUS)
+
+    def read_block(self, device, address, size):
+        data = bytearray(size)
+
+        def store(offset, block):
+            data[offset:offset + len(block)] = block
+        self.request(REQUEST_READ, pack_string(device) + ADDRESS.pack(address, size), store)
+        return bytes(data)
+
+    def program(self, device, address, data):
+        return self.request(REQUEST_PROGRAM, pack_string(device) + OFFSET.pack(address) + bytes(data))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  dump
+    #  \param device
+    #  \param console "genesis", "sms" or "tg16"
+    #  \param sink optional file object the dump is written to as it streams in
+    #  \param progress optional function(bytes received)
+    #  \param consensus True to have the server read every block until enough reads agree
+    #
+    #  dump the cart of a device, return (image, verdict)
+    # ------------------------------------------------------------------------------------------------------------------
+    def dump(self, device, console, sink=None, progress=None, consensus=False):
+        image = bytearray()
+
+        def store(offset, block):
+            image[offset:offset + len(block)] = block
+            if sink is not None:
+                sink.write(block)
+            if progress is not None:
+                progress(len(image))
+        verdict = self.request(REQUEST_DUMP, pack_string(device) + pack_string(console) + bytes([consensus]), store)
+        return image, verdict
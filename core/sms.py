@@ -24,8 +24,7 @@
 #
 ########################################################################
 
-import os
-import struct
+from core.romimage import RomImage
 
 ## ROM Operations
 #
@@ -43,6 +42,21 @@ class sms:
     readChunkSize = 2048
     progressBarSize = 64
     
+    # banks are 16KB, the first 32KB are read without touching the mapper
+    # and every other bank through slot 2 at 0x8000
+    bankSize = 0x4000
+    fixedSize = 0x8000
+    maxRomSize = 0x100000
+    sampleSize = 256
+    banksPerRequest = 8
+    
+    # mapper : (slot 2 bank register, slot 2 window)
+    mapperData = {
+        "sega"        : (0xFFFF, 0x8000),
+        "codemasters" : (0x8000, 0x8000),
+        "korean"      : (0xA000, 0x8000),
+    }
+    
     # relationship between rom size indicator in ROM header and header location
     # sizecode : (romSize, skipChecksumStart, skipChecksumEnd)
     romSizeData = {
@@ -53,7 +67,7 @@ class sms:
         14 : (65536,   0x7FEF, 0x8000),
         15 : (131072,  0x7FEF, 0x8000),
         0  : (262144,  0x7FEF, 0x8000),
-        1  : (525288,  0x7FEF, 0x8000),
+        1  : (524288,  0x7FEF, 0x8000),
         2  : (1048576, 0x7FEF, 0x8000), 
     }
     
@@ -76,93 +90,223 @@ class sms:
 ########################################################################    
 ## checksumSMS(self, file):
 #  \param self self
-#  \param file the rom to verify
+#  \param file the rom to verify, a file name or a RomImage
 #
 ########################################################################
     def checksum(self, filename):
         
+        image = RomImage.load(filename)
+        self.checksumRom, self.checksumCalc = image.cached("sms.checksum", lambda: self.sumImage(image))
+        return self.checksumCalc
+
+
+########################################################################    
+## sumImage(self, image):
+#  \param self self
+#  \param image a RomImage
+#
+#  Return (header checksum, calculated checksum)
+########################################################################
+    def sumImage(self, image):
+        
+        # read the ROM header's checksum value
+        checksumRom = int.from_bytes(image.view(0x7FFA, 2), byteorder="little")
+        
+        # read the ROM header's size info, some games put a smaller 
+        # value here to speed up the checksum calculation
+        romSizeVal = image.view(0x7FFF, 1)[0] & 0x0F
+        romSize, lowerBound, upperBound = self.checksumRange(romSizeVal, image.size)
+        
         # SMS checksum skips the header portion (16 bytes at 0x7FF0), but 
         # starts calculating at 0
-        pos = 0
-        self.checksumCalc = 0
-        fileSize = os.path.getsize(filename)
-
-        with open(filename, "rb") as f:
-            
-            # read the ROM header's checksum value
-            f.seek( 0x7FFA, 0)
-            data = f.read(2)
-            thisWord = data[0],data[1]
-            self.checksumRom = int.from_bytes(thisWord, byteorder="little")
-            
-            # read the ROM header's size info, some games put a smaller 
-            # value here to speed up the checksum calculation
-            f.seek( 0x7FFF, 0)
-            data = f.read(1)
-            romSizeVal = int.from_bytes(data, byteorder="little") & 0x0F
-            
-            romSize = self.romSizeData.get(romSizeVal)[0]
-            lowerBound = self.romSizeData.get(romSizeVal)[1]
-            upperBound = self.romSizeData.get(romSizeVal)[2]
-            
-            # jump back to beginning of file
-            f.seek(0, 0)
-            
-            while( pos < romSize ):
-                if( ( romSize - pos ) >= self.readChunkSize):
-                    sizeOfRead = self.readChunkSize
-                else:
-                    sizeOfRead = ( romSize - pos )
-                    
-                data = f.read(sizeOfRead)
-                
-                i = 0
-                while i < sizeOfRead:
-                    # check for lower and upper bound
-                    if lowerBound < (pos + i) < upperBound:
-                        # print("0x{0:X}".format(pos + i))
-                        i += 1
-                    else:
-                        # int.from_bytes wasn't happy with an 8bit value
-                        thisByte = data[i],0
-                        intVal = int.from_bytes(thisByte, byteorder="little") & 0xFF
-                        self.checksumCalc = (self.checksumCalc + intVal) & 0xFFFF
-                        i += 1
-                
-                pos += sizeOfRead
+        checksumCalc = sum(image.view(0, min(romSize, lowerBound + 1)))
+        if upperBound < romSize:
+            checksumCalc += sum(image.view(upperBound, romSize - upperBound))
+        return checksumRom, checksumCalc & 0xFFFF
 
 
 ########################################################################    
-## decodeHeader
+## checksumRange(self, romSizeVal, dumpSize):
 #  \param self self
+#  \param romSizeVal the size code, low nibble of 0x7FFF
+#  \param dumpSize the size of the dump
 #  
-#  Read and format the ROM header for Sega Master System cartridge
+#  Return (romSize, skipChecksumStart, skipChecksumEnd) of a size code.
+#  Headerless, Korean and odd carts carry codes which are not in
+#  romSizeData, their checksum covers the whole dump.
 ########################################################################
-    def formatHeader(self, filename):
+    def checksumRange(self, romSizeVal, dumpSize):
         
-        # clear current rom info dictionnary
-        self.headerData.clear()
-        with open(filename, "rb") as f:
-            
-        # get Trademark
-            self.headerData.update({"Trademark": f.read(8).decode("utf-8", "replace") })
-        # get checksum
-            f.read(2) # 2 reserved bytes here, skip
-            data = int.from_bytes(f.read(2), byteorder="little" )
-            self.headerData.update({"Checksum": [data, hex(data)] })
-        # get product code and version
-            data = int.from_bytes(f.read(3), byteorder="little" ) & 0x0FFFFF
-            self.headerData.update({"Product Code": [data, hex(data)] })
-            
-            version = (data >> 20) & 0x0F
-            self.headerData.update({"Version": version })
-        # get region and size
-            data = int.from_bytes(f.read(1), byteorder="little" )
-            regionVal = (data & 0xF0) >> 4
-            print("{} {}".format(data, regionVal))
-            self.headerData.update({"Region": self.regionData.get(regionVal) })
-
-            romSizeVal = self.romSizeData.get((data & 0x0F))[0]
-            self.headerData.update({"Size": [romSizeVal, hex(romSizeVal)] })
+        return self.romSizeData.get(romSizeVal, (dumpSize, 0x7FEF, 0x8000))
+
+
+########################################################################    
+## formatHeader
+#  \param self self
+#  
+#  Read and format the ROM header for Sega Master System cartridge,
+#  filename may also be a RomImage
+########################################################################
+    def formatHeader(self, filename):
         
+        image = RomImage.load(filename)
+        header = image.cached("sms.header",
+                              lambda: dict(self.decodeHeader(image.view(self.headerAddress, self.headerSize))))
+        self.headerData = dict(header)
         return self.headerData
+
+
+########################################################################    
+## decodeHeader
+#  \param self self
+#  \param data the headerSize bytes found at headerAddress
+#  
+#  Decode a raw Sega Master System header
+########################################################################
+    def decodeHeader(self, data):
+        
+        # fresh dictionnary per call, jobs decode headers concurrently
+        header = {}
+        data = bytes(data)
+        
+    # get Trademark
+        header.update({"Trademark": data[0:8].decode("utf-8", "replace") })
+    # get checksum, 2 reserved bytes before it
+        value = int.from_bytes(data[10:12], byteorder="little" )
+        header.update({"Checksum": [value, hex(value)] })
+    # get product code and version, the version is the upper nibble of the third byte
+        value = int.from_bytes(data[12:15], byteorder="little" )
+        productCode = value & 0x0FFFFF
+        header.update({"Product Code": [productCode, hex(productCode)] })
+        
+        version = (value >> 20) & 0x0F
+        header.update({"Version": version })
+    # get region and size
+        value = data[15]
+        regionVal = (value & 0xF0) >> 4
+        header.update({"Region": self.regionData.get(regionVal) })
+        
+        romSizeVal = self.romSizeData.get((value & 0x0F), (0,))[0]
+        header.update({"Size": [romSizeVal, hex(romSizeVal)] })
+        
+        self.headerData = header
+        return header
+
+
+########################################################################    
+## detectSize
+#  \param self self
+#  \param umd a connected UMDv2
+#  \param port the serial port name
+#  \param mapper a key of mapperData
+#  \param consensus optional ConsensusReader for the samples
+#  
+#  Find the ROM size from mirroring with a single batched request: a
+#  small sample of every power of two bank is compared against bank 0,
+#  the first bank that mirrors bank 0 is the size of the ROM. The header
+#  size is only used for 48KB carts, which do not mirror on a power of 2.
+########################################################################
+    def detectSize(self, umd, port, mapper="sega", consensus=None):
+        
+        register, window = self.mapperData[mapper]
+        candidates = []
+        banks = 2
+        while banks * self.bankSize <= self.maxRomSize:
+            candidates.append(banks)
+            banks *= 2
+        
+        samples = {}
+        commands = []
+        for address in (0x0000, 0x2000, 0x4000):
+            samples[address] = bytearray(self.sampleSize)
+            commands.append(("read", address, memoryview(samples[address])))
+        header = bytearray(self.headerSize)
+        commands.append(("read", self.headerAddress, memoryview(header)))
+        for bank in [0] + candidates:
+            samples[bank * self.bankSize + window] = bytearray(self.sampleSize)
+            commands.append(("write", register, bank & 0xFF))
+            commands.append(("read", window, memoryview(samples[bank * self.bankSize + window])))
+        if consensus is not None:
+            consensus.batch(commands)
+        else:
+            umd.batch(port, commands)
+        
+        if samples[0x2000] == samples[0x0000]:
+            return 0x2000
+        if samples[0x4000] == samples[0x0000]:
+            return 0x4000
+        
+        size = self.maxRomSize
+        for bank in candidates:
+            if samples[bank * self.bankSize + window] == samples[window]:
+                size = bank * self.bankSize
+                break
+        
+        headerSize = self.romSizeData.get(header[15] & 0x0F, (0,))[0]
+        if headerSize == 0xC000 and size == 0x10000:
+            return headerSize
+        return size
+
+
+########################################################################    
+## planDump
+#  \param self self
+#  \param romSize
+#  \param mapper a key of mapperData
+#  \param blockSize largest single read
+#  
+#  Return the list of batches needed to read romSize bytes, each batch is
+#  a list of UMDv2.batch commands with the image offset of every read
+########################################################################
+    def planDump(self, romSize, mapper="sega", blockSize=2048):
+        
+        register, window = self.mapperData[mapper]
+        
+        def reads(address, offset, size):
+            return [("read", address + pos, offset + pos, min(blockSize, size - pos))
+                    for pos in range(0, size, blockSize)]
+        
+        batches = [reads(0, 0, min(romSize, self.fixedSize))]
+        banks = list(range(self.fixedSize // self.bankSize, -(-romSize // self.bankSize)))
+        for first in range(0, len(banks), self.banksPerRequest):
+            batch = []
+            for bank in banks[first:first + self.banksPerRequest]:
+                offset = bank * self.bankSize
+                batch.append(("write", register, bank & 0xFF))
+                batch += reads(window, offset, min(self.bankSize, romSize - offset))
+            batches.append(batch)
+        return batches
+
+
+########################################################################    
+## dumpRom
+#  \param self self
+#  \param umd a connected UMDv2
+#  \param port the serial port name
+#  \param mapper "sega", "codemasters" or "korean"
+#  \param stages extra pipeline stages, e.g. a FileWriterStage
+#  \param job optional JobContext for progress and cancellation
+#  \param consensus optional ConsensusReader to read every block until
+#         enough reads agree
+#  
+#  Dump an SMS or Game Gear cart reading only the banks it has, mapper
+#  writes and bank reads go out in batches of banksPerRequest banks.
+#  Return (image, verdict) with the checksum and digests of the dump.
+########################################################################
+    def dumpRom(self, umd, port, mapper="sega", stages=None, job=None, consensus=None):
+        
+        # the pipeline stages use this module, import it here to avoid a cycle
+        from core.pipeline import DumpPipeline, SmsChecksumStage, DigestStage
+        
+        romSize = self.detectSize(umd, port, mapper, consensus)
+        blockSize = umd.settings.get(port, (umd.baudrate, umd.block_size))[1]
+        image = bytearray(romSize)
+        pipeline = DumpPipeline([SmsChecksumStage(), DigestStage()] + list(stages or []))
+        
+        try:
+            umd.run_plan(port, self.planDump(romSize, mapper, blockSize), image, pipeline, job, consensus)
+        finally:
+            # leave slot 2 on its power on bank
+            umd.write_byte(port, self.mapperData[mapper][0], 2)
+            verdict = pipeline.finish()
+        return image, verdict
@@ -37,6 +37,17 @@ class snes:
             
     headerSize = 64
 
+    # offsets in the 64 bytes at the header address, the last 32 bytes
+    # are the interrupt vectors of the bank
+    titleSize = 21
+    mapModeOffset = 0x15
+    complementOffset = 0x1C
+    checksumOffset = 0x1E
+    resetVectorOffset = 0x3C
+
+    # bit 0 of the map mode is set on HiROM carts
+    mapModes = {"LoROM" : 0, "HiROM" : 1}
+
     checksumRom = 0
     checksumCalc = 0
     romInfo = {}
@@ -66,46 +77,74 @@ class snes:
 ########################################################################    
 ## readHeader
 #  \param self self
+#  \param umd a connected UMDv2
+#  \param port the serial port name
 #  
-#  Read and format the ROM header for Super Nintendo cartridge
+#  Read and format the ROM header for Super Nintendo cartridge, the
+#  title is tested in the receive buffer without copying or decoding it
 ########################################################################
-    def readHeader(self):
+    def readHeader(self, umd, port):
         
-        # clear current rom info dictionnary
-        self.romInfo.clear()
+        # new rom info dictionnary, the class one stays empty
+        self.romInfo = {}
 
         # header data could be in one of two places, 0x7FC0 or 0xFFC0
         # search for 21 ASCII characters at the beginning of the header
-        
-        # check for valid header at 0x7FC0
-        cmd = "rdbblk 0x7FC0 21\r\n"
-        self.serialPort.write(bytes(cmd,"utf-8"))
-        response = self.serialPort.read(21)
-
-        headerLo = True
-        for testChar in response:
-            if not(0x20 <= testChar <= 0x7F):
-                print("invalid ascii char {0} found in 0x7FC0 header".format(testChar))
-                headerLo = False
-                break
-        
-        if headerLo:
-            response = response.decode("utf-8", "replace")
-            print("{0} is plausibly the game's title found in 0x7FC0 header".format(response))
-
-        else:
-            # check for valid header at 0x7FC0
-            cmd = "rdbblk 0x7FF0 21\r\n"
-            self.serialPort.write(bytes(cmd,"utf-8"))
-            response = self.serialPort.read(21)
-
-            headerHi = True
+        for mapping in ("LoROM", "HiROM"):
+            address = self.header[mapping]
+            response = umd.read_block(port, address, 21)
+            
+            valid = len(response) == 21
             for testChar in response:
                 if not(0x20 <= testChar <= 0x7F):
-                    print("invalid ascii char {0} found in 0xFFC0 header".format(testChar))
-                    headerLo = False
+                    print("invalid ascii char {0} found in 0x{1:X} header".format(testChar, address))
+                    valid = False
                     break
+            
+            if valid:
+                title = bytes(response).decode("utf-8", "replace")
+                print("{0} is plausibly the game's title found in 0x{1:X} header".format(title, address))
+                self.romInfo.update({"Mapping": mapping, "Title": title})
+                break
+        
+        return self.romInfo
 
 
-
-
+########################################################################    
+## decodeHeader
+#  \param self self
+#  \param data the headerSize bytes found at one of the header addresses
+#  
+#  Decode a raw Super Nintendo header, from a file or straight off a
+#  cart
+########################################################################
+    def decodeHeader(self, data):
+        
+        # new dictionnary for every header
+        header = {}
+        data = bytes(data)
+        
+    # get title, padded with spaces
+        header.update({"Title": data[:self.titleSize].decode("utf-8", "replace") })
+    # get map mode, speed in bit 4
+        value = data[self.mapModeOffset]
+        header.update({"Map Mode": [value, hex(value)] })
+    # get cartridge type, ROM size and SRAM size, sizes are log2 of KB
+        header.update({"Cartridge Type": data[self.mapModeOffset + 1] })
+        header.update({"ROM Size": 1024 << data[self.mapModeOffset + 2] if data[self.mapModeOffset + 2] < 16 else 0 })
+        header.update({"SRAM Size": 1024 << data[self.mapModeOffset + 3] if 0 < data[self.mapModeOffset + 3] < 16 else 0 })
+    # get region and version
+        header.update({"Region": data[self.mapModeOffset + 4] })
+        header.update({"Version": data[self.mapModeOffset + 6] })
+    # get checksum and its complement
+        value = struct.unpack_from("<H", data, self.complementOffset)[0]
+        header.update({"Complement": [value, hex(value)] })
+        value = struct.unpack_from("<H", data, self.checksumOffset)[0]
+        header.update({"Checksum": [value, hex(value)] })
+    # get the emulation mode reset vector
+        if len(data) >= self.headerSize:
+            value = struct.unpack_from("<H", data, self.resetVectorOffset)[0]
+            header.update({"Reset Vector": [value, hex(value)] })
+        
+        self.romInfo = header
+        return header
@@ -0,0 +1,303 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+########################################################################
+# \file  tg16.py
+# \author René Richard
+# \brief This program allows to read and write to various game cartridges
+#        including: Genesis, Coleco, SMS, PCE - with possibility for
+#        future expansion.
+########################################################################
+# \copyright This file is part of Universal Mega Dumper.
+#
+#   Universal Mega Dumper is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Universal Mega Dumper is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Universal Mega Dumper.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+import hashlib
+import zlib
+
+from core.romimage import RomImage
+
+## ROM Operations
+#
+#  All TurboGrafx-16 / PC Engine specific functions, HuCards have no
+#  header so everything is worked out from the reset vector and mirroring
+
+class tg16:
+
+    # bank 0 is mapped at 0xE000 on reset, the reset vector is the last
+    # word of the first 8KB bank
+    bankSize = 0x2000
+    resetVector = 0x1FFE
+    resetBase = 0xE000
+
+    # first instruction of nearly every HuCard: SEI, CSH or CLD
+    resetOpcodes = (0x78, 0xD4, 0xD8)
+
+    # copiers put a 512 byte header in front of the ROM
+    copierHeaderSize = 512
+
+    # HuCards decode 1MB, 384KB carts put their last 128KB at 0x40000
+    # mirrored at 0x60000
+    maxRomSize = 0x100000
+    splitSize = 0x60000
+    sampleSize = 256
+
+    # US HuCards have their data lines reversed, D0 is D7 and so on
+    reverseTable = bytes(int("{:08b}".format(value)[::-1], 2) for value in range(256))
+
+    romInfo = {}
+
+########################################################################
+## The Constructor
+#  \param self self
+#
+########################################################################
+    def __init__(self):
+        pass
+
+
+########################################################################
+## reverseBits(self, data):
+#  \param self self
+#  \param data bytes like
+#
+#  Return data with the bits of every byte reversed, US <-> Japan
+########################################################################
+    def reverseBits(self, data):
+
+        return bytes(data).translate(self.reverseTable)
+
+
+########################################################################
+## bootScore(self, data):
+#  \param self self
+#  \param data the first 8KB bank, or more
+#
+#  Score how much data looks like a bootable bank 0: a reset vector in
+#  the bank 0 window and a typical first instruction where it points
+########################################################################
+    def bootScore(self, data):
+
+        if len(data) < self.bankSize:
+            return 0
+        vector = data[self.resetVector] | (data[self.resetVector + 1] << 8)
+        if vector < self.resetBase:
+            return 0
+        if data[vector - self.resetBase] in self.resetOpcodes:
+            return 2
+        return 1
+
+
+########################################################################
+## isReversed(self, data):
+#  \param self self
+#  \param data the first 8KB bank of a header-less image
+#
+#  Return True if the image has its bits reversed, an image which boots
+#  either way is taken as it is
+########################################################################
+    def isReversed(self, data):
+
+        bank = bytes(data[:self.bankSize])
+        return self.bootScore(self.reverseBits(bank)) > self.bootScore(bank)
+
+
+########################################################################
+## mirrorSize(self, data):
+#  \param self self
+#  \param data a header-less image
+#
+#  Return the real ROM size of an image which may be an overdump: the
+#  smallest power of two which the rest of the image repeats, or 384KB
+#  for a 512KB image whose last 128KB mirror each other
+########################################################################
+    def mirrorSize(self, data):
+
+        view = memoryview(data)
+        size = len(view)
+        while size > self.bankSize and size % 2 == 0:
+            half = size // 2
+            if view[:half] != view[half:size]:
+                break
+            size = half
+        if size == 0x80000 and view[0x40000:0x60000] == view[0x60000:0x80000]:
+            return self.splitSize
+        return size
+
+
+########################################################################
+## normalize(self, filename):
+#  \param self self
+#  \param filename the ROM file name or a RomImage
+#
+#  Return a RomImage of the ROM as a Japanese HuCard would read it: no
+#  copier header, bits in order and no mirrors. The result is cached by
+#  the source image.
+########################################################################
+    def normalize(self, filename):
+
+        image = RomImage.load(filename)
+
+        def compute():
+            view = image.view()
+            if len(view) % self.bankSize == self.copierHeaderSize:
+                view = view[self.copierHeaderSize:]
+            data = view.tobytes()
+            if self.isReversed(data):
+                data = data.translate(self.reverseTable)
+            return RomImage(data=data[:self.mirrorSize(data)])
+        return image.cached("tg16.normal", compute)
+
+
+########################################################################
+## formatHeader
+#  \param self self
+#  \param filename the ROM file name or a RomImage
+#
+#  HuCards have no header, report what can be told from the image itself
+########################################################################
+    def formatHeader(self, filename):
+
+        image = RomImage.load(filename)
+        normal = self.normalize(image)
+        bank = normal.view(0, self.bankSize)
+        copierHeader = len(image) % self.bankSize == self.copierHeaderSize
+        self.romInfo = {}
+        self.romInfo.update({"Copier Header": copierHeader})
+        self.romInfo.update({"Bit Reversed": self.isReversed(image.view(self.copierHeaderSize if copierHeader else 0))})
+        self.romInfo.update({"ROM Size": normal.size})
+        if len(bank) == self.bankSize:
+            vector = bank[self.resetVector] | (bank[self.resetVector + 1] << 8)
+            self.romInfo.update({"Reset Vector": hex(vector)})
+        return self.romInfo
+
+
+########################################################################
+## md5(self, filename):
+#  \param self self
+#  \param filename the ROM file name or a RomImage
+#
+#  Return the md5 hex digest of the normalized ROM
+########################################################################
+    def md5(self, filename):
+
+        normal = self.normalize(filename)
+        return normal.cached("digest.md5", lambda: hashlib.md5(normal.view()).hexdigest())
+
+
+########################################################################
+## crc32(self, filename):
+#  \param self self
+#  \param filename the ROM file name or a RomImage
+#
+#  Return the crc32 of the normalized ROM, as listed in ROM databases
+########################################################################
+    def crc32(self, filename):
+
+        normal = self.normalize(filename)
+        return normal.cached("digest.crc32", lambda: "{:08x}".format(zlib.crc32(normal.view())))
+
+
+########################################################################
+## convert(self, ifile, ofile, reverse=False):
+#  \param self self
+#  \param ifile the ROM file or a RomImage
+#  \param ofile
+#  \param reverse True to write a US (bit reversed) image
+#
+#  Write the normalized ROM, or its bit reversed version
+########################################################################
+    def convert(self, ifile, ofile, reverse=False):
+
+        data = self.normalize(ifile).view()
+        with open(ofile, "wb") as fwrite:
+            fwrite.write(self.reverseBits(data) if reverse else data)
+
+
+########################################################################
+## detectSize
+#  \param self self
+#  \param umd a connected UMDv2
+#  \param port the serial port name
+#  \param consensus optional ConsensusReader for the samples
+#
+#  Find the ROM size and the bit order of a cart with a single batched
+#  request: the reset bank, a sample at every power of two and the two
+#  halves of the 384KB split area. Return (romSize, reversed).
+########################################################################
+    def detectSize(self, umd, port, consensus=None):
+
+        bank = bytearray(self.bankSize)
+        commands = [("read", 0, memoryview(bank))]
+        samples = {}
+        addresses = [self.bankSize << n for n in range((self.maxRomSize // self.bankSize).bit_length() - 1)]
+        for address in [0x40000, 0x60000] + addresses:
+            samples[address] = bytearray(self.sampleSize)
+            commands.append(("read", address, memoryview(samples[address])))
+        if consensus is not None:
+            consensus.batch(commands)
+        else:
+            umd.batch(port, commands)
+
+        size = self.maxRomSize
+        for address in addresses:
+            if samples[address] == bank[:self.sampleSize]:
+                size = address
+                break
+        if size == 0x80000 and samples[0x40000] != bank[:self.sampleSize] and samples[0x60000] == samples[0x40000]:
+            size = self.splitSize
+        return size, self.isReversed(bank)
+
+
+########################################################################
+## dumpRom
+#  \param self self
+#  \param umd a connected UMDv2
+#  \param port the serial port name
+#  \param stages extra pipeline stages, e.g. a FileWriterStage
+#  \param job optional JobContext for progress and cancellation
+#  \param consensus optional ConsensusReader to read every block until
+#         enough reads agree
+#  \param bitReversed True for a US HuCard, None to tell from the reset
+#         bank
+#
+#  Dump a HuCard without its mirrors, US carts are bit reversed on the
+#  fly so the file and the digests match the usual ROM databases.
+#  Return (image, verdict) with the digests of the dump.
+########################################################################
+    def dumpRom(self, umd, port, stages=None, job=None, consensus=None, bitReversed=None):
+
+        # the pipeline stages use this module, import it here to avoid a cycle
+        from core.pipeline import DumpPipeline, BitReverseStage, DigestStage
+
+        romSize, detected = self.detectSize(umd, port, consensus)
+        if bitReversed is None:
+            bitReversed = detected
+        blockSize = umd.settings.get(port, (umd.baudrate, umd.block_size))[1]
+        image = bytearray(romSize)
+        pipeline = DumpPipeline(([BitReverseStage()] if bitReversed else []) +
+                                [DigestStage()] + list(stages or []))
+        plan = [[("read", offset, offset, min(blockSize, romSize - offset))
+                 for offset in range(start, min(start + self.bankSize * 8, romSize), blockSize)]
+                for start in range(0, romSize, self.bankSize * 8)]
+
+        try:
+            umd.run_plan(port, plan, image, pipeline, job, consensus)
+        finally:
+            verdict = pipeline.finish()
+        verdict.update({"reversed": bitReversed})
+        if bitReversed:
+            image = self.reverseBits(image)
+        return image, verdict
@@ -0,0 +1,55 @@
+import random
+
+from core.archive import ArchiveStore, ArchiveWriter, ArchiveRom, Chunker, GEAR
+
+
+def chunks(data, step):
+    chunker = Chunker()
+    result = []
+    for offset in range(0, len(data), step):
+        result += chunker.feed(data[offset:offset + step])
+    return result + list(chunker.flush())
+
+
+def test_streamed_chunks_match_one_call():
+    rng = random.Random(4)
+    # padding runs never cut, so they end on max_size chunks
+    data = rng.randbytes(0x60000) + bytes(0x18000) + b"\xFF" * 0x9000 + rng.randbytes(0x12345)
+    expected = chunks(data, len(data))
+    assert b"".join(expected) == data
+    assert any(len(chunk) == 65536 for chunk in expected)
+    for step in (7, 1000, 2048, 8191, 65536, 100000):
+        assert chunks(data, step) == expected
+
+
+def reference_cuts(data, min_size=2048, avg_bits=13, max_size=65536):
+    # one byte at a time, the way the gear hash is defined
+    mask = ((1 << avg_bits) - 1) << (32 - avg_bits)
+    cuts = []
+    start = 0
+    while start < len(data):
+        h = 0
+        end = min(len(data), start + max_size)
+        cut = end
+        for i in range(start + min_size, end):
+            h = ((h << 1) + GEAR[data[i]]) & 0xFFFFFFFF
+            if not h & mask:
+                cut = i + 1
+                break
+        cuts.append(cut - start)
+        start = cut
+    return cuts
+
+
+def test_chunks_follow_the_gear_hash():
+    data = random.Random(5).randbytes(0x30000) + bytes(0x12000) + random.Random(6).randbytes(0x5432)
+    assert [len(chunk) for chunk in chunks(data, 4096)] == reference_cuts(data)
+
+
+def test_archive_round_trip(tmp_path):
+    data = random.Random(6).randbytes(0x40000)
+    store = ArchiveStore(str(tmp_path))
+    with ArchiveWriter(store, "rom") as writer:
+        for offset in range(0, len(data), 2048):
+            writer.write(data[offset:offset + 2048])
+    assert ArchiveRom(store, "rom").read(0, len(data)) == data
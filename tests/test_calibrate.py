@@ -0,0 +1,117 @@
+import random
+import types
+
+from core.calibrate import Calibrator
+from core.configfile import ConfigFile
+from core.emulator import EmulatedUMD
+from core.hardware import UMDv2
+from core.sms import sms
+
+
+class FlakyUMD(EmulatedUMD):
+    # every block read longer than limit loses its last bytes
+    limit = 512
+
+    def execute(self, words):
+        if words and words[0] == b"rdbblk" and int(words[2], 0) > self.limit:
+            self.respond(self.cart.read(int(words[1], 0), int(words[2], 0))[:-16])
+        else:
+            super().execute(words)
+
+
+def attach(name, rom, device_class=EmulatedUMD):
+    umd = UMDv2(0)
+    device = device_class(rom, "sms")
+    device.timeout = 0.01
+    umd.attach_device(name, device)
+    umd.settings[name] = (460800, 2048)
+    return umd
+
+
+def test_dump_backs_off_on_short_blocks(capsys):
+    rom = bytes(random.Random(1).randbytes(0x20000))
+    umd = attach("flaky-dump", rom, FlakyUMD)
+    try:
+        image, verdict = sms().dumpRom(umd, "flaky-dump")
+        assert image == rom
+        assert umd.settings["flaky-dump"][1] == FlakyUMD.limit
+        assert "backing off" in capsys.readouterr().out
+    finally:
+        umd.detach("flaky-dump")
+
+
+def test_stream_range_backs_off_on_short_blocks():
+    rom = bytes(random.Random(2).randbytes(0x8000))
+    umd = attach("flaky-stream", rom, FlakyUMD)
+    try:
+        assert bytes(umd.read_range("flaky-stream", 0, len(rom))) == rom
+        assert umd.tuner("flaky-stream").block_size == FlakyUMD.limit
+    finally:
+        umd.detach("flaky-stream")
+
+
+def test_reliable_link_keeps_its_settings():
+    rom = bytes(random.Random(3).randbytes(0x8000))
+    umd = attach("steady", rom)
+    try:
+        assert bytes(umd.read_range("steady", 0, len(rom))) == rom
+        assert umd.settings["steady"] == (460800, 2048)
+    finally:
+        umd.detach("steady")
+
+
+class LinkUMD(EmulatedUMD):
+    # a link which garbles blocks past 2048 bytes and everything over 460800 baud, time is simulated: every request
+    # costs a fixed overhead plus the transfer time of its bytes
+    overhead = 0.002
+    clock = 0.0
+    stable = True
+
+    def execute(self, words):
+        if words and words[0] == b"rdbblk":
+            size = int(words[2], 0)
+            data = bytearray(self.cart.read(int(words[1], 0), size))
+            self.clock += self.overhead + size * 10 / self.baudrate
+            if size > 2048 or self.baudrate > 460800 or not self.stable:
+                data[0] ^= 0xFF
+                self.stable = LinkUMD.stable
+            self.respond(data)
+        else:
+            super().execute(words)
+
+
+def calibrator(tmp_path, monkeypatch, name, device):
+    umd = UMDv2(0, ConfigFile(str(tmp_path / "umd.conf")))
+    device.timeout = 0.01
+    umd.attach_device(name, device)
+    monkeypatch.setattr("core.calibrate.time", types.SimpleNamespace(perf_counter=lambda: device.clock))
+    return umd, Calibrator(umd, pattern_size=8192, trials=2)
+
+
+def test_calibration_saves_the_fastest_reliable_setting(tmp_path, monkeypatch):
+    device = LinkUMD(random.Random(4).randbytes(0x8000))
+    umd, calibration = calibrator(tmp_path, monkeypatch, "link-ok", device)
+    try:
+        assert calibration.calibrate("link-ok") == (460800, 2048)
+        failed = {(r[0], r[1]) for r in calibration.results if r[2] > 0}
+        assert failed == {(b, s) for b in Calibrator.baudrates for s in Calibrator.block_sizes if b > 460800 or s > 2048}
+        assert umd.settings["link-ok"] == (460800, 2048) and device.baudrate == 460800
+        assert umd.configfile.read("CALIBRATION", umd.serial_number("link-ok")) == "460800,2048"
+        # a later connection picks the stored setting up
+        assert umd.load_settings("link-ok") == (460800, 2048)
+    finally:
+        umd.detach("link-ok")
+
+
+def test_calibration_keeps_the_link_on_an_unstable_pattern(tmp_path, monkeypatch, capsys):
+    device = LinkUMD(random.Random(5).randbytes(0x8000))
+    device.stable = False
+    umd, calibration = calibrator(tmp_path, monkeypatch, "link-unstable", device)
+    try:
+        umd.settings["link-unstable"] = (230400, 1024)
+        assert calibration.calibrate("link-unstable") is None
+        assert "not stable" in capsys.readouterr().out
+        assert device.baudrate == 230400
+        assert umd.configfile.read("CALIBRATION", umd.serial_number("link-unstable"), fallback=None) is None
+    finally:
+        umd.detach("link-unstable")
@@ -0,0 +1,30 @@
+import random
+
+from core.emulator import EmulatedUMD
+from core.hardware import UMDv2
+
+
+def test_replay_closes_the_open_devices(tmp_path):
+    umd = UMDv2(0)
+    rom = bytes(random.Random(3).randbytes(0x8000))
+    device = EmulatedUMD(rom, "sms")
+    device.timeout = 0.01
+    umd.attach_device("emu-capture", device)
+    trace = str(tmp_path / "session.trace")
+    try:
+        umd.start_capture(trace)
+        block = bytearray(0x100)
+        umd.batch("emu-capture", [("read", 0x200, memoryview(block))])
+        umd.stop_capture()
+
+        umd.replay(trace)
+        assert not device.is_open
+        assert "emu-capture" not in umd.devices
+        assert umd.port["emu-capture"] is not device
+
+        replayed = bytearray(0x100)
+        umd.batch("emu-capture", [("read", 0x200, memoryview(replayed))])
+        assert replayed == block == rom[0x200:0x300]
+        assert umd.port["emu-capture"].mismatches == 0
+    finally:
+        umd.detach("emu-capture")
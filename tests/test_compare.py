@@ -0,0 +1,61 @@
+import random
+
+from core.compare import compare_dumps
+
+
+def dumps(tmp_path, *images):
+    paths = []
+    for index, image in enumerate(images):
+        path = str(tmp_path / "dump{}.bin".format(index))
+        with open(path, "wb") as f:
+            f.write(image)
+        paths.append(path)
+    return paths
+
+
+def test_stuck_data_line_is_blamed_on_the_bad_dump(tmp_path):
+    good = bytes(random.Random(1).randbytes(0x10000))
+    bad = bytes(value & ~0x08 for value in good)
+    report = compare_dumps(dumps(tmp_path, good, bad, good), bank_size=0)
+    assert report.reference in (0, 2)
+    assert report.errors[1] == sum(value & 0x08 != 0 for value in good)
+    assert report.data_lines[3] == report.error_bytes
+    assert report.causes[0] == "data line D3 stuck at 0"
+
+
+def test_word_bus_data_lines(tmp_path):
+    good = bytes(random.Random(2).randbytes(0x8000))
+    bad = bytearray(good)
+    # D9 is bit 1 of the high byte, the first byte of a big endian word
+    bad[0::2] = bytes(value | 0x02 for value in good[0::2])
+    report = compare_dumps(dumps(tmp_path, good, bytes(bad), good), bus_width=16, bank_size=0)
+    assert report.causes[0] == "data line D9 stuck at 1"
+
+
+def test_stuck_address_line(tmp_path):
+    good = bytes(random.Random(3).randbytes(0x10000))
+    bad = bytearray(good)
+    for offset in range(len(good)):
+        if offset & 0x1000:
+            bad[offset] = good[offset ^ 0x1000]
+    report = compare_dumps(dumps(tmp_path, good, bytes(bad), good), bank_size=0)
+    assert report.address_lines[12] == 1.0
+    assert "address line A12 stuck low, reads come from 0x1000 bytes lower" in report.causes
+
+
+def test_bank_boundary_errors(tmp_path):
+    good = bytes(random.Random(4).randbytes(0x20000))
+    bad = bytearray(good)
+    for boundary in range(0x4000, len(good), 0x4000):
+        for offset in range(boundary - 8, boundary + 8):
+            bad[offset] ^= 0x5A
+    report = compare_dumps(dumps(tmp_path, good, bytes(bad), good), bank_size=0x4000)
+    assert report.boundary_errors == report.error_bytes
+    assert "bank switching fault" in report.causes[-1]
+
+
+def test_identical_dumps_agree(tmp_path):
+    good = bytes(random.Random(5).randbytes(0x1000))
+    report = compare_dumps(dumps(tmp_path, good, good))
+    assert report.error_bytes == 0 and report.errors == {1: 0}
+    assert "all dumps agree" in report.format()
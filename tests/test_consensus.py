@@ -0,0 +1,107 @@
+import random
+
+import pytest
+
+from core.consensus import ConsensusReader
+from core.emulator import EmulatedUMD
+from core.hardware import UMDv2
+
+
+class NoisyUMD(EmulatedUMD):
+    # the listed reads of a block come back with bytes flipped, counted per block address
+    def __init__(self, rom, bad_reads):
+        super().__init__(rom, "flat")
+        self.bad_reads = bad_reads
+        self.counts = {}
+
+    def execute(self, words):
+        if words and words[0] == b"rdbblk":
+            address, size = int(words[1], 0), int(words[2], 0)
+            self.counts[address] = self.counts.get(address, 0) + 1
+            data = bytearray(self.cart.read(address, size))
+            if self.counts[address] in self.bad_reads.get(address, ()):
+                data[5] ^= 0x10
+                data[size - 1] ^= 0x01
+            self.respond(data)
+        else:
+            super().execute(words)
+
+
+def reader(name, device, **kwargs):
+    umd = UMDv2(0)
+    device.timeout = 0.01
+    umd.attach_device(name, device)
+    umd.settings[name] = (460800, 0x400)
+    return umd, ConsensusReader(umd, name, **kwargs)
+
+
+def test_vote_outnumbers_one_corrupted_read():
+    consensus = ConsensusReader(UMDv2(0), "none", agree=2)
+    good = bytes(range(64))
+    bad = bytearray(good)
+    bad[7] ^= 0xFF
+    data, undecided = consensus.vote([bytes(bad), good, good])
+    assert data == good and undecided == 0
+    data, undecided = consensus.vote([bytes(bad), good])
+    assert undecided == 1 and data == bytes(bad)
+
+
+def test_corrupted_read_is_read_again():
+    rom = bytes(random.Random(6).randbytes(0x1000))
+    # the first read of the second block is corrupted
+    umd, consensus = reader("emu-consensus", NoisyUMD(rom, {0x400: (1,)}))
+    try:
+        assert bytes(consensus.read(0, len(rom))) == rom
+        assert (consensus.blocks, consensus.reads, consensus.retried) == (4, 9, 1)
+        assert consensus.unresolved == []
+    finally:
+        umd.detach("emu-consensus")
+
+
+def test_block_without_agreement_is_reported():
+    rom = bytes(random.Random(7).randbytes(0x800))
+    # every other read of the first block is corrupted, the two values never reach three votes each
+    umd, consensus = reader("emu-unresolved", NoisyUMD(rom, {0: (1, 3)}), agree=3, max_reads=4)
+    try:
+        consensus.read(0, len(rom))
+        assert consensus.unresolved == [(0, 0x400, 2)]
+        assert "0x000000 1024 bytes, 2 without agreement" in consensus.report()
+    finally:
+        umd.detach("emu-unresolved")
+
+
+class ShortUMD(EmulatedUMD):
+    # the listed rdbblk requests lose their last bytes
+    def __init__(self, rom, short_requests):
+        super().__init__(rom, "flat")
+        self.short_requests = short_requests
+        self.reads = 0
+
+    def execute(self, words):
+        if words and words[0] == b"rdbblk":
+            self.reads += 1
+            data = self.cart.read(int(words[1], 0), int(words[2], 0))
+            self.respond(data[:-3] if self.reads in self.short_requests else data)
+        else:
+            super().execute(words)
+
+
+def test_short_read_is_not_voted_on():
+    rom = bytes(random.Random(8).randbytes(0x1000))
+    umd, consensus = reader("emu-short", ShortUMD(rom, {2, 9}))
+    try:
+        assert bytes(consensus.read(0, len(rom))) == rom
+        # the requests holding a short read were sent again, no block needed a tie break
+        assert consensus.short == 2 and consensus.retried == 0
+    finally:
+        umd.detach("emu-short")
+
+
+def test_short_reads_give_up_with_an_error():
+    rom = bytes(random.Random(9).randbytes(0x400))
+    umd, consensus = reader("emu-dead", ShortUMD(rom, set(range(1, 100))))
+    try:
+        with pytest.raises(IOError, match="short"):
+            consensus.read(0, len(rom))
+    finally:
+        umd.detach("emu-dead")
@@ -0,0 +1,85 @@
+import array
+import random
+
+import pytest
+
+from core.detect import CartDetector
+from core.emulator import EmulatedUMD
+from core.genesis import genesis
+from core.hardware import UMDv2
+from core.sms import sms
+from core.tg16 import tg16
+
+
+def genesis_rom(size):
+    rom = bytearray(random.Random(size).randbytes(size))
+    rom[0x100:0x110] = b"SEGA MEGA DRIVE "
+    rom[0x1A0:0x1A8] = bytes(4) + (size - 1).to_bytes(4, "big")
+    words = array.array("H", bytes(rom[0x200:]))
+    words.byteswap()
+    rom[0x18E:0x190] = (sum(words) & 0xFFFF).to_bytes(2, "big")
+    return rom
+
+
+def sms_rom(size):
+    rom = bytearray(random.Random(size).randbytes(size))
+    rom[0x7FF0:0x8000] = b"TMR SEGA\x00\x00\x12\x34\x56\x70\x00\x40"
+    return rom
+
+
+def hucard(size, us):
+    rom = bytearray(random.Random(size).randbytes(size))
+    rom[0x1FFE:0x2000] = b"\x10\xE0"
+    rom[0x10] = 0x78
+    return rom, tg16().reverseBits(rom) if us else bytes(rom)
+
+
+@pytest.fixture
+def umd():
+    umd = UMDv2(0)
+    yield umd
+    umd.detach("detect")
+
+
+def test_genesis_ssf2_is_dumped_with_its_mapping(umd):
+    rom = genesis_rom(0x500000)
+    umd.attach_device("detect", EmulatedUMD(rom, "genesis"))
+    detection = CartDetector().detect(umd, "detect")
+    assert (detection["console"], detection["mapping"], detection["confident"]) == ("genesis", "ssf2", True)
+    image, verdict = genesis().dumpRom(umd, "detect", mapper=detection["mapping"])
+    assert image == rom and verdict["checksum_ok"]
+
+
+def test_genesis_linear_mapping_never_banks(umd):
+    rom = genesis_rom(0x500000)
+    device = EmulatedUMD(rom, "genesis")
+    umd.attach_device("detect", device)
+    image, verdict = genesis().dumpRom(umd, "detect", mapper="linear")
+    assert image == rom[:genesis.windowSize]
+    assert device.cart.banks == list(range(8))
+
+
+def test_sms_detection(umd):
+    rom = sms_rom(0x40000)
+    umd.attach_device("detect", EmulatedUMD(rom, "sms"))
+    detection = CartDetector().detect(umd, "detect")
+    assert (detection["console"], detection["mapping"], detection["confident"]) == ("sms", "sega", True)
+    image, verdict = sms().dumpRom(umd, "detect", mapper=detection["mapping"])
+    assert image == rom
+
+
+@pytest.mark.parametrize("us", [False, True])
+def test_hucard_bit_order_is_passed_to_the_dump(umd, us):
+    rom, cart = hucard(0x40000, us)
+    umd.attach_device("detect", EmulatedUMD(cart, "tg16"))
+    detection = CartDetector().detect(umd, "detect")
+    assert detection["console"] == "tg16"
+    assert detection["mapping"] == ("reversed" if us else "normal")
+    image, verdict = tg16().dumpRom(umd, "detect", bitReversed=detection["mapping"] == "reversed")
+    assert bytes(image) == bytes(rom)
+    assert verdict["reversed"] == us
+
+
+def test_blank_bus_is_not_confident(umd):
+    umd.attach_device("detect", EmulatedUMD(b"\xFF" * 0x8000))
+    assert not CartDetector().detect(umd, "detect")["confident"]
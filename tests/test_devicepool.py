@@ -0,0 +1,48 @@
+import threading
+
+from core.devicepool import DevicePool
+from core.hardware import UMDv2
+from core.jobs import JobExecutor
+
+
+class UnpluggedSerial:
+    # an unplugged device, every ioctl fails
+    is_open = True
+    closed = False
+
+    @property
+    def in_waiting(self):
+        raise OSError("device disconnected")
+
+    def close(self):
+        self.closed = True
+
+
+def test_refresh_leaves_busy_ports_alone():
+    umd = UMDv2(0)
+    umd.list_serial_ports = lambda: ["pool-busy"]
+    ser = UnpluggedSerial()
+    umd.port["pool-busy"] = ser
+    executor = JobExecutor()
+    pool = DevicePool(umd, executor=executor)
+    pool.seen = {"pool-busy"}
+    release = threading.Event()
+    started = threading.Event()
+
+    def job(context):
+        started.set()
+        release.wait(5)
+
+    try:
+        executor.submit("dump", job, device="pool-busy")
+        assert started.wait(5)
+        assert pool.refresh() == ([], [])
+        assert umd.port["pool-busy"] is ser and not ser.closed
+
+        release.set()
+        executor.shutdown()
+        assert pool.refresh() == ([], ["pool-busy"])
+        assert ser.closed
+    finally:
+        release.set()
+        umd.detach("pool-busy")
@@ -0,0 +1,103 @@
+import array
+import random
+
+from core.emulator import EmulatedUMD
+from core.fingerprint import FingerprintIndex
+from core.hardware import UMDv2
+from core.tg16 import tg16
+
+
+def genesis_rom(size, seed):
+    rom = bytearray(random.Random(seed).randbytes(size))
+    rom[0x100:0x110] = b"SEGA MEGA DRIVE "
+    words = array.array("H", bytes(rom[0x200:]))
+    words.byteswap()
+    rom[0x18E:0x190] = (sum(words) & 0xFFFF).to_bytes(2, "big")
+    return bytes(rom)
+
+
+def write(path, data):
+    with open(str(path), "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def attach(rom, console, name):
+    umd = UMDv2(0)
+    device = EmulatedUMD(rom, console)
+    device.timeout = 0.01
+    umd.attach_device(name, device)
+    return umd, device
+
+
+def test_known_cart_is_copied_from_the_index(tmp_path):
+    # past 4MB, the spot check reaches the last block through the SSF2 mapper
+    rom = genesis_rom(0x480000, 1)
+    index = FingerprintIndex(str(tmp_path / "index.json"))
+    key = index.add_file("genesis", write(tmp_path / "known.bin", rom))
+    index.save()
+    index = FingerprintIndex(str(tmp_path / "index.json"))
+    umd, device = attach(rom, "genesis", "emu-known")
+    try:
+        verdict = index.known_dump(umd, "emu-known", "genesis", str(tmp_path / "copy.bin"))
+        assert verdict["fingerprint"] == key and verdict["size"] == len(rom)
+        with open(str(tmp_path / "copy.bin"), "rb") as f:
+            assert f.read() == rom
+        # the mapper is back to power on
+        assert device.cart.banks == list(range(8))
+    finally:
+        umd.detach("emu-known")
+
+
+def test_different_cart_with_the_same_header_fails_the_spot_check(tmp_path, capsys):
+    rom = genesis_rom(0x100000, 2)
+    other = bytearray(rom)
+    other[0x8000:] = random.Random(3).randbytes(len(rom) - 0x8000)
+    index = FingerprintIndex(str(tmp_path / "index.json"))
+    index.add_file("genesis", write(tmp_path / "known.bin", rom))
+    umd, device = attach(bytes(other), "genesis", "emu-other")
+    try:
+        assert index.known_dump(umd, "emu-other", "genesis", str(tmp_path / "copy.bin")) is None
+        assert "spot check failed" in capsys.readouterr().out
+    finally:
+        umd.detach("emu-other")
+
+
+def test_bad_dump_is_not_indexed(tmp_path):
+    rom = bytearray(genesis_rom(0x20000, 4))
+    rom[0x1000] ^= 0xFF
+    index = FingerprintIndex(str(tmp_path / "index.json"))
+    assert index.add_file("genesis", write(tmp_path / "bad.bin", bytes(rom))) is None
+    assert index.entries == {}
+
+
+def test_us_hucard_matches_its_japanese_dump(tmp_path):
+    rom = bytearray(random.Random(5).randbytes(0x40000))
+    rom[tg16.resetVector:tg16.resetVector + 2] = (0xE010).to_bytes(2, "little")
+    rom[0x10] = 0x78
+    index = FingerprintIndex(str(tmp_path / "index.json"))
+    key = index.add_file("tg16", write(tmp_path / "jp.pce", bytes(rom)))
+    umd, device = attach(tg16().reverseBits(rom), "tg16", "emu-hucard")
+    try:
+        assert index.identify(umd, "emu-hucard", "tg16")[::2] == (key, True)
+        assert index.known_dump(umd, "emu-hucard", "tg16", str(tmp_path / "copy.pce"))["md5"] == \
+            index.entries[key][0]["md5"]
+    finally:
+        umd.detach("emu-hucard")
+
+
+def test_mapped_dumps_are_bounded(tmp_path):
+    index = FingerprintIndex(str(tmp_path / "index.json"))
+    index.max_images = 2
+    entries = []
+    for n in range(4):
+        path = write(tmp_path / "dump{}.bin".format(n), genesis_rom(0x8000, 10 + n))
+        entries.append({"console": "genesis", "path": path})
+    images = [index.image(entry) for entry in entries[:3]]
+    assert list(index.images) == [entries[1]["path"], entries[2]["path"]]
+    # a hit moves the dump to the back
+    assert index.image(entries[1]) is images[1]
+    index.image(entries[3])
+    assert list(index.images) == [entries[1]["path"], entries[3]["path"]]
+    index.close()
+    assert index.images == {} and len(images[1]) == 0
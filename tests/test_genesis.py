@@ -0,0 +1,172 @@
+import hashlib
+import random
+import threading
+
+import pytest
+
+from core.emulator import EmulatedUMD
+from core.genesis import genesis
+from core.hardware import UMDv2
+from core.sms import sms
+
+
+def genesis_header(serial):
+    data = bytearray(b" " * genesis.headerSize)
+    data[0:16] = b"SEGA MEGA DRIVE "
+    data[0x80:0x8E] = serial.encode("ascii").ljust(14)
+    return data
+
+
+def test_decode_header_does_not_touch_class_state():
+    header = genesis().decodeHeader(genesis_header("GM 00001009-00"))
+    assert header["Serial Number"].strip() == "GM 00001009-00"
+    assert genesis.headerData == {}
+    assert sms.headerData == {}
+
+
+def test_concurrent_decodes_keep_their_own_header():
+    errors = []
+
+    def decode(serial):
+        data = genesis_header(serial)
+        console = genesis()
+        for n in range(2000):
+            if console.decodeHeader(data)["Serial Number"].strip() != serial:
+                errors.append(serial)
+                return
+
+    threads = [threading.Thread(target=decode, args=("GM {:08d}-00".format(n),)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+
+def sram_cart(lanes, begin=0x200001, end=0x203FFF, name="emu-sram"):
+    rom = bytearray(random.Random(lanes).randbytes(0x300000))
+    header = genesis_header("GM SRAMTEST-00")
+    header[0xB0:0xB4] = bytes([0x52, 0x41, {"both": 0xE0, "even": 0xF0, "odd": 0xF8}[lanes], 0x20])
+    header[0xB4:0xB8] = begin.to_bytes(4, "big")
+    header[0xB8:0xBC] = end.to_bytes(4, "big")
+    rom[genesis.headerAddress:genesis.headerAddress + genesis.headerSize] = header
+    umd = UMDv2(0)
+    device = EmulatedUMD(rom, "genesis")
+    device.timeout = 0.01
+    umd.attach_device(name, device)
+    return umd, device
+
+
+@pytest.mark.parametrize("lanes, size", [("both", 0x4000), ("even", 0x2000), ("odd", 0x2000)])
+def test_sram_backup_and_restore(tmp_path, lanes, size):
+    umd, device = sram_cart(lanes)
+    lane = {"both": slice(None), "even": slice(0, None, 2), "odd": slice(1, None, 2)}[lanes]
+    try:
+        filename = str(tmp_path / "backup.srm")
+        digest = genesis().backupSram(umd, "emu-sram", filename)
+        with open(filename, "rb") as f:
+            save = f.read()
+        assert len(save) == size
+        assert save == device.cart.rom[0x200000:0x204000][lane]
+        assert digest == hashlib.md5(save).hexdigest()
+
+        restored = bytes(random.Random(size).randbytes(size))
+        with open(filename, "wb") as f:
+            f.write(restored)
+        assert genesis().restoreSram(umd, "emu-sram", filename)
+        assert device.cart.rom[0x200000:0x204000][lane] == restored
+    finally:
+        umd.detach("emu-sram")
+
+
+@pytest.mark.parametrize("lanes, size", [("both", 0x4001), ("both", 0x100), ("odd", 0x2001), ("even", 0x1000)])
+def test_sram_restore_refuses_wrong_size(tmp_path, capsys, lanes, size):
+    umd, device = sram_cart(lanes)
+    before = bytes(device.cart.rom)
+    try:
+        filename = str(tmp_path / "wrong.srm")
+        with open(filename, "wb") as f:
+            f.write(bytes(size))
+        assert genesis().restoreSram(umd, "emu-sram", filename) is False
+        assert "SRAM window holds" in capsys.readouterr().out
+        assert bytes(device.cart.rom) == before
+    finally:
+        umd.detach("emu-sram")
+
+
+class UnpluggedUMD(EmulatedUMD):
+
+    def write(self, data):
+        raise OSError("device disconnected")
+
+
+def test_sram_backup_all_reports_every_port(tmp_path, capsys):
+    umd, device = sram_cart("odd", name="emu-sram-ok")
+    umd.attach_device("emu-sram-gone", UnpluggedUMD())
+    umd.attach_device("emu-sram-busy", EmulatedUMD())
+    try:
+        ports = ["emu-sram-ok", "emu-sram-gone", "emu-sram-busy", "emu-sram-missing"]
+        results = genesis().backupSramAll(umd, str(tmp_path), ports, busy={"emu-sram-busy"})
+        assert sorted(results) == sorted(ports)
+        filename, digest = results["emu-sram-ok"]
+        with open(filename, "rb") as f:
+            assert hashlib.md5(f.read()).hexdigest() == digest
+        assert results["emu-sram-gone"][0] is None and isinstance(results["emu-sram-gone"][1], OSError)
+        assert all(results[port][0] is None for port in ("emu-sram-busy", "emu-sram-missing"))
+        assert "emu-sram-gone : SRAM backup failed" in capsys.readouterr().out
+        assert device.requests and not umd.port["emu-sram-busy"].requests
+    finally:
+        for port in ports:
+            umd.detach(port)
+
+
+def genesis_image(size=0x20000):
+    rom = bytearray(random.Random(size).randbytes(size))
+    rom[genesis.headerAddress:genesis.headerAddress + genesis.headerSize] = genesis_header("GM SMDTEST-00")
+    return bytes(rom)
+
+
+def test_smd_interleave_round_trip():
+    rom = genesis_image()
+    blocks = genesis().interleave(rom)
+    assert len(blocks) == len(rom)
+    # the first half of a block holds the odd bytes
+    assert blocks[:0x2000] == rom[1:0x4000:2] and blocks[0x2000:0x4000] == rom[0:0x4000:2]
+    assert genesis().deinterleave(blocks) == rom
+    # a partial last block is padded
+    assert genesis().deinterleave(genesis().interleave(rom[:0x5000]))[:0x5000] == rom[:0x5000]
+
+
+def test_detect_format():
+    rom = genesis_image()
+    console = genesis()
+    smd = console.smdHeader(len(rom) // genesis.smdBlockSize) + console.interleave(rom)
+    assert console.detectFormat(rom) == "bin"
+    assert console.detectFormat(console.swapBytes(rom)) == "swapped"
+    assert console.detectFormat(smd) == "smd"
+    # copiers which leave the id bytes out are told by the deinterleaved header
+    assert console.detectFormat(bytes(genesis.smdHeaderSize) + console.interleave(rom)) == "smd"
+
+
+@pytest.mark.parametrize("target", genesis.smdFormats)
+def test_convert_file_round_trip(tmp_path, target):
+    rom = genesis_image()
+    source = str(tmp_path / "game.bin")
+    converted = str(tmp_path / "game.out")
+    back = str(tmp_path / "game.back")
+    with open(source, "wb") as f:
+        f.write(rom)
+    assert genesis().convertFile(source, converted, target) == (source, "bin")
+    assert genesis().convertFile(converted, back, "bin") == (converted, target)
+    with open(back, "rb") as f:
+        assert f.read() == rom
+
+
+def test_split_smd_set_is_joined(tmp_path):
+    rom = genesis_image(0x40000)
+    console = genesis()
+    half = len(rom) // 2
+    for name, part, last in (("GAMEA.SMD", rom[:half], False), ("GAMEB.SMD", rom[half:], True)):
+        with open(str(tmp_path / name), "wb") as f:
+            f.write(console.smdHeader(len(part) // genesis.smdBlockSize, last) + console.interleave(part))
+    assert console.loadImage(str(tmp_path / "GAMEA.SMD")).view().tobytes() == rom
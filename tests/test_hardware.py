@@ -0,0 +1,13 @@
+from core.emulator import EmulatedUMD
+from core.hardware import UMDv2
+
+
+def test_instances_keep_their_own_devices():
+    first = UMDv2(0)
+    second = UMDv2(0)
+    device = EmulatedUMD(b"\x12\x34", "flat")
+    device.timeout = 0.01
+    first.attach_device("emu", device)
+    assert bytes(first.read_block("emu", 0, 2)) == b"\x12\x34"
+    assert second.port == {} and second.rx == {} and second.settings == {} and second.devices == set()
+    first.detach("emu")
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from core.jobs import JobExecutor
+
+
+def drain(executor, count, timeout=5):
+    events = []
+    deadline = time.monotonic() + timeout
+    while sum(event[0] in ("done", "error", "cancelled") for event in events) < count:
+        assert time.monotonic() < deadline
+        events += executor.poll()
+        time.sleep(0.01)
+    return events
+
+
+def test_jobs_of_one_device_never_overlap():
+    executor = JobExecutor(workers=4)
+    lock = threading.Lock()
+    running = {"port": 0, "other": 0}
+    overlaps = []
+    order = []
+
+    def job(context, device, number):
+        with lock:
+            running[device] += 1
+            overlaps.append(dict(running))
+            order.append((device, number))
+        time.sleep(0.02)
+        with lock:
+            running[device] -= 1
+
+    try:
+        for number in range(4):
+            executor.submit("dump", job, "port", number, device="port")
+        executor.submit("script", job, "other", 0, device="other")
+        events = drain(executor, 5)
+    finally:
+        executor.shutdown()
+    assert all(state["port"] <= 1 and state["other"] <= 1 for state in overlaps)
+    # the other device did not wait for the busy one
+    assert any(state["port"] and state["other"] for state in overlaps)
+    assert [number for device, number in order if device == "port"] == [0, 1, 2, 3]
+    assert [event[0] for event in events].count("done") == 5
+    assert executor.busy_devices() == set()
+
+
+def test_cancelled_waiting_job_never_starts():
+    executor = JobExecutor()
+    release = threading.Event()
+    started = []
+
+    def job(context, number):
+        started.append(number)
+        release.wait(5)
+
+    try:
+        executor.submit("dump", job, 0, device="port")
+        waiting = executor.submit("dump", job, 1, device="port")
+        executor.cancel(waiting)
+        release.set()
+        events = drain(executor, 2)
+    finally:
+        executor.shutdown()
+    assert started == [0]
+    assert ("cancelled", waiting) in [(event[0], event[1]) for event in events]
@@ -0,0 +1,72 @@
+import array
+import hashlib
+import random
+import zlib
+
+import pytest
+
+from core.pipeline import ByteSwapStage, DumpPipeline, GenesisChecksumStage, SmsChecksumStage, DigestStage, FileWriterStage
+
+
+def genesis_rom(size):
+    rom = bytearray(random.Random(size).randbytes(size))
+    rom[0x100:0x110] = b"SEGA MEGA DRIVE "
+    words = array.array("H", bytes(rom[0x200:]))
+    words.byteswap()
+    rom[0x18E:0x190] = (sum(words) & 0xFFFF).to_bytes(2, "big")
+    return bytes(rom)
+
+
+def blocks(data, size):
+    return (data[offset:offset + size] for offset in range(0, len(data), size))
+
+
+def test_genesis_dump_runs_through_every_stage(tmp_path):
+    rom = genesis_rom(0x20000)
+    filename = str(tmp_path / "dump.bin")
+    # a block size which cuts the header and the words of the checksum range
+    verdict = DumpPipeline([GenesisChecksumStage(), DigestStage(), FileWriterStage(filename)]).run(blocks(rom, 0x7F))
+    assert verdict["size"] == len(rom)
+    assert verdict["checksum_ok"] and verdict["checksum"] == int.from_bytes(rom[0x18E:0x190], "big")
+    assert verdict["md5"] == hashlib.md5(rom).hexdigest()
+    assert verdict["sha1"] == hashlib.sha1(rom).hexdigest()
+    assert verdict["crc32"] == "{:08x}".format(zlib.crc32(rom))
+    with open(filename, "rb") as f:
+        assert f.read() == rom
+
+
+def test_bad_checksum_is_reported():
+    rom = bytearray(genesis_rom(0x8000))
+    rom[0x4000] ^= 0x01
+    verdict = DumpPipeline([GenesisChecksumStage()]).run(blocks(bytes(rom), 0x800))
+    assert verdict["checksum_ok"] is False
+
+
+def test_sms_checksum_stage():
+    rom = bytearray(random.Random(9).randbytes(0x20000))
+    rom[0x7FF0:0x7FF8] = b"TMR SEGA"
+    # size code 0xF is 128KB, summed over everything but the header
+    rom[0x7FFF] = 0x4F
+    total = (sum(rom[:0x7FF0]) + sum(rom[0x8000:])) & 0xFFFF
+    rom[0x7FFA:0x7FFC] = total.to_bytes(2, "little")
+    verdict = DumpPipeline([SmsChecksumStage()]).run(blocks(bytes(rom), 0x1000))
+    assert verdict["checksum"] == total and verdict["checksum_ok"]
+
+
+def test_byte_swapped_dump_keeps_the_offsets():
+    rom = genesis_rom(0x8000)
+    swapped = bytearray(rom)
+    swapped[0::2], swapped[1::2] = rom[1::2], rom[0::2]
+    verdict = DumpPipeline([ByteSwapStage(), GenesisChecksumStage(), DigestStage(("md5",))]).run(
+        blocks(bytes(swapped), 0x100))
+    assert verdict["checksum_ok"] and verdict["md5"] == hashlib.md5(rom).hexdigest()
+
+
+def test_byte_swap_refuses_an_odd_block_before_the_last():
+    pipeline = DumpPipeline([ByteSwapStage()])
+    for block in (b"\x01\x02\x03", b"\x04\x05"):
+        pipeline.feed(block)
+    with pytest.raises(ValueError, match="odd length"):
+        pipeline.finish()
+    verdict = DumpPipeline([ByteSwapStage(), DigestStage(("md5",))]).run([b"\x01\x02", b"\x03\x04\x05"])
+    assert verdict["byteswap_trailing"] == 1 and verdict["md5"] == hashlib.md5(b"\x02\x01\x04\x03\x05").hexdigest()
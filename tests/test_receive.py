@@ -0,0 +1,79 @@
+import os
+import random
+import threading
+
+import pytest
+
+from core.calibrate import Calibrator
+from core.hardware import UMDv2
+
+ROM = bytes(random.Random(7).randbytes(0x10000))
+
+
+## pseudo terminal UMDv2, the port is a real serial.Serial so the receive buffer reads its file descriptor
+class PtyDevice:
+
+    def __init__(self, glitch_at):
+        self.master, slave = os.openpty()
+        self.path = os.ttyname(slave)
+        self.slave = slave
+        self.glitch_at = glitch_at
+        self.requests = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        pending = b""
+        while self.running:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            pending += data
+            while b"\n" in pending:
+                line, pending = pending.split(b"\n", 1)
+                words = line.split()
+                if words and words[0] == b"rdbblk":
+                    address, size = int(words[1], 0), int(words[2], 0)
+                    response = ROM[address:address + size]
+                    self.requests += 1
+                    if self.requests == self.glitch_at:
+                        # line noise, a few bytes the host did not ask for
+                        response += b"\x55" * 16
+                    os.write(self.master, response)
+
+    def close(self):
+        self.running = False
+        os.close(self.master)
+        os.close(self.slave)
+
+
+@pytest.fixture
+def pty_umd():
+    device = PtyDevice(glitch_at=30)
+    umd = UMDv2(0.05)
+    umd.attach(device.path)
+    yield umd, device
+    umd.detach(device.path)
+    device.close()
+
+
+def test_calibration_recovers_after_a_desynchronized_block(pty_umd):
+    umd, device = pty_umd
+    calibrator = Calibrator(umd, pattern_size=4096, trials=2)
+    calibrator.baudrates = [115200, 230400]
+    calibrator.block_sizes = [512, 1024, 2048]
+    assert calibrator.calibrate(device.path) is not None
+    errors = [result[2] for result in calibrator.results]
+    # only the setting which saw the noise has errors
+    assert sum(1 for rate in errors if rate) == 1
+    assert errors[-1] == 0
+
+
+def test_reset_input_drops_buffered_bytes(pty_umd):
+    umd, device = pty_umd
+    device.glitch_at = 1
+    assert bytes(umd.read_block(device.path, 0, 256)) == ROM[:256]
+    umd.drain(device.path)
+    assert bytes(umd.read_block(device.path, 256, 256)) == ROM[256:512]
@@ -0,0 +1,40 @@
+import hashlib
+import os
+
+from core.romimage import RomImage
+
+
+def md5(image):
+    return image.cached("md5", lambda: hashlib.md5(image.view()).hexdigest())
+
+
+def test_refresh_drops_the_cache_when_the_file_changes(tmp_path):
+    path = str(tmp_path / "game.bin")
+    with open(path, "wb") as f:
+        f.write(b"\x01" * 0x1000)
+    with RomImage.load(path) as image:
+        first = md5(image)
+        assert image.cache == {"md5": first}
+        assert image.refresh() is False
+
+        with open(path, "wb") as f:
+            f.write(b"\x02" * 0x2000)
+        # force a different stamp on file systems with a coarse clock
+        os.utime(path, ns=(0, 0))
+        assert image.refresh() is True
+        assert image.cache == {}
+        assert len(image) == 0x2000
+        assert md5(image) == hashlib.md5(b"\x02" * 0x2000).hexdigest()
+
+
+def test_cached_results_are_computed_once():
+    image = RomImage.load(bytearray(b"\x03" * 64))
+    calls = []
+    for n in range(3):
+        assert image.cached("sum", lambda: calls.append(1) or sum(image.view())) == 3 * 64
+    assert len(calls) == 1
+    image.invalidate()
+    image.cached("sum", lambda: calls.append(1) or 0)
+    assert len(calls) == 2
+    assert RomImage.load(image) is image
+    assert image.view(8, 4).tobytes() == b"\x03" * 4
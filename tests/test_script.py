@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+from core.emulator import EmulatedUMD
+from core.hardware import UMDv2
+from core.script import ScriptRunner, ScriptError
+
+
+@pytest.fixture
+def runner():
+    umd = UMDv2(0)
+    rom = bytes(random.Random(7).randbytes(0x8000))
+    device = EmulatedUMD(rom, "sms")
+    device.timeout = 0.01
+    umd.attach_device("emu-script", device)
+    yield ScriptRunner(umd, "emu-script"), rom
+    umd.detach("emu-script")
+
+
+@pytest.mark.parametrize("statement", ["rdbblk 0x100", "rdbblk 0x100 many", "rdbblk 0x100 0x20000"])
+def test_bad_block_size_raises_script_error(runner, statement):
+    runner, rom = runner
+    responses = []
+    with pytest.raises(ScriptError, match="^line 3: "):
+        for command, response in runner.run("rdbblk 0 16\nrdbblk 16 16\n" + statement):
+            responses.append(response)
+    # the blocks sent before the bad line are still handed out
+    assert responses == [rom[:16], rom[16:32]]
+    assert list(runner.run("rdbblk 0x20 4")) == [("rdbblk 0x20 4", rom[0x20:0x24])]
+
+
+def test_commands_without_terminator_are_sent_as_they_are(runner):
+    runner, rom = runner
+    runner.terminator = ""
+    assert list(runner.run("rdbblk 0 4")) == [("rdbblk 0 4", None)]
+    assert runner.umd.port[runner.port].pending == bytearray(b"rdbblk 0 4")
+    # the line end sent next completes the command
+    runner.umd.port[runner.port].write(b"\r\n")
+    assert bytes(runner.umd.receiver(runner.port).read(4)) == rom[:4]
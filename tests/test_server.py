@@ -0,0 +1,103 @@
+import array
+import hashlib
+import os
+import random
+import socket
+import threading
+
+import pytest
+
+from core.emulator import EmulatedUMD
+from core.hardware import UMDv2
+from core.server import UMDServer, UMDClient, ServerError, MAX_READ_SIZE, REQUEST_READ, pack_string, ADDRESS
+
+
+def genesis_rom(size):
+    rom = bytearray(random.Random(size).randbytes(size))
+    rom[0x100:0x110] = b"SEGA MEGA DRIVE "
+    rom[0x1A0:0x1A8] = bytes(4) + (size - 1).to_bytes(4, "big")
+    words = array.array("H", bytes(rom[0x200:]))
+    words.byteswap()
+    rom[0x18E:0x190] = (sum(words) & 0xFFFF).to_bytes(2, "big")
+    return rom
+
+
+@pytest.fixture
+def server(tmp_path):
+    umd = UMDv2(0)
+    rom = genesis_rom(0x500000)
+    device = EmulatedUMD(rom, "genesis", latency=0.02)
+    umd.attach_device("emu-server", device)
+    address = "unix:" + str(tmp_path / "umd.sock")
+    server = UMDServer(umd, address)
+    server.start()
+    yield server, device, rom
+    server.shutdown()
+    umd.detach("emu-server")
+
+
+def test_reads_during_ssf2_dump_see_the_default_mapping(server):
+    server, device, rom = server
+    dumping = threading.Event()
+    done = threading.Event()
+    failures = []
+    reads = []
+
+    def reader():
+        with UMDClient(server.address) as client:
+            dumping.wait()
+            while not done.is_set():
+                # slot 1 holds bank 8 while the dump reads it
+                address = 0x80000 + 0x100 * len(reads)
+                data = client.read_block("emu-server", address, 256)
+                reads.append(device.requests)
+                if data != bytes(rom[address:address + 256]):
+                    failures.append(address)
+                client.program("emu-server", 0x100000, rom[0x100000:0x100010])
+
+    threads = [threading.Thread(target=reader) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    with UMDClient(server.address) as client:
+        dumping.set()
+        image, verdict = client.dump("emu-server", "genesis")
+    done.set()
+    for thread in threads:
+        thread.join()
+
+    assert image == rom
+    assert verdict["md5"] == hashlib.md5(rom).hexdigest()
+    assert verdict["checksum_ok"]
+    assert reads and not failures
+    assert device.cart.rom == rom
+
+
+def test_large_read_is_refused(server):
+    server, device, rom = server
+    with UMDClient(server.address) as client:
+        with pytest.raises(ServerError):
+            client.request(REQUEST_READ, pack_string("emu-server") + ADDRESS.pack(0, MAX_READ_SIZE + 1))
+        assert client.read_block("emu-server", 0x1000, 0x3000) == bytes(rom[0x1000:0x4000])
+
+
+def test_running_server_socket_is_not_replaced(server):
+    server, device, rom = server
+    with pytest.raises(OSError):
+        UMDServer(server.umd, server.address)
+    with UMDClient(server.address) as client:
+        assert "emu-server" in client.status()["devices"]
+
+
+def test_stale_socket_is_replaced(tmp_path):
+    path = str(tmp_path / "stale.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server = UMDServer(UMDv2(0), "unix:" + path)
+    server.start()
+    try:
+        with UMDClient(server.address) as client:
+            assert "devices" in client.status()
+    finally:
+        server.shutdown()
+    assert not os.path.exists(path)
@@ -0,0 +1,41 @@
+import random
+
+from core.emulator import EmulatedUMD
+from core.hardware import UMDv2
+from core.romimage import RomImage
+from core.sms import sms
+
+
+def make_rom(size, size_code):
+    rng = random.Random(size_code)
+    rom = bytearray(rng.randbytes(size))
+    rom[0x7FF0:0x7FFF] = b"TMR SEGA\x00\x00\x00\x00\x00\x00\x00"
+    rom[0x7FFF] = 0x40 | size_code
+    checksum = sms().checksum(RomImage(data=bytes(rom)))
+    rom[0x7FFA:0x7FFC] = checksum.to_bytes(2, "little")
+    return rom
+
+
+def dump(rom, name):
+    umd = UMDv2(0)
+    umd.attach_device(name, EmulatedUMD(rom, "sms"))
+    try:
+        return sms().dumpRom(umd, name)
+    finally:
+        umd.detach(name)
+
+
+def test_dump_known_size_code():
+    rom = make_rom(0x40000, 0)
+    image, verdict = dump(rom, "sms-known")
+    assert image == rom
+    assert verdict["checksum_ok"] is True
+
+
+def test_dump_invalid_size_code():
+    rom = make_rom(0x40000, 5)
+    image, verdict = dump(rom, "sms-invalid")
+    assert image == rom
+    # no size code, the checksum covers the whole dump and cannot be judged
+    assert verdict["checksum_ok"] is None
+    assert verdict["checksum"] == sms().checksum(RomImage(data=bytes(rom)))
@@ -0,0 +1,66 @@
+import hashlib
+import random
+import zlib
+
+import pytest
+
+from core.emulator import EmulatedUMD
+from core.hardware import UMDv2
+from core.romimage import RomImage
+from core.tg16 import tg16
+
+
+def hucard(size):
+    rom = bytearray(random.Random(size).randbytes(size))
+    # reset vector to 0xE010 where a SEI waits
+    rom[tg16.resetVector:tg16.resetVector + 2] = (0xE010).to_bytes(2, "little")
+    rom[0x10] = 0x78
+    rom[0x11] = 0x00
+    return bytes(rom)
+
+
+def test_bit_order_is_told_from_the_reset_bank():
+    rom = hucard(0x40000)
+    assert tg16().isReversed(rom) is False
+    assert tg16().isReversed(tg16().reverseBits(rom)) is True
+    assert tg16().reverseBits(tg16().reverseBits(rom)) == rom
+    assert tg16().reverseBits(b"\x01\x80\x0F") == b"\x80\x01\xF0"
+
+
+@pytest.mark.parametrize("size, dump", [(0x40000, 0x100000), (0x60000, 0x80000), (0x8000, 0x8000)])
+def test_mirrors_are_cut(size, dump):
+    rom = hucard(size)
+    if size == 0x60000:
+        data = rom + rom[0x40000:]
+    else:
+        data = rom * (dump // size)
+    assert tg16().mirrorSize(data) == size
+
+
+def test_normalize_strips_header_bits_and_mirrors():
+    rom = hucard(0x40000)
+    us_dump = bytes(512) + tg16().reverseBits(rom * 2)
+    image = RomImage(data=us_dump)
+    assert tg16().normalize(image).view().tobytes() == rom
+    assert tg16().md5(image) == hashlib.md5(rom).hexdigest()
+    assert tg16().crc32(image) == "{:08x}".format(zlib.crc32(rom))
+    info = tg16().formatHeader(image)
+    assert info["Copier Header"] and info["Bit Reversed"] and info["ROM Size"] == 0x40000
+    assert info["Reset Vector"] == "0xe010"
+
+
+@pytest.mark.parametrize("size, reversed_card", [(0x60000, True), (0x20000, False)])
+def test_dump_on_the_emulator(size, reversed_card):
+    rom = hucard(size)
+    umd = UMDv2(0)
+    device = EmulatedUMD(tg16().reverseBits(rom) if reversed_card else rom, "tg16")
+    device.timeout = 0.01
+    umd.attach_device("emu-tg16", device)
+    try:
+        assert tg16().detectSize(umd, "emu-tg16") == (size, reversed_card)
+        image, verdict = tg16().dumpRom(umd, "emu-tg16")
+        assert bytes(image) == rom
+        assert verdict["reversed"] is reversed_card
+        assert verdict["md5"] == hashlib.md5(rom).hexdigest()
+    finally:
+        umd.detach("emu-tg16")
@@ -18,20 +18,38 @@ import os
 import glob
 import serial
 import threading
+import queue
 from io import TextIOWrapper
 import tkinter as tk
 from tkinter import *
+from tkinter import ttk
 from tkinter import filedialog
 from tkinter import messagebox
 import configparser
 import subprocess
+import argparse
+import time
 
 from PIL import Image, ImageTk
 from core.configfile import ConfigFile
+from core.cartridge import Cartridge
+from core.romimage import RomImage
 from core.hardware import UMDv2
+from core.calibrate import Calibrator
+from core.devicepool import DevicePool
+from core.script import ScriptRunner, ScriptError, format_response
+from core.jobs import JobExecutor
+from core.compare import CONSOLE_BUS
+from core.consensus import ConsensusReader
+from core.fingerprint import FingerprintIndex
+from core.pipeline import FileWriterStage
+from core.emulator import EmulatedUMD
+from core.detect import CartDetector, format_detection
+from core.server import UMDServer, UMDClient, ServerError, DEFAULT_ADDRESS
 from core.genesis import genesis
 from core.sms import sms
 from core.snes import snes
+from core.tg16 import tg16
 
 
 class AppUmd(Tk):
@@ -39,6 +57,7 @@ class AppUmd(Tk):
     hex_test = "0x000000 00 01 02 03 04 05 06 06 07 08 09 0A 0B 0C 0D 0E 0F\n"
 
     load_filename = None
+    load_image = None
 
     configfile = ""
     umdv2 = ""
@@ -47,18 +66,35 @@ class AppUmd(Tk):
     selected_ports = {}
     active_ports = {}
 
-    cart_types = ["genesis", "sms", "snes", "tg16"]
+    cart_types = ["genesis", "sms", "snes", "tg16", "auto"]
 
     # ------------------------------------------------------------------------------------------------------------------
     #  __init__
     #
-    #  select a local file
+    #  select a local file, remote is the address of a UMDv2 server whose devices are used instead of local ones
     # ------------------------------------------------------------------------------------------------------------------
-    def __init__(self, conf, device, *args, **kwargs):
+    def __init__(self, conf, device, remote=None, *args, **kwargs):
 
         # store config in this class
         self.configfile = conf
         self.umdv2 = device
+        self.remote = remote
+        self.remote_ports = []
+        self.remote_generation = 0
+        self.jobs = JobExecutor()
+        self.pool = DevicePool(device, executor=self.jobs)
+        self.pool_generation = -1
+        self.dumpers = {"genesis": self.dump_genesis, "sms": self.dump_sms, "tg16": self.dump_tg16}
+        # (port, detection, consensus) of auto detections waiting for the Tk thread
+        self.detections = queue.Queue()
+        index_path = os.path.expanduser(self.configfile.read("FINGERPRINT", "index",
+                                                             fallback="~/ROMs/fingerprints.json"))
+        try:
+            self.fingerprints = FingerprintIndex(index_path)
+        except ValueError as e:
+            print(e)
+            self.fingerprints = None
+        self.job_rows = {}
 
         # declare main window
         Tk.__init__(self, *args, **kwargs)
@@ -73,6 +109,10 @@ class AppUmd(Tk):
         self.menu_file.add_command(label="Load ROM", command=self.load_rom)
         self.menu_file.add_separator()
         self.menu_file.add_command(label="Preferences", command=self.open_preferences)
+        self.menu_file.add_command(label="Calibrate UMDv2", command=self.calibrate_umd)
+        self.menu_file.add_command(label="Run Script", command=self.run_script_file)
+        self.menu_file.add_command(label="Compare Dumps", command=self.compare_dumps)
+        self.menu_file.add_command(label="Index Dumps", command=self.index_dumps)
         self.menu_file.add_separator()
         self.menu_file.add_command(label="Exit", command=self.app_exit)
         self.menu.add_cascade(label="File", menu=self.menu_file)
@@ -91,6 +131,10 @@ class AppUmd(Tk):
         self.btn_loadrom = tk.Button(self.frm_romfunctions, text="Load ROM", command=self.load_rom).pack(side=LEFT)
         self.btn_md5 = Button(self.frm_romfunctions, text="MD5", command=self.calc_md5).pack(side=LEFT)
         self.btn_connect_umd = Button(self.frm_romfunctions, text="Connect", command=self.connect_umd).pack(side=LEFT)
+        self.btn_dump = Button(self.frm_romfunctions, text="Dump", command=self.dump_rom).pack(side=LEFT)
+        self.var_consensus = tk.BooleanVar(self, value=False)
+        self.chk_consensus = tk.Checkbutton(self.frm_romfunctions, text="Consensus", variable=self.var_consensus)
+        self.chk_consensus.pack(side=LEFT)
         self.frm_romfunctions.grid_propagate(False)
         self.frm_romfunctions.grid(row=row, column=0, padx=8, pady=4, sticky="nwe")
 
@@ -160,42 +204,349 @@ class AppUmd(Tk):
         self.frm_ports = tk.Frame(self)
         self.frm_ports.grid(row=row, padx=4, pady=4, sticky="nwes")
 
+        # one row per running job with progress bar, throughput and ETA
+        row += 1
+        self.frm_jobs = tk.Frame(self)
+        self.frm_jobs.columnconfigure(1, weight=1)
+        self.frm_jobs.grid(row=row, padx=4, pady=4, sticky="nwes")
+
     # ------------------------------------------------------------------------------------------------------------------
     #  connect umd
     #
     #  start a background thread to connect to the UMD
     # ------------------------------------------------------------------------------------------------------------------
     def connect_umd(self):
-        def callback():
-            self.umdv2.connect(self)
-            self.selected_ports.clear()
-            for widget in self.frm_ports.pack_slaves():
-                widget.destroy()
-            i = 0
-            for port in self.umdv2.port:
-                var = tk.IntVar()
-                self.chk_port = tk.Checkbutton(self.frm_ports,
-                                               text=port,
-                                               variable=var,
-                                               command=self.select_port)
-                self.selected_ports[port] = var
-                if i == 0:
-                    self.chk_port.select()
-                self.chk_port.pack(side=LEFT)
-                i += 1
-
-            # add a few dummy ports
-            for dummy in range(0, 3):
-                var = tk.IntVar()
-                port = "port" + str(dummy)
-                self.chk_port = tk.Checkbutton(self.frm_ports,
-                                               text=port,
-                                               variable=var,
-                                               command=self.select_port)
-                self.selected_ports[port] = var
-                self.chk_port.pack(side=LEFT)
-        thread = threading.Thread(target=callback)
-        thread.start()
+        def remote(job):
+            print("connecting to the UMDv2 server at " + self.remote)
+            with UMDClient(self.remote) as client:
+                devices = client.status()["devices"]
+            self.remote_ports = sorted(devices)
+            self.remote_generation += 1
+            if not devices:
+                print("the server has no UMDv2 connected")
+
+        def callback(job):
+            print("autodecting UMDv2...")
+            self.pool.rescan()
+            if len(self.umdv2.port) == 0:
+                print("no UMDv2 detected, please connect a UMDv2 to the PC and press 'Connect'")
+        self.jobs.submit("connect", remote if self.remote else callback)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  device names
+    #
+    #  return the names of the local UMDv2, or of the devices of the server in remote mode
+    # ------------------------------------------------------------------------------------------------------------------
+    def device_names(self):
+        if self.remote:
+            return list(self.remote_ports)
+        return sorted(self.umdv2.port)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  poll jobs
+    #
+    #  drain the job events on the Tk thread, progress is already throttled per job by the executor
+    # ------------------------------------------------------------------------------------------------------------------
+    def poll_jobs(self):
+        for kind, job_id, name, device, payload in self.jobs.poll():
+            title = name if device is None else "{} {}".format(name, device)
+            if kind == "start":
+                self.add_job_row(job_id, title)
+            elif kind == "progress":
+                self.update_job_row(job_id, payload)
+            elif kind == "log":
+                print(payload)
+            else:
+                self.remove_job_row(job_id)
+                if kind == "error":
+                    print("{} failed : {}".format(title, payload))
+                elif kind == "cancelled":
+                    print("{} cancelled".format(title))
+        while True:
+            try:
+                self.dump_detected(*self.detections.get_nowait())
+            except queue.Empty:
+                break
+        sys.stdout.flush()
+        # about 60 frames per second
+        self.after(16, self.poll_jobs)
+
+    def add_job_row(self, job_id, title):
+        # grid rows may be sparse, the job id keeps rows in start order
+        row = job_id
+        label = tk.Label(self.frm_jobs, text=title, anchor="w", width=24)
+        label.grid(row=row, column=0, sticky="w")
+        bar = ttk.Progressbar(self.frm_jobs, mode="indeterminate", maximum=1000)
+        bar.grid(row=row, column=1, padx=4, sticky="we")
+        bar.start()
+        status = tk.Label(self.frm_jobs, text="", anchor="w", width=32)
+        status.grid(row=row, column=2, sticky="w")
+        cancel = tk.Button(self.frm_jobs, text="Cancel", command=lambda: self.jobs.cancel(job_id))
+        cancel.grid(row=row, column=3)
+        self.job_rows[job_id] = (label, bar, status, cancel)
+
+    def update_job_row(self, job_id, progress):
+        if job_id not in self.job_rows:
+            return
+        label, bar, status, cancel = self.job_rows[job_id]
+        if progress["total"]:
+            if str(bar["mode"]) != "determinate":
+                bar.stop()
+                bar.config(mode="determinate")
+            bar["value"] = 1000 * progress["done"] / progress["total"]
+        text = "{:.1f} KB/s".format(progress["rate"] / 1024)
+        if progress["eta"] is not None:
+            text += "  ETA {:.0f}s".format(progress["eta"])
+        status.config(text=text)
+
+    def remove_job_row(self, job_id):
+        for widget in self.job_rows.pop(job_id, ()):
+            widget.destroy()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  poll ports
+    #
+    #  rebuild the port list on the Tk thread whenever the device pool changed
+    # ------------------------------------------------------------------------------------------------------------------
+    def poll_ports(self):
+        generation = self.remote_generation if self.remote else self.pool.generation
+        if generation != self.pool_generation:
+            self.pool_generation = generation
+            self.show_ports()
+        self.after(250, self.poll_ports)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  show ports
+    #
+    #  list the connected UMDv2 as checkbuttons, selections of devices still present are kept
+    # ------------------------------------------------------------------------------------------------------------------
+    def show_ports(self):
+        previous = {port: var.get() for port, var in self.selected_ports.items()}
+        self.selected_ports.clear()
+        for widget in self.frm_ports.pack_slaves():
+            widget.destroy()
+        i = 0
+        for port in self.device_names():
+            var = tk.IntVar()
+            self.chk_port = tk.Checkbutton(self.frm_ports,
+                                           text=port,
+                                           variable=var,
+                                           command=self.select_port)
+            self.selected_ports[port] = var
+            if previous.get(port, i == 0):
+                self.chk_port.select()
+            self.chk_port.pack(side=LEFT)
+            i += 1
+
+        # add a few dummy ports
+        for dummy in range(0, 3):
+            var = tk.IntVar()
+            port = "port" + str(dummy)
+            self.chk_port = tk.Checkbutton(self.frm_ports,
+                                           text=port,
+                                           variable=var,
+                                           command=self.select_port)
+            self.selected_ports[port] = var
+            self.chk_port.pack(side=LEFT)
+        self.select_port()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  calibrate umd
+    #
+    #  start a background thread to find the best link settings of the selected UMDv2
+    # ------------------------------------------------------------------------------------------------------------------
+    def calibrate_umd(self):
+        def callback(job, port):
+            print("calibrating UMDv2 on " + port)
+            return Calibrator(self.umdv2).calibrate(port)
+        for port, active in self.active_ports.items():
+            if active and port in self.umdv2.port:
+                self.jobs.submit("calibrate", callback, port, device=port)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  compare dumps
+    #
+    #  compare several dumps of the same cart as a background job and print the report
+    # ------------------------------------------------------------------------------------------------------------------
+    def compare_dumps(self):
+        console = self.var_consoles.get()
+        filenames = filedialog.askopenfilenames(title="Select two or more dumps of the same cart",
+                                                initialdir=self.configfile.read("ROMDIRECTORIES", console, fallback="."))
+        if len(filenames) < 2:
+            return
+        bus_width, bank_size = CONSOLE_BUS.get(console, (8, 0x4000))
+
+        def callback(job, filenames):
+            report = Cartridge(filenames[0]).compare(*filenames[1:], bus_width=bus_width, bank_size=bank_size)
+            print(report.format(), end="")
+            return report
+        self.jobs.submit("compare", callback, list(filenames))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  index dumps
+    #
+    #  add verified dumps of the selected console to the fingerprint index as a background job
+    # ------------------------------------------------------------------------------------------------------------------
+    def index_dumps(self):
+        console = self.var_consoles.get()
+        if self.fingerprints is None:
+            messagebox.showwarning("Warning", "The fingerprint index could not be loaded")
+            return
+        if console == "auto":
+            messagebox.showwarning("Warning", "Select the console of the dumps to index")
+            return
+        filenames = filedialog.askopenfilenames(title="Select verified {} dumps".format(console),
+                                                initialdir=self.configfile.read("ROMDIRECTORIES", console, fallback="."))
+        if not filenames:
+            return
+
+        def callback(job, filenames):
+            added = 0
+            for done, filename in enumerate(filenames):
+                try:
+                    added += self.fingerprints.add_file(console, filename) is not None
+                except (OSError, ValueError) as e:
+                    print("{} : {}".format(filename, e))
+                job.progress(done + 1, len(filenames))
+                job.check()
+            self.fingerprints.save()
+            print("{} of {} dumps added to the fingerprint index".format(added, len(filenames)))
+        self.jobs.submit("index", callback, list(filenames))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  dump rom
+    #
+    #  dump the cart of every selected UMDv2 as a background job, files go to the console's ROM directory
+    # ------------------------------------------------------------------------------------------------------------------
+    def dump_rom(self):
+        console = self.var_consoles.get()
+        devices = self.device_names()
+        ports = [port for port, active in self.active_ports.items() if active and port in devices]
+        if console == "auto":
+            if self.remote:
+                messagebox.showwarning("Warning", "Select the console, carts of a server cannot be detected")
+                return
+            for port in ports:
+                self.jobs.submit("detect", self.detect_cart, port, self.var_consensus.get(), device=port)
+            return
+        if console not in self.dumpers:
+            messagebox.showwarning("Warning", "Dumping {} carts is not supported yet".format(console))
+            return
+        for port in ports:
+            self.submit_dump(console, port, self.var_consensus.get())
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  submit dump
+    #
+    #  start the dump job of one device, mapping is the detected mapping of the cart or None to find it out
+    # ------------------------------------------------------------------------------------------------------------------
+    def submit_dump(self, console, port, consensus=False, mapping=None):
+        try:
+            directory = os.path.expanduser(self.configfile.read("ROMDIRECTORIES", console))
+        except KeyError:
+            directory = "."
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(directory, "{}_{}.{}".format(
+            os.path.basename(port), time.strftime("%Y%m%d-%H%M%S"), console))
+        if self.remote:
+            self.jobs.submit("dump", self.dump_remote, console, port, filename, consensus, device=port)
+        else:
+            self.jobs.submit("dump", self.dump_cart, self.dumpers[console], console, port, filename, consensus,
+                             mapping, device=port)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  detect cart
+    #
+    #  probe the cart of a device for every console at once, the Tk thread picks the result up in poll_jobs
+    # ------------------------------------------------------------------------------------------------------------------
+    def detect_cart(self, job, port, consensus=False):
+        reader = ConsensusReader(self.umdv2, port) if consensus else None
+        detection = CartDetector().detect(self.umdv2, port, reader)
+        print("{} : {}".format(port, format_detection(detection)))
+        self.detections.put((port, detection, consensus))
+        return detection
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  dump detected
+    #
+    #  dump a detected cart, the operator confirms the console first when the detection is not confident
+    # ------------------------------------------------------------------------------------------------------------------
+    def dump_detected(self, port, detection, consensus):
+        console = detection["console"]
+        if console not in self.dumpers:
+            print("{} : dumping {} carts is not supported yet".format(port, console))
+            return
+        if not detection["confident"]:
+            question = "The cart on {} looks like {}.\nDump it as {}?".format(port, format_detection(detection),
+                                                                            console)
+            if not messagebox.askyesno("Detect Console", question):
+                print("{} : select the console and press 'Dump'".format(port))
+                return
+        self.submit_dump(console, port, consensus, detection["mapping"])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  dump cart
+    #
+    #  skip the full dump of a cart found in the fingerprint index once a spot check agrees, carts which are dumped
+    #  in full and verify are added to the index
+    # ------------------------------------------------------------------------------------------------------------------
+    def dump_cart(self, job, dumper, console, port, filename, consensus=False, mapping=None):
+        if self.fingerprints is not None:
+            verdict = self.fingerprints.known_dump(self.umdv2, port, console, filename)
+            if verdict is not None:
+                print("{} : known cart {}, spot check ok, md5 {}".format(filename, verdict["identified"],
+                                                                         verdict["md5"]))
+                return verdict
+        verdict = dumper(job, port, filename, consensus, mapping)
+        if self.fingerprints is not None and verdict.get("checksum_ok"):
+            self.fingerprints.add_file(console, filename, verify=False)
+            self.fingerprints.save()
+        return verdict
+
+    def dump_genesis(self, job, port, filename, consensus=False, mapping=None):
+        return self.report_dump(port, filename, consensus, lambda reader: genesis().dumpRom(
+            self.umdv2, port, stages=[FileWriterStage(filename)], job=job, consensus=reader, mapper=mapping))
+
+    def dump_sms(self, job, port, filename, consensus=False, mapping=None):
+        return self.report_dump(port, filename, consensus, lambda reader: sms().dumpRom(
+            self.umdv2, port, mapper=mapping or "sega", stages=[FileWriterStage(filename)], job=job,
+            consensus=reader))
+
+    def dump_tg16(self, job, port, filename, consensus=False, mapping=None):
+        bit_reversed = None if mapping is None else mapping == "reversed"
+        return self.report_dump(port, filename, consensus, lambda reader: tg16().dumpRom(
+            self.umdv2, port, stages=[FileWriterStage(filename)], job=job, consensus=reader, bitReversed=bit_reversed))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  dump remote
+    #
+    #  dump a cart of the server, the blocks are written to the file as they stream in. Cancelling the job closes
+    #  the connection, which stops the dump on the server.
+    # ------------------------------------------------------------------------------------------------------------------
+    def dump_remote(self, job, console, port, filename, consensus=False):
+        def progress(done):
+            job.progress(done, 0)
+            job.check()
+        with UMDClient(self.remote) as client, open(filename, "wb") as f:
+            try:
+                image, verdict = client.dump(port, console, sink=f, progress=progress, consensus=consensus)
+            except ServerError as e:
+                print("{} : {}".format(port, e))
+                return None
+        checksum = {True: "ok", False: "BAD", None: "n/a"}[verdict.get("checksum_ok")]
+        print("{} : {} bytes, checksum {}, md5 {}".format(filename, verdict["size"], checksum, verdict["md5"]))
+        if verdict.get("unresolved"):
+            print("{} : {} blocks without consensus".format(filename, len(verdict["unresolved"])))
+        return verdict
+
+    def report_dump(self, port, filename, consensus, dump):
+        reader = ConsensusReader(self.umdv2, port) if consensus else None
+        image, verdict = dump(reader)
+        checksum = {True: "ok", False: "BAD", None: "n/a"}[verdict.get("checksum_ok")]
+        print("{} : {} bytes, checksum {}, md5 {}".format(filename, verdict["size"], checksum, verdict["md5"]))
+        if reader is not None:
+            print(reader.report(), end="")
+        return verdict
 
     # ------------------------------------------------------------------------------------------------------------------
     #  select console
@@ -203,8 +554,9 @@ class AppUmd(Tk):
     #  select a local file
     # ------------------------------------------------------------------------------------------------------------------
     def calc_md5(self):
-        if self.load_filename is not None:
+        if self.load_image is not None:
             print("Calculating MD5 sum on {}".format(self.load_filename))
+            print(Cartridge(self.load_image).md5().hex())
         else:
             messagebox.showwarning("Warning", "You must load a ROM before performing this operation")
 
@@ -237,10 +589,14 @@ class AppUmd(Tk):
     #  load a ROM file, default to this console's ROM directory
     # ------------------------------------------------------------------------------------------------------------------
     def load_rom(self):
-        initial_directory = self.configfile.read("ROMDIRECTORIES", self.var_consoles.get())
+        initial_directory = self.configfile.read("ROMDIRECTORIES", self.var_consoles.get(), fallback=".")
         self.load_filename = filedialog.askopenfilename(initialdir=initial_directory)
         if(len(self.load_filename)) > 0:
             print(self.load_filename)
+            # map the ROM once, header, checksum and MD5 all work from the same image
+            if self.load_image is not None:
+                self.load_image.close()
+            self.load_image = RomImage(self.load_filename)
 
     # ------------------------------------------------------------------------------------------------------------------
     #  write
@@ -264,10 +620,48 @@ class AppUmd(Tk):
         command = self.entry_cmd.get()
         if self.configfile.read("COMMAND", "clear_entry_on_send") == "yes":
             self.entry_cmd.delete(0, END)
+        # statements may be separated by ';' to send a small script from the entry box, auto_append_lf "no" sends
+        # them without a line end
+        print("sending : " + command)
         if self.configfile.read("COMMAND", "auto_append_lf") == "yes":
-            print("sending : " + command)
+            self.run_script(command)
         else:
-            print("sending : " + command)
+            self.run_script(command, terminator="")
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  run_script_file
+    #
+    #  pick a command script and run it on the selected UMDv2
+    # ------------------------------------------------------------------------------------------------------------------
+    def run_script_file(self):
+        filename = filedialog.askopenfilename(title="Command script")
+        if len(filename) > 0:
+            with open(filename) as f:
+                self.run_script(f.read())
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #  run_script
+    #  \param text command script
+    #  \param terminator appended to every command
+    #
+    #  run a command script on every selected UMDv2 in a background thread, responses stream to the output pane
+    # ------------------------------------------------------------------------------------------------------------------
+    def run_script(self, text, terminator="\r\n"):
+        ports = [port for port, active in self.active_ports.items() if active and port in self.umdv2.port]
+        if len(ports) == 0:
+            print("no UMDv2 selected")
+            return
+
+        def callback(job, port):
+            try:
+                for count, (command, response) in enumerate(ScriptRunner(self.umdv2, port, terminator=terminator).run(text), 1):
+                    print(format_response(command, response), end='')
+                    job.progress(count)
+                    job.check()
+            except ScriptError as e:
+                print("script error : {}".format(e))
+        for port in ports:
+            self.jobs.submit("script", callback, port, device=port)
 
     # ------------------------------------------------------------------------------------------------------------------
     #  open preferences
@@ -296,21 +690,109 @@ class AppUmd(Tk):
     #
     #  Retrieve the ROM's manufacturer flash ID
     # ------------------------------------------------------------------------------------------------------------------
-    @staticmethod
-    def app_exit():
+    def app_exit(self):
+        self.jobs.shutdown()
+        self.pool.stop(close_ports=True)
+        if self.fingerprints is not None:
+            self.fingerprints.close()
         exit()
 
 
 class RedirectOutput(TextIOWrapper):
 
+    # text written from worker threads is queued, Tk widgets may only be touched from the main thread
     def __init__(self, txt_object):
         self.txt_output = txt_object
+        self.pending = queue.Queue()
+        self.main_thread = threading.current_thread()
 
     def write(self, string):
-        self.txt_output.configure(state="normal")
-        self.txt_output.insert(END, string)
-        self.txt_output.see(END)
-        self.txt_output.configure(state="disabled")
+        self.pending.put(string)
+        if threading.current_thread() is self.main_thread:
+            self.flush()
+
+    def flush(self):
+        chunks = []
+        while True:
+            try:
+                chunks.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        if chunks:
+            self.txt_output.configure(state="normal")
+            self.txt_output.insert(END, "".join(chunks))
+            self.txt_output.see(END)
+            self.txt_output.configure(state="disabled")
+
+
+# ------------------------------------------------------------------------------------------------------------------
+#  run_script_cli
+#
+#  run a command script without the GUI, on the given port or the first UMDv2 found
+# ------------------------------------------------------------------------------------------------------------------
+def run_script_cli(umdv2, args):
+    umdv2.connect(None)
+    port = args.port or next(iter(sorted(umdv2.port)), None)
+    if port not in umdv2.port:
+        print("no UMDv2 found" if port is None else "no UMDv2 on " + port)
+        return 1
+    with open(args.script) as f:
+        text = f.read()
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for command, response in ScriptRunner(umdv2, port).run(text):
+            output.write(format_response(command, response))
+    except ScriptError as e:
+        print("script error : {}".format(e))
+        return 1
+    finally:
+        if args.output:
+            output.close()
+        umdv2.disconnect()
+    return 0
+
+
+# ------------------------------------------------------------------------------------------------------------------
+#  attach_emulated
+#
+#  attach an emulated UMDv2 for every --emulate CONSOLE:ROM, named emu0, emu1...
+# ------------------------------------------------------------------------------------------------------------------
+def attach_emulated(umdv2, specs):
+    for number, spec in enumerate(specs):
+        console, filename = spec.split(":", 1)
+        rom = RomImage.load(filename).view().tobytes()
+        umdv2.attach_device("emu{}".format(number), EmulatedUMD(rom, console))
+
+
+# ------------------------------------------------------------------------------------------------------------------
+#  serve_cli
+#
+#  share the UMDv2 of this machine over a socket until interrupted
+# ------------------------------------------------------------------------------------------------------------------
+def serve_cli(umdv2, args):
+    umdv2.connect(None)
+    attach_emulated(umdv2, args.emulate)
+    server = UMDServer(umdv2, args.serve)
+    print("serving {} on {}".format(", ".join(sorted(umdv2.port)) or "no UMDv2", server.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        umdv2.disconnect()
+    return 0
+
+
+def compare_cli(args):
+    bus_width, bank_size = CONSOLE_BUS.get(args.console, (8, 0x4000))
+    try:
+        report = Cartridge(args.compare[0]).compare(*args.compare[1:], bus_width=bus_width, bank_size=bank_size)
+    except (OSError, ValueError) as e:
+        print("compare failed : {}".format(e))
+        return 1
+    print(report.format(), end="")
+    return 1 if report.error_bytes else 0
 
 
 # ------------------------------------------------------------------------------------------------------------------
@@ -320,21 +802,48 @@ class RedirectOutput(TextIOWrapper):
 # ------------------------------------------------------------------------------------------------------------------
 if __name__ == "__main__":
     # execute only if run as a script
+    parser = argparse.ArgumentParser(description="UMDv2 interface")
+    parser.add_argument("--script", help="run a command script without the GUI")
+    parser.add_argument("--port", help="serial port of the UMDv2 running the script")
+    parser.add_argument("--output", help="write script responses to this file instead of stdout")
+    parser.add_argument("--compare", nargs="+", metavar="DUMP", help="compare dumps of the same cart without the GUI")
+    parser.add_argument("--console", default="sms", choices=sorted(CONSOLE_BUS),
+                        help="bus width and bank size used by --compare")
+    parser.add_argument("--serve", nargs="?", const=DEFAULT_ADDRESS, metavar="ADDRESS",
+                        help="share the UMDv2 of this machine without the GUI, unix:PATH or HOST:PORT")
+    parser.add_argument("--server", nargs="?", const=DEFAULT_ADDRESS, metavar="ADDRESS",
+                        help="use the UMDv2 of a server instead of local ones")
+    parser.add_argument("--emulate", action="append", default=[], metavar="CONSOLE:ROM",
+                        help="add an emulated UMDv2 holding a ROM file, e.g. genesis:sonic.bin")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare_cli(args))
 
     # check for config file
     configfile = ConfigFile("umd.conf")
 
     # create umd
     timeout = float(configfile.read("UMD", "timeout"))
-    umdv2 = UMDv2(timeout)
-    app = AppUmd(configfile, umdv2)
+    umdv2 = UMDv2(timeout, configfile)
+
+    if args.serve:
+        sys.exit(serve_cli(umdv2, args))
+    if args.script:
+        sys.exit(run_script_cli(umdv2, args))
+    attach_emulated(umdv2, args.emulate)
+    app = AppUmd(configfile, umdv2, args.server)
 
     # redirect stdout to the console window in the GUI
     redirector = RedirectOutput(app.txt_output)
     sys.stdout = redirector
 
-    if configfile.read("UMD", "auto_connect_on_start") == "yes":
+    if args.server:
         app.connect_umd()
+    elif configfile.read("UMD", "auto_connect_on_start") == "yes":
+        app.pool.start()
+    app.poll_ports()
+    app.poll_jobs()
 
     app.mainloop()
 